@@ -0,0 +1,345 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Single file archive of TEDS images, read through mmap
+#
+# File layout, big endian:
+#   header   magic "TEDSARCH", version, flags (0), number of index entries, index offset
+#   images   TEDS data block images (as written by to_bytes), packed
+#   index    one entry per image: UUID, TEDS access code, flags, offset, length, checksum
+# The checksum is the one of the image once framed (see calc_image_checksum)
+# Appending writes the new images and a new index at the end of the file, then the header,
+# so the archive stays readable if an append is interrupted. The old index is left behind
+# as garbage until the archive is compacted. Removed entries are only flagged in the index.
+# When a UUID and access code are stored more than once, the last entry is the current one.
+#
+#   python teds_archive.py add fleet.tedsa batch/              Meta-TEDS use their own UUID
+#   python teds_archive.py add --uuid 0a1b... fleet.tedsa channel.bin   one image per access code
+#   python teds_archive.py list fleet.tedsa
+#   python teds_archive.py get fleet.tedsa 0a1b... --teds ChanTEDS -o channel.bin
+#   python teds_archive.py verify fleet.tedsa
+#   python teds_archive.py compact fleet.tedsa
+
+import argparse
+import mmap
+import os
+import sys
+from struct import Struct
+
+import numpy as np
+
+from teds_utils import TEDS_Data_Block, CHECKSUM_OCTETS, iter_tlv, calc_segment_sums, calc_image_checksum
+from teds_data_model import TEDS_ACCESS_CODES, get_teds_access_code, teds_data_block_from_bytes
+
+ARCHIVE_MAGIC = b"TEDSARCH"
+ARCHIVE_VERSION = 1
+
+# Magic, version, flags, number of index entries, index offset
+archive_header_struct = Struct(">8sHHIQ")
+# UUID, access code, flags, offset, length, checksum
+archive_entry_struct = Struct(">10sBBQIH")
+# The same entry, to view the whole index as a NumPy array without copying it
+ARCHIVE_ENTRY_DTYPE = np.dtype([("uuid", "S10"), ("access_code", "u1"), ("flags", "u1"),
+    ("offset", ">u8"), ("length", ">u4"), ("checksum", ">u2")])
+
+# Entry flags
+ENTRY_REMOVED = 0x01
+
+# TLV type and length of the TEDSID (UUID) field of a Meta-TEDS
+TEDSID_TYPE = 4
+UUID_OCTETS = 10
+
+# UUID of a Meta-TEDS image, read from its TEDSID TLV without decoding the image
+def find_image_uuid(image):
+    for field_type, field_length, seek in iter_tlv(image):
+        if field_type == TEDSID_TYPE and field_length == UUID_OCTETS:
+            return bytes(image[seek:seek+UUID_OCTETS])
+    raise ValueError("TEDS image has no UUID field, a UUID must be given.")
+
+def _uuid_bytes(uuid):
+    if isinstance(uuid, str):
+        uuid = bytes.fromhex(uuid)
+    uuid = bytes(uuid)
+    if len(uuid) != UUID_OCTETS:
+        raise ValueError("TEDS UUID: {}, should have {} octets.".format(uuid.hex(), UUID_OCTETS))
+    return uuid
+
+# Index key of an image: its UUID (the given one, or its own for a Meta-TEDS) and its access code
+def image_key(image, uuid=None):
+    return find_image_uuid(image) if uuid is None else _uuid_bytes(uuid), get_teds_access_code(image)
+
+class TEDS_Archive():
+
+    # Open an archive, mode "r" to read, "a" to read and append (created if it does not exist)
+    def __init__(self, path, mode="r"):
+        if mode not in ("r", "a"):
+            raise ValueError("TEDS archive mode: {}, should be r or a.".format(mode))
+        self.path = path
+        self.mode = mode
+        if mode == "a" and not os.path.exists(path):
+            with open(path, "wb") as fh:
+                fh.write(archive_header_struct.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, 0, 0, archive_header_struct.size))
+        self.file = open(path, "rb" if mode == "r" else "r+b")
+        self.mm = None
+        self.entries = None
+        # Memory maps replaced by an append while views of them were still in use
+        self.retired = []
+        self.lookup = None
+        self.map()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Map the file and view its index
+    def map(self):
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, flags, count, index_offset = archive_header_struct.unpack_from(self.mm, 0)
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError("TEDS archive: {}, not an archive.".format(self.path))
+        if version != ARCHIVE_VERSION:
+            raise ValueError("TEDS archive version: {}, not supported.".format(version))
+        if index_offset + count * ARCHIVE_ENTRY_DTYPE.itemsize > len(self.mm):
+            raise ValueError("TEDS archive: {}, truncated index.".format(self.path))
+        self.index_offset = index_offset
+        self.entries = np.frombuffer(self.mm, dtype=ARCHIVE_ENTRY_DTYPE, count=count, offset=index_offset)
+        self.lookup = None
+
+    def unmap(self):
+        self.entries = None
+        try:
+            self.mm.close()
+        except BufferError:
+            # Images handed out are still in use, the map is closed when they are released
+            self.retired.append(self.mm)
+        self.mm = None
+
+    def close(self):
+        if self.mm is not None:
+            self.unmap()
+        self.file.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Position of the current entry of each (UUID, access code), built on first lookup
+    def get_lookup(self):
+        if self.lookup is None:
+            self.lookup = {}
+            removed = (self.entries["flags"] & ENTRY_REMOVED) != 0
+            for index, (uuid, access_code) in enumerate(zip(self.entries["uuid"].tolist(),
+                    self.entries["access_code"].tolist())):
+                # NumPy strips trailing zero octets of the S10 field
+                key = (uuid.ljust(UUID_OCTETS, b"\0"), access_code)
+                if removed[index]:
+                    self.lookup.pop(key, None)
+                else:
+                    self.lookup[key] = index
+        return self.lookup
+
+    # Index entry position of an image, or None
+    def find(self, uuid, access_code=TEDS_ACCESS_CODES.MetaTEDS):
+        return self.get_lookup().get((_uuid_bytes(uuid), int(access_code)))
+
+    # The image of an index entry, a view of the mapped file (no copy)
+    # A view still in use when the archive is closed keeps the map open until it is released
+    def get_entry_image(self, index, verify=False):
+        entry = self.entries[index]
+        offset = int(entry["offset"])
+        image = memoryview(self.mm)[offset:offset + int(entry["length"])]
+        if verify and calc_image_checksum(image) != int(entry["checksum"]):
+            raise ValueError("TEDS archive entry {}, checksum does not match.".format(index))
+        return image
+
+    def get_image(self, uuid, access_code=TEDS_ACCESS_CODES.MetaTEDS, verify=False):
+        index = self.find(uuid, access_code)
+        if index is None:
+            raise KeyError("TEDS archive: no {} with UUID {}.".format(TEDS_ACCESS_CODES(access_code).name,
+                _uuid_bytes(uuid).hex()))
+        return self.get_entry_image(index, verify)
+
+    # Decode an archived TEDS, the decoder reads the mapped file directly
+    def load(self, uuid, access_code=TEDS_ACCESS_CODES.MetaTEDS, verify=False, lazy=False):
+        with self.get_image(uuid, access_code, verify) as image:
+            return teds_data_block_from_bytes(image, lazy)
+
+    # Append TEDS data blocks or images, with the UUID of each one
+    # A UUID can be omitted (None) for Meta-TEDS, their own UUID is used
+    # A UUID and access code can only be given once per append, a later entry would hide the earlier one
+    # Return the index entry positions of the appended images
+    def append(self, items, uuids=None):
+        if self.mode != "a":
+            raise ValueError("TEDS archive: {}, not opened for append.".format(self.path))
+        items = list(items)
+        if uuids is None:
+            uuids = [None] * len(items)
+        # Check all images before writing any of them
+        images = []
+        positions = {}
+        for position, (item, uuid) in enumerate(zip(items, uuids)):
+            image = bytes(item.to_bytes()) if isinstance(item, TEDS_Data_Block) else bytes(item)
+            uuid, access_code = image_key(image, uuid)
+            if (uuid, access_code) in positions:
+                raise ValueError("TEDS archive: images {} and {} are both {} with UUID {}, only one can be added.".format(
+                    positions[(uuid, access_code)], position, TEDS_ACCESS_CODES(access_code).name, uuid.hex()))
+            positions[(uuid, access_code)] = position
+            images.append((uuid, access_code, image))
+        new_entries = []
+        self.file.seek(0, os.SEEK_END)
+        offset = self.file.tell()
+        for uuid, access_code, image in images:
+            new_entries.append(archive_entry_struct.pack(uuid, access_code, 0, offset, len(image),
+                calc_image_checksum(image)))
+            self.file.write(image)
+            offset += len(image)
+        # New index after the new images: the old entries and the new ones
+        index_offset = offset
+        count = len(self.entries)
+        self.file.write(self.mm[self.index_offset:self.index_offset + count * ARCHIVE_ENTRY_DTYPE.itemsize])
+        self.file.write(b"".join(new_entries))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        # The header is written last, it switches to the new index
+        self.file.seek(0)
+        self.file.write(archive_header_struct.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION, 0, count + len(new_entries), index_offset))
+        self.file.flush()
+        self.unmap()
+        self.map()
+        return list(range(count, count + len(new_entries)))
+
+    # Flag the current entry of a UUID and access code as removed
+    def remove(self, uuid, access_code=TEDS_ACCESS_CODES.MetaTEDS):
+        if self.mode != "a":
+            raise ValueError("TEDS archive: {}, not opened for append.".format(self.path))
+        index = self.find(uuid, access_code)
+        if index is None:
+            raise KeyError("TEDS archive: no {} with UUID {}.".format(TEDS_ACCESS_CODES(access_code).name,
+                _uuid_bytes(uuid).hex()))
+        flags_offset = self.index_offset + index * ARCHIVE_ENTRY_DTYPE.itemsize + UUID_OCTETS + 1
+        self.file.seek(flags_offset)
+        self.file.write(bytes([int(self.entries[index]["flags"]) | ENTRY_REMOVED]))
+        self.file.flush()
+        self.unmap()
+        self.map()
+
+    # Index entry positions whose stored checksum does not match their image
+    def verify(self):
+        entries = self.entries
+        order = np.argsort(entries["offset"], kind="stable")
+        starts = entries["offset"][order].astype(np.int64)
+        lengths = entries["length"][order].astype(np.int64)
+        sums = calc_segment_sums(self.mm, starts, starts + lengths).astype(np.int64)
+        # Octets of the length prefix of the framed image
+        framed = lengths + CHECKSUM_OCTETS
+        sums += (framed >> 24 & 0xFF) + (framed >> 16 & 0xFF) + (framed >> 8 & 0xFF) + (framed & 0xFF)
+        checksums = 0xFFFF - sums % 0xFFFF
+        bad = checksums != entries["checksum"][order].astype(np.int64)
+        return sorted(order[bad].tolist())
+
+    # Rewrite the archive with the current entries only
+    def compact(self):
+        if self.mode != "a":
+            raise ValueError("TEDS archive: {}, not opened for append.".format(self.path))
+        current = sorted(self.get_lookup().values())
+        temp_path = self.path + ".compact"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        with TEDS_Archive(temp_path, "a") as compacted:
+            items = []
+            uuids = []
+            for index in current:
+                items.append(bytes(self.get_entry_image(index)))
+                uuids.append(self.entries[index]["uuid"].ljust(UUID_OCTETS, b"\0"))
+            compacted.append(items, uuids)
+        self.close()
+        os.replace(temp_path, self.path)
+        self.__init__(self.path, "a")
+
+# Command line
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Single file archive of TEDS images.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="append TEDS files (paths, globs or directories)")
+    add.add_argument("archive")
+    add.add_argument("paths", nargs="+")
+    add.add_argument("--uuid", help="UUID (hexadecimal) of the images, Meta-TEDS use their own if not given")
+    listing = commands.add_parser("list", help="list the current entries")
+    listing.add_argument("archive")
+    get = commands.add_parser("get", help="extract an image")
+    get.add_argument("archive")
+    get.add_argument("uuid")
+    get.add_argument("--teds", default="MetaTEDS", help="TEDS access code name (default MetaTEDS)")
+    get.add_argument("--output", "-o", required=True)
+    verify = commands.add_parser("verify", help="check the checksum of every image")
+    verify.add_argument("archive")
+    compact = commands.add_parser("compact", help="drop removed and replaced images")
+    compact.add_argument("archive")
+    options = parser.parse_args(argv)
+    try:
+        return run_command(options)
+    except (ValueError, KeyError, OSError) as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        return 1
+
+def run_command(options):
+    if options.command == "add":
+        # The CLI helpers read plain and checksummed files, with one or more images
+        from teds_cli import expand_paths, read_images
+        with TEDS_Archive(options.archive, "a") as archive:
+            images = []
+            sources = []
+            for path in expand_paths(options.paths, "*.bin"):
+                for index, image in enumerate(read_images(path)[1]):
+                    images.append(bytes(image))
+                    sources.append("{} image {}".format(path, index))
+            # Checked here too, to name the files of the images clashing
+            keys = {}
+            for image, source in zip(images, sources):
+                uuid, access_code = image_key(image, options.uuid)
+                if (uuid, access_code) in keys:
+                    raise ValueError("{} and {} are both {} with UUID {}, only one can be added.".format(
+                        keys[(uuid, access_code)], source, TEDS_ACCESS_CODES(access_code).name, uuid.hex()))
+                keys[(uuid, access_code)] = source
+            archive.append(images, [options.uuid] * len(images))
+            print("{} images added, {} entries.".format(len(images), len(archive)))
+    elif options.command == "list":
+        with TEDS_Archive(options.archive) as archive:
+            for index in sorted(archive.get_lookup().values()):
+                entry = archive.entries[index]
+                print("{} {:10} offset {} length {} checksum {:#06x}".format(
+                    entry["uuid"].ljust(UUID_OCTETS, b"\0").hex(), TEDS_ACCESS_CODES(entry["access_code"]).name,
+                    int(entry["offset"]), int(entry["length"]), int(entry["checksum"])))
+    elif options.command == "get":
+        with TEDS_Archive(options.archive) as archive:
+            with archive.get_image(options.uuid, TEDS_ACCESS_CODES[options.teds], verify=True) as image:
+                with open(options.output, "wb") as fh:
+                    fh.write(image)
+    elif options.command == "verify":
+        with TEDS_Archive(options.archive) as archive:
+            bad = archive.verify()
+            for index in bad:
+                print("Entry {}, checksum does not match.".format(index), file=sys.stderr)
+            print("{} entries, {} bad.".format(len(archive), len(bad)))
+            return 1 if bad else 0
+    elif options.command == "compact":
+        with TEDS_Archive(options.archive, "a") as archive:
+            before = os.path.getsize(options.archive)
+            archive.compact()
+            print("{} -> {} octets, {} entries.".format(before, os.path.getsize(options.archive), len(archive)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
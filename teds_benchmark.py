@@ -0,0 +1,365 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Benchmarks of the TEDS model: construction, encode and decode, nested blocks, framing and
+# checksums, and the population of the editor tables (offscreen, only if PyQt5 is installed)
+# Each benchmark reports latency percentiles, throughput and peak memory
+#
+#   python teds_benchmark.py                                 run all benchmarks
+#   python teds_benchmark.py --filter decode --repeat 50     run the decode benchmarks
+#   python teds_benchmark.py --save-baseline baseline.json   store the results as a baseline
+#   python teds_benchmark.py --baseline baseline.json        fail if a median latency regressed
+#                                                            more than --threshold (default 15 %)
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+import numpy as np
+
+from teds_utils import TEDS_Data_Block, infer_conversion_functions, calc_checksum, find_checksummed_offsets, \
+    verify_checksummed_images
+from teds_data_model import Meta_TEDS_Data_Block, TransducerChannel_TEDS_Data_Block, UNITS_TEDS_Data_Block
+from teds_stream import FRAMING_PLAIN, iter_teds_blocks
+
+# Images of the bulk benchmarks
+BULK_SIZE = 1000
+# Minimum duration of a timed sample, the operation is repeated until it is reached
+MIN_SAMPLE_TIME = 0.002
+DEFAULT_REPEAT = 30
+DEFAULT_THRESHOLD = 0.15
+
+# Registered benchmarks: name -> setup function
+# A setup function prepares the data and returns the operation to time and the items it processes
+BENCHMARKS = {}
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+# Mark a block and all its nested blocks as changed, so the next encoding does not use any cache
+def invalidate(teds_data_block):
+    for field in teds_data_block.fields:
+        value = getattr(field, "value", None)
+        if isinstance(value, TEDS_Data_Block):
+            invalidate(value)
+    teds_data_block.mark_dirty()
+
+def full_encode(teds_data_block):
+    invalidate(teds_data_block)
+    return teds_data_block.to_bytes()
+
+# Construction
+
+@benchmark("construct.meta")
+def setup_construct_meta():
+    return Meta_TEDS_Data_Block, 1
+
+@benchmark("construct.channel")
+def setup_construct_channel():
+    return TransducerChannel_TEDS_Data_Block, 1
+
+@benchmark("construct.channel.prototype")
+def setup_construct_channel_prototype():
+    TransducerChannel_TEDS_Data_Block.get_prototype()
+    return TransducerChannel_TEDS_Data_Block.create, 1
+
+# Conversion functions of a field definition, the field schemas are interned so they are
+# only inferred once per definition, this times the inference itself
+class _Conversion_Probe():
+
+    def __init__(self, data_type, n_octets):
+        self.data_type = data_type
+        self.n_octets = n_octets
+
+    def get_value_length(self):
+        return self.n_octets
+
+@benchmark("codec.infer_conversion_functions")
+def setup_infer_conversion_functions():
+    probes = [_Conversion_Probe(field.data_type, field.get_value_length())
+        for field in TransducerChannel_TEDS_Data_Block().fields[1:] if field.codec is not None]
+    def run():
+        for probe in probes:
+            infer_conversion_functions(probe)
+    return run, len(probes)
+
+# Encode and decode
+
+@benchmark("encode.meta")
+def setup_encode_meta():
+    teds_data_block = Meta_TEDS_Data_Block()
+    return lambda: full_encode(teds_data_block), 1
+
+@benchmark("encode.channel")
+def setup_encode_channel():
+    teds_data_block = TransducerChannel_TEDS_Data_Block()
+    return lambda: full_encode(teds_data_block), 1
+
+@benchmark("encode.channel.cached")
+def setup_encode_channel_cached():
+    teds_data_block = TransducerChannel_TEDS_Data_Block()
+    return teds_data_block.to_bytes, 1
+
+@benchmark("decode.meta")
+def setup_decode_meta():
+    image = bytes(Meta_TEDS_Data_Block().to_bytes())
+    teds_data_block = Meta_TEDS_Data_Block()
+    return lambda: teds_data_block.load_from_bytearray(image), 1
+
+@benchmark("decode.channel")
+def setup_decode_channel():
+    image = bytes(TransducerChannel_TEDS_Data_Block().to_bytes())
+    teds_data_block = TransducerChannel_TEDS_Data_Block()
+    return lambda: teds_data_block.load_from_bytearray(image), 1
+
+@benchmark("decode.channel.lazy")
+def setup_decode_channel_lazy():
+    image = bytes(TransducerChannel_TEDS_Data_Block().to_bytes())
+    teds_data_block = TransducerChannel_TEDS_Data_Block()
+    return lambda: teds_data_block.load_from_bytearray(image, lazy=True), 1
+
+# Nested blocks
+
+@benchmark("nested.units.encode")
+def setup_nested_units_encode():
+    teds_data_block = UNITS_TEDS_Data_Block()
+    for field in teds_data_block.fields:
+        field.include = True
+    return lambda: full_encode(teds_data_block), 1
+
+@benchmark("nested.units.decode")
+def setup_nested_units_decode():
+    teds_data_block = UNITS_TEDS_Data_Block()
+    for field in teds_data_block.fields:
+        field.include = True
+    image = bytes(teds_data_block.to_bytes())
+    return lambda: teds_data_block.load_from_bytearray(image), 1
+
+# Bulk
+
+def channel_blocks(count):
+    prototype = TransducerChannel_TEDS_Data_Block()
+    return [prototype.clone() for _ in range(count)]
+
+@benchmark("bulk.encode.channel")
+def setup_bulk_encode_channel():
+    blocks = channel_blocks(BULK_SIZE)
+    def run():
+        for teds_data_block in blocks:
+            full_encode(teds_data_block)
+    return run, BULK_SIZE
+
+@benchmark("bulk.decode.channel")
+def setup_bulk_decode_channel():
+    stream = b"".join(bytes(teds_data_block.to_bytes()) for teds_data_block in channel_blocks(BULK_SIZE))
+    def run():
+        for teds_data_block in iter_teds_blocks(BytesIO(stream), FRAMING_PLAIN):
+            pass
+    return run, BULK_SIZE
+
+# Framing and checksums
+
+@benchmark("framing.channel.encode")
+def setup_framing_channel_encode():
+    teds_data_block = TransducerChannel_TEDS_Data_Block()
+    def run():
+        invalidate(teds_data_block)
+        teds_data_block.to_bytes_with_length_and_checksum()
+    return run, 1
+
+@benchmark("framing.channel.decode")
+def setup_framing_channel_decode():
+    image = bytes(TransducerChannel_TEDS_Data_Block().to_bytes_with_length_and_checksum())
+    teds_data_block = TransducerChannel_TEDS_Data_Block()
+    return lambda: teds_data_block.load_from_bytearray_with_length_and_checksum(image), 1
+
+@benchmark("checksum.channel")
+def setup_checksum_channel():
+    image = bytes(TransducerChannel_TEDS_Data_Block().to_bytes())
+    return lambda: calc_checksum(image), 1
+
+@benchmark("checksum.bulk.verify")
+def setup_checksum_bulk_verify():
+    stream = b"".join(bytes(teds_data_block.to_bytes_with_length_and_checksum())
+        for teds_data_block in channel_blocks(BULK_SIZE))
+    def run():
+        verify_checksummed_images(stream, find_checksummed_offsets(stream))
+    return run, BULK_SIZE
+
+# Editor tables, rendered offscreen
+
+_qt_application = None
+
+def load_gui():
+    global _qt_application
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    try:
+        from PyQt5 import QtWidgets
+    except ImportError:
+        return None
+    import teds_table_model
+    if _qt_application is None:
+        _qt_application = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    return QtWidgets, teds_table_model
+
+def setup_gui_table(block_class):
+    gui = load_gui()
+    if gui is None:
+        return None
+    QtWidgets, teds_table_model = gui
+    teds_data_block = block_class()
+    def run():
+        table = QtWidgets.QTableView()
+        teds_table_model.setup_teds_table_view(table, teds_data_block)
+        # The view only reads the fields when painting the rows
+        table.grab()
+        table.deleteLater()
+        _qt_application.processEvents()
+    return run, 1
+
+@benchmark("gui.meta.table")
+def setup_gui_meta_table():
+    return setup_gui_table(Meta_TEDS_Data_Block)
+
+@benchmark("gui.channel.table")
+def setup_gui_channel_table():
+    return setup_gui_table(TransducerChannel_TEDS_Data_Block)
+
+# Runner
+
+# Number of operations in a sample, so each sample lasts at least MIN_SAMPLE_TIME
+def calibrate(operation):
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            operation()
+        if time.perf_counter() - start >= MIN_SAMPLE_TIME:
+            return number
+        number *= 2
+
+# Peak memory allocated by one operation, in octets
+def measure_peak_memory(operation):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        operation()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_benchmark(name, repeat):
+    prepared = BENCHMARKS[name]()
+    if prepared is None:
+        return None
+    operation, items = prepared
+    # Warm up caches (codec plans, prototypes) before timing
+    operation()
+    number = calibrate(operation)
+    samples = np.empty(repeat)
+    gc.collect()
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for index in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                operation()
+            samples[index] = (time.perf_counter() - start) / number
+    finally:
+        if gc_enabled:
+            gc.enable()
+    p50, p90, p99 = np.percentile(samples, [50, 90, 99])
+    return {
+        "items": items,
+        "p50_us": p50 * 1e6,
+        "p90_us": p90 * 1e6,
+        "p99_us": p99 * 1e6,
+        "items_per_s": items / p50,
+        "peak_kib": measure_peak_memory(operation) / 1024,
+    }
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+    }
+
+def print_results(results):
+    print("{:34} {:>11} {:>11} {:>11} {:>13} {:>10}".format("benchmark", "p50 us", "p90 us", "p99 us", "items/s", "peak KiB"))
+    for name, result in results.items():
+        if result is None:
+            print("{:34} skipped".format(name))
+            continue
+        print("{:34} {:11.2f} {:11.2f} {:11.2f} {:13.0f} {:10.1f}".format(name, result["p50_us"], result["p90_us"],
+            result["p99_us"], result["items_per_s"], result["peak_kib"]))
+
+# Benchmarks whose median latency grew more than the threshold over the baseline
+def find_regressions(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        reference = baseline["results"].get(name)
+        if result is None or reference is None:
+            continue
+        ratio = result["p50_us"] / reference["p50_us"]
+        if ratio > 1 + threshold:
+            regressions.append((name, reference["p50_us"], result["p50_us"], ratio))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the TEDS model, codecs and editor tables.")
+    parser.add_argument("--filter", "-k", default="", help="only run the benchmarks whose name contains it")
+    parser.add_argument("--repeat", "-r", type=int, default=DEFAULT_REPEAT, help="timed samples per benchmark")
+    parser.add_argument("--save-baseline", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with the results in this JSON file")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+        help="allowed median latency increase over the baseline (0.15 is 15 %%)")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks")
+    options = parser.parse_args(argv)
+    names = [name for name in BENCHMARKS if options.filter in name]
+    if options.list:
+        print("\n".join(names))
+        return 0
+    results = {}
+    for name in names:
+        results[name] = run_benchmark(name, options.repeat)
+    print_results(results)
+    if options.save_baseline:
+        with open(options.save_baseline, "w") as fh:
+            json.dump({"environment": environment(), "repeat": options.repeat, "results": results}, fh, indent=2)
+    if options.baseline:
+        with open(options.baseline) as fh:
+            baseline = json.load(fh)
+        if baseline.get("environment") != environment():
+            print("Warning: the baseline was recorded on a different environment.", file=sys.stderr)
+        regressions = find_regressions(results, baseline, options.threshold)
+        for name, reference, current, ratio in regressions:
+            print("Regression: {}, p50 {:.2f} us -> {:.2f} us (x{:.2f})".format(name, reference, current, ratio),
+                file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# NCAP side cache of TEDS, by TIM UUID, TransducerChannel number and TEDS access code
+# Each entry keeps the decoded data block and the TEDS as stored in the TIM (length prefix,
+# data block, checksum). Entries are fresh for ttl seconds; a stale entry is revalidated with a
+# Query TEDS, whose reply holds the TEDS size and checksum: if they match the length prefix and
+# checksum of the cached TEDS, the entry is fresh again, else the TEDS is fetched again.
+# The checksum is a sum of the octets: a change keeping the size and the octet sum (e.g. two
+# octets swapped) is not seen, the NCAP should invalidate the TEDS it writes itself.
+# The least recently used entries are dropped when the cache holds too many entries or octets.
+# Cached data blocks are shared by all callers and must not be changed.
+
+import asyncio
+import collections
+import time
+
+from teds_utils import LENGTH_OCTETS, CHECKSUM_OCTETS, length_struct, checksum_struct
+from teds_data_model import TEDS_ACCESS_CODES, Meta_TEDS_Data_Block, TransducerChannel_TEDS_Data_Block
+
+DEFAULT_TTL = 60.0
+DEFAULT_MAX_ENTRIES = 100000
+DEFAULT_MAX_OCTETS = 64 << 20
+
+# Data block class of each TEDS access code, TEDS of other access codes are only kept as octets
+CACHE_BLOCK_CLASSES = {
+    TEDS_ACCESS_CODES.MetaTEDS: Meta_TEDS_Data_Block,
+    TEDS_ACCESS_CODES.ChanTEDS: TransducerChannel_TEDS_Data_Block,
+}
+
+class TEDS_Cache_Entry():
+
+    def __init__(self, teds_data_block, image, validated):
+        self.teds_data_block = teds_data_block
+        self.image = image
+        # Time of the last fetch or revalidation
+        self.validated = validated
+
+    # Length prefix and checksum of the cached TEDS
+    def get_trailer(self):
+        return length_struct.unpack_from(self.image, 0)[0], checksum_struct.unpack_from(self.image,
+            len(self.image) - CHECKSUM_OCTETS)[0]
+
+class TEDS_Cache():
+
+    # client fetches the TEDS, see teds_client.TEDS_Client
+    # clock returns the time in seconds, for the ttl
+    def __init__(self, client=None, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, max_octets=DEFAULT_MAX_OCTETS,
+            clock=time.monotonic):
+        self.client = client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_octets = max_octets
+        self.clock = clock
+        # Least recently used first
+        self.entries = collections.OrderedDict()
+        self.octets = 0
+        # Fetches in progress by key, so concurrent misses of a TEDS fetch it once
+        self.fetching = {}
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.refetches = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    # Cache key, the UUID as 10 octets
+    @staticmethod
+    def make_key(tim_uuid, channel, access_code):
+        return bytes(tim_uuid), int(channel), int(access_code)
+
+    # Store a TEDS, given as a data block or as stored in the TIM (with length prefix and checksum)
+    def put(self, key, teds_data_block=None, image=None):
+        if image is None:
+            image = bytes(teds_data_block.to_bytes_with_length_and_checksum())
+        elif teds_data_block is None:
+            teds_data_block = self.decode(key, image)
+        self._store(key, TEDS_Cache_Entry(teds_data_block, bytes(image), self.clock()))
+
+    def _store(self, key, entry):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.octets -= len(old.image)
+        self.entries[key] = entry
+        self.octets += len(entry.image)
+        while len(self.entries) > self.max_entries or (self.octets > self.max_octets and len(self.entries) > 1):
+            self.octets -= len(self.entries.popitem(last=False)[1].image)
+
+    # Cached entry of a key, whether fresh or not, None if not cached
+    def get_entry(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def is_fresh(self, entry):
+        return self.clock() - entry.validated < self.ttl
+
+    # Cached data block if it is fresh, else None, the TIM is not contacted
+    def get(self, key):
+        entry = self.get_entry(key)
+        if entry is None or not self.is_fresh(entry):
+            return None
+        self.hits += 1
+        return entry.teds_data_block
+
+    def invalidate(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.octets -= len(entry.image)
+
+    # Drop all the TEDS of a TIM
+    def invalidate_tim(self, tim_uuid):
+        tim_uuid = bytes(tim_uuid)
+        for key in [key for key in self.entries if key[0] == tim_uuid]:
+            self.invalidate(key)
+
+    def clear(self):
+        self.entries.clear()
+        self.octets = 0
+
+    # Data block of a TEDS as stored in the TIM, None for access codes without a data block class
+    def decode(self, key, image):
+        block_class = CACHE_BLOCK_CLASSES.get(key[2])
+        if block_class is None:
+            return None
+        teds_data_block = block_class.create()
+        teds_data_block.load_from_bytearray(memoryview(image)[LENGTH_OCTETS:len(image) - CHECKSUM_OCTETS])
+        return teds_data_block
+
+    # Data block of a TEDS of the TIM at endpoint, from the cache when it is fresh or still valid
+    async def get_teds(self, endpoint, tim_uuid, channel, access_code):
+        key = self.make_key(tim_uuid, channel, access_code)
+        entry = self.get_entry(key)
+        if entry is not None and self.is_fresh(entry):
+            self.hits += 1
+            return entry.teds_data_block
+        task = self.fetching.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._refresh(endpoint, key, entry))
+            self.fetching[key] = task
+        return (await asyncio.shield(task)).teds_data_block
+
+    async def _refresh(self, endpoint, key, entry):
+        try:
+            if entry is not None:
+                self.revalidations += 1
+                size, checksum, max_segment = await self.client.query_teds(endpoint, key[1], key[2])
+                length, cached_checksum = entry.get_trailer()
+                if size == length + LENGTH_OCTETS and checksum == cached_checksum:
+                    entry.validated = self.clock()
+                    self.hits += 1
+                    return entry
+                self.refetches += 1
+            else:
+                self.misses += 1
+            image = bytes(await self.client.fetch_image(endpoint, key[1], key[2]))
+            entry = TEDS_Cache_Entry(self.decode(key, image), image, self.clock())
+            self._store(key, entry)
+            return entry
+        finally:
+            del self.fetching[key]
+
+    # Share of the requests answered from the cache, fresh or revalidated
+    def get_hit_ratio(self):
+        requests = self.hits + self.misses + self.refetches
+        return self.hits / requests if requests else 0.0
@@ -0,0 +1,303 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Headless command line front end to process batches of TEDS files, without the GUI (no PyQt)
+# Files are given as paths, globs or directories, and processed in parallel by a process pool
+#
+#   python teds_cli.py decode --format json --output-dir out/ "batch/*.bin"
+#   python teds_cli.py encode --checksummed teds.json
+#   python teds_cli.py frame --in-place batch/
+#   python teds_cli.py verify batch/
+#   python teds_cli.py uuid --output-dir out/ batch/
+#   python teds_cli.py validate --jobs 8 --chunksize 64 batch/
+
+import argparse
+import glob
+import json
+import os
+import sys
+from io import BytesIO
+from functools import partial
+
+from teds_utils import TEDS_Data_Block, LENGTH_OCTETS, CHECKSUM_OCTETS, length_struct, checksum_struct, calc_checksum
+from teds_stream import FRAMING_PLAIN, FRAMING_CHECKSUMMED, detect_framing, iter_teds_images
+from teds_data_model import TEDS_ACCESS_CODES, TEDS_Identifier_Structure, Meta_TEDS_Data_Block, \
+    teds_data_block_from_bytes, teds_data_block_to_dict, teds_data_block_from_dict
+
+BIN_PATTERN = "*.bin"
+JSON_PATTERN = "*.json"
+
+# Files processed by each worker task
+DEFAULT_CHUNKSIZE = 16
+
+# Expand paths, globs and directories (searched recursively for the pattern) to a list of files
+def expand_paths(paths, pattern):
+    return [match for match, name in expand_paths_with_names(paths, pattern)]
+
+# Same, each file with its name relative to the path it was found from
+# (the directory, or the part of the glob before the first wildcard)
+def expand_paths_with_names(paths, pattern):
+    files = []
+    seen = set()
+    for path in paths:
+        if os.path.isdir(path):
+            root = path
+            matches = sorted(glob.glob(os.path.join(path, "**", pattern), recursive=True))
+        elif glob.has_magic(path):
+            root = os.path.dirname(path)
+            while glob.has_magic(root):
+                root = os.path.dirname(root)
+            matches = sorted(glob.glob(path, recursive=True))
+        else:
+            root = os.path.dirname(path)
+            matches = [path]
+        for match in matches:
+            if match not in seen:
+                seen.add(match)
+                files.append((match, os.path.relpath(match, root or os.curdir)))
+    return files
+
+# Read the TEDS images of a file, return the file framing and the data block octets of each image
+# The checksums of checksummed images are verified
+def read_images(path):
+    with open(path, "rb") as fh:
+        data = fh.read()
+    framing = detect_framing(data)
+    return framing, list(iter_teds_images(BytesIO(data), framing))
+
+# Add the length prefix and checksum to a TEDS data block image
+def frame_image(image):
+    barray = bytearray(LENGTH_OCTETS + len(image) + CHECKSUM_OCTETS)
+    length_struct.pack_into(barray, 0, len(image) + CHECKSUM_OCTETS)
+    barray[LENGTH_OCTETS:LENGTH_OCTETS + len(image)] = image
+    checksum_struct.pack_into(barray, LENGTH_OCTETS + len(image), calc_checksum(barray[:LENGTH_OCTETS + len(image)]))
+    return barray
+
+def write_images(path, images, framing):
+    with open(path, "wb") as fh:
+        for image in images:
+            fh.write(frame_image(image) if framing == FRAMING_CHECKSUMMED else image)
+
+# Extension of the files written by a command, None to keep the one of the input file
+def output_extension(options):
+    if options.command == "decode":
+        return ".json" if options.format == "json" else ".txt"
+    if options.command == "encode":
+        return ".bin"
+    return None
+
+# Path of the file written for an input file, in the output directory or in place
+# In the output directory, the input path relative to the directory or glob it was found from is kept
+def output_path(options, path):
+    extension = output_extension(options)
+    if options.output_dir:
+        name = options.output_names.get(path, os.path.basename(path))
+        if extension is not None:
+            name = os.path.splitext(name)[0] + extension
+        return os.path.join(options.output_dir, name)
+    if extension is None and not options.in_place:
+        raise ValueError("no --output-dir given, use --in-place to rewrite the file.")
+    name = os.path.basename(path)
+    if extension is not None:
+        name = os.path.splitext(name)[0] + extension
+    return os.path.join(os.path.dirname(path), name)
+
+# Input files that would be written to the same output file, as pairs of paths
+def output_clashes(options, paths):
+    clashes = []
+    outputs = {}
+    for path in paths:
+        out = os.path.normcase(os.path.normpath(output_path(options, path)))
+        if out in outputs:
+            clashes.append((outputs[out], path))
+        else:
+            outputs[out] = path
+    return clashes
+
+# Text listing of the included fields of a TEDS data block, nested blocks indented
+def block_to_text(teds_data_block, indent=""):
+    lines = []
+    for field in teds_data_block.fields:
+        if isinstance(field, TEDS_Identifier_Structure):
+            lines.append("{}{} = {} (family {}, version {}, tuple length {})".format(indent, field.name,
+                TEDS_ACCESS_CODES(field.teds_class).name, field.family, field.version, field.tuple_length))
+            continue
+        if field.optional and field.include == False:
+            continue
+        value = field.get_value()
+        if isinstance(value, TEDS_Data_Block):
+            lines.append("{}{}: {}".format(indent, field.name, field.description))
+            lines.extend(block_to_text(value, indent + "  "))
+            continue
+        value_string = field.get_value_as_string()
+        if field.enum is not None:
+            try:
+                value_string = "{} {}".format(int(value), field.enum(value).name)
+            except ValueError:
+                pass
+        lines.append("{}{} = {} ({})".format(indent, field.name, value_string, field.description))
+    for tlv in teds_data_block.unknown_tlvs:
+        lines.append("{}Unknown TLV = {}".format(indent, bytes(tlv).hex()))
+    return lines
+
+# Operations, each one processes a file and returns a message, or raises an error
+
+def decode_file(options, path):
+    framing, images = read_images(path)
+    blocks = [teds_data_block_from_bytes(image) for image in images]
+    if options.format == "json":
+        values = [teds_data_block_to_dict(teds_data_block) for teds_data_block in blocks]
+        text = json.dumps(values[0] if len(values) == 1 else values, indent=2) + "\n"
+    else:
+        text = ""
+        for index, teds_data_block in enumerate(blocks):
+            text += "# {} image {} ({})\n".format(path, index, framing)
+            text += "\n".join(block_to_text(teds_data_block)) + "\n"
+    if options.output_dir:
+        out = output_path(options, path)
+        with open(out, "w") as fh:
+            fh.write(text)
+        return "{} -> {}".format(path, out)
+    return text.rstrip("\n")
+
+def encode_file(options, path):
+    with open(path) as fh:
+        values = json.load(fh)
+    if isinstance(values, dict):
+        values = [values]
+    images = [teds_data_block_from_dict(item).to_bytes() for item in values]
+    out = output_path(options, path)
+    write_images(out, images, FRAMING_CHECKSUMMED if options.checksummed else FRAMING_PLAIN)
+    return "{} -> {}".format(path, out)
+
+def frame_file(options, path):
+    framing, images = read_images(path)
+    out = output_path(options, path)
+    write_images(out, images, FRAMING_PLAIN if options.remove else FRAMING_CHECKSUMMED)
+    return "{} -> {}".format(path, out)
+
+def verify_file(options, path):
+    framing, images = read_images(path)
+    if framing != FRAMING_CHECKSUMMED:
+        raise ValueError("file has no length and checksum framing.")
+    return "{}: {} images, checksums ok".format(path, len(images))
+
+def uuid_file(options, path):
+    framing, images = read_images(path)
+    count = 0
+    for index, image in enumerate(images):
+        teds_data_block = teds_data_block_from_bytes(image, lazy=True)
+        if isinstance(teds_data_block, Meta_TEDS_Data_Block):
+            teds_data_block.regenerate_uuid()
+            images[index] = teds_data_block.to_bytes()
+            count += 1
+    if not count:
+        return "{}: no Meta-TEDS image, unchanged".format(path)
+    out = output_path(options, path)
+    write_images(out, images, framing)
+    return "{} -> {}: {} UUIDs".format(path, out, count)
+
+def validate_file(options, path):
+    framing, images = read_images(path)
+    for index, image in enumerate(images):
+        encoded = teds_data_block_from_bytes(image).to_bytes()
+        if encoded != image:
+            offset = next((i for i, (a, b) in enumerate(zip(encoded, image)) if a != b), min(len(encoded), len(image)))
+            raise ValueError("image {}, re-encoded image differs at offset {}.".format(index, offset))
+    return "{}: {} images ({}), valid".format(path, len(images), framing)
+
+# Run an operation on a file, errors are returned instead of raised so the batch goes on
+def run_operation(operation, options, path):
+    try:
+        return path, True, operation(options, path)
+    except Exception as e:
+        return path, False, "{}: {}".format(path, e)
+
+OPERATIONS = {
+    "decode": (decode_file, BIN_PATTERN, "Decode TEDS files to text or JSON"),
+    "encode": (encode_file, JSON_PATTERN, "Encode TEDS files from JSON"),
+    "frame": (frame_file, BIN_PATTERN, "Add (or remove) the length and checksum framing"),
+    "verify": (verify_file, BIN_PATTERN, "Verify the length and checksum framing"),
+    "uuid": (uuid_file, BIN_PATTERN, "Regenerate the UUID of Meta-TEDS files"),
+    "validate": (validate_file, BIN_PATTERN, "Decode and re-encode TEDS files, check they match"),
+}
+
+# Commands writing a file for each input file
+WRITING_COMMANDS = ("decode", "encode", "frame", "uuid")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Process IEEE 1451.0 TEDS files without the editor GUI.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, (operation, pattern, description) in OPERATIONS.items():
+        command = commands.add_parser(name, help=description, description=description)
+        command.add_argument("paths", nargs="+", help="files, globs or directories (searched for {})".format(pattern))
+        command.add_argument("--jobs", "-j", type=int, default=os.cpu_count(), help="worker processes")
+        command.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="files per worker task")
+        command.add_argument("--output-dir", "-o", help="directory of the written files")
+        if name in ("frame", "uuid"):
+            command.add_argument("--in-place", action="store_true", help="rewrite the input files")
+        if name == "decode":
+            command.add_argument("--format", choices=("text", "json"), default="text")
+        if name == "encode":
+            command.add_argument("--checksummed", action="store_true", help="write length and checksum framing")
+        if name == "frame":
+            command.add_argument("--remove", action="store_true", help="write plain images instead")
+    return parser
+
+def main(argv=None):
+    options = build_parser().parse_args(argv)
+    operation, pattern, description = OPERATIONS[options.command]
+    files = expand_paths_with_names(options.paths, pattern)
+    paths = [path for path, name in files]
+    if not paths:
+        print("No files found.", file=sys.stderr)
+        return 2
+    options.output_names = dict(files)
+    if options.output_dir and options.command in WRITING_COMMANDS:
+        clashes = output_clashes(options, paths)
+        for first, second in clashes:
+            print("{} and {} would be written to the same file: {}".format(first, second, output_path(options, second)),
+                file=sys.stderr)
+        if clashes:
+            return 2
+        for directory in sorted({os.path.dirname(output_path(options, path)) for path in paths}):
+            os.makedirs(directory, exist_ok=True)
+    task = partial(run_operation, operation, options)
+    failures = 0
+    if options.jobs <= 1 or len(paths) == 1:
+        results = map(task, paths)
+        failures = report(results)
+    else:
+        # The process pool (and multiprocessing) is only imported for parallel runs
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=options.jobs) as executor:
+            failures = report(executor.map(task, paths, chunksize=max(1, options.chunksize)))
+    if failures:
+        print("{} of {} files failed.".format(failures, len(paths)), file=sys.stderr)
+        return 1
+    return 0
+
+# Print the results in the order of the files, return the number of failures
+def report(results):
+    failures = 0
+    for path, ok, message in results:
+        if ok:
+            if message:
+                print(message)
+        else:
+            failures += 1
+            print(message, file=sys.stderr)
+    return failures
+
+if __name__ == "__main__":
+    sys.exit(main())
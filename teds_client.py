@@ -0,0 +1,349 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# NCAP side client fetching TEDS from TIMs with the commands of teds_protocol
+# One connection per TIM is kept open in a pool and shared by all requests to that TIM.
+# Commands are sent without waiting for the replies of the previous ones (pipelining), the
+# replies are matched to the commands by their order. The octets of a TEDS segment are received
+# straight into the buffer of the TEDS, which is then decoded in place.
+#
+#   python teds_client.py --endpoints tims.txt --concurrency 256 --timeout 5
+#   python teds_client.py 127.0.0.1:15000 unix:/tmp/tims/tim_00000.sock
+
+import argparse
+import asyncio
+import collections
+import sys
+import time
+
+from teds_utils import LENGTH_OCTETS, CHECKSUM_OCTETS, check_length_and_checksum
+from teds_data_model import TEDS_ACCESS_CODES, Meta_TEDS_Data_Block, TransducerChannel_TEDS_Data_Block
+from teds_tim import TEDS_TIM
+from teds_protocol import reply_struct, query_args_struct, query_reply_struct, read_args_struct, \
+    read_reply_struct, COMMON_CMD_FUNCTIONS, REPLY_SUCCESS, TIM_CHANNEL, pack_command, connect_endpoint
+
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_CONCURRENCY = 256
+# Segment reads of one TEDS sent before waiting for their replies
+DEFAULT_WINDOW = 16
+DEFAULT_MAX_CONNECTIONS = 4096
+
+# Replies shorter than this are received in the protocol buffer and copied, longer segment
+# replies are received straight into the TEDS buffer
+DIRECT_RECEIVE_OCTETS = 256
+
+# Receives the replies of a TIM connection, in command order
+# Each pending command has a future and, for segment reads, the buffer slice of the segment
+class TEDS_Client_Protocol(asyncio.BufferedProtocol):
+
+    def __init__(self):
+        self.transport = None
+        self.pending = collections.deque()
+        self.receive_buffer = memoryview(bytearray(1 << 16))
+        self.closed = False
+        self.exception = None
+        # Set when a reply can not be matched to its command, nothing more is received
+        self.aborted = False
+        self._start_reply()
+
+    def _start_reply(self):
+        # Reply header, plus the offset of segment replies
+        self.header = bytearray()
+        self.header_octets = reply_struct.size
+        self.target = None
+        self.position = 0
+        self.remaining = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.closed = True
+        if self.exception is None:
+            self.exception = exc or ConnectionError("TIM connection closed.")
+        self._fail_pending()
+
+    def _fail_pending(self):
+        while self.pending:
+            future = self.pending.popleft()[0]
+            if not future.done():
+                future.set_exception(self.exception)
+
+    # Drop the connection on a reply that does not fit the command waiting for it
+    # The replies after it can not be matched either, all pending commands fail
+    def _abort(self, message):
+        self.aborted = True
+        self.closed = True
+        self.exception = ValueError(message)
+        self._fail_pending()
+        self.transport.abort()
+
+    # Send a command, return the future of its reply
+    # A segment read gives its buffer slice as sink, its reply is (success, octets received)
+    # other replies are (success, reply octets)
+    def send(self, command, sink=None):
+        if self.closed:
+            raise self.exception
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((future, sink))
+        self.transport.write(command)
+        return future
+
+    def get_buffer(self, sizehint):
+        if self.aborted:
+            return self.receive_buffer
+        if self.target is not None and self.remaining >= DIRECT_RECEIVE_OCTETS:
+            return self.target[self.position:self.position + self.remaining]
+        return self.receive_buffer
+
+    def buffer_updated(self, nbytes):
+        if self.aborted:
+            return
+        if self.target is not None and self.remaining >= DIRECT_RECEIVE_OCTETS:
+            # Received straight into the target
+            self.position += nbytes
+            self.remaining -= nbytes
+            if not self.remaining:
+                self._finish_reply()
+            return
+        self._feed(self.receive_buffer[:nbytes])
+
+    def _feed(self, data):
+        while len(data) and not self.aborted:
+            if self.target is None:
+                count = min(self.header_octets - len(self.header), len(data))
+                self.header += data[:count]
+                data = data[count:]
+                if len(self.header) == self.header_octets:
+                    self._parse_header()
+            else:
+                count = min(self.remaining, len(data))
+                self.target[self.position:self.position + count] = data[:count]
+                data = data[count:]
+                self.position += count
+                self.remaining -= count
+                if not self.remaining:
+                    self._finish_reply()
+
+    def _parse_header(self):
+        if not self.pending:
+            self._abort("TIM reply received with no command waiting for it.")
+            return
+        success, length = reply_struct.unpack_from(self.header)
+        sink = self.pending[0][1]
+        if sink is not None and success == REPLY_SUCCESS:
+            if self.header_octets == reply_struct.size:
+                # Segment reply, read its offset before its octets
+                self.header_octets += read_reply_struct.size
+                if length < read_reply_struct.size:
+                    self._abort("TIM Read TEDS segment reply: {} octets, shorter than its offset.".format(length))
+                return
+            length -= read_reply_struct.size
+            if length > len(sink):
+                self._abort("TIM Read TEDS segment reply: {} octets, more than the {} requested."
+                    .format(length, len(sink)))
+                return
+            self.target = sink
+        else:
+            self.target = memoryview(bytearray(length))
+        self.remaining = length
+        if not length:
+            self._finish_reply()
+
+    def _finish_reply(self):
+        future, sink = self.pending.popleft()
+        success = reply_struct.unpack_from(self.header)[0] == REPLY_SUCCESS
+        if sink is not None and success:
+            result = (success, self.position)
+        else:
+            result = (success, self.target.obj if self.target is not None else b"")
+        self._start_reply()
+        # A command whose caller timed out still takes its reply, so the next replies stay in order
+        if not future.done():
+            future.set_result(result)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+# Open connections by endpoint, opened when first needed and closed when the pool is full
+class TEDS_Connection_Pool():
+
+    def __init__(self, max_connections=DEFAULT_MAX_CONNECTIONS, timeout=DEFAULT_TIMEOUT):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        # Least recently used first
+        self.connections = collections.OrderedDict()
+        # Connections being opened, so concurrent requests to an endpoint share one
+        self.connecting = {}
+
+    async def get(self, endpoint):
+        protocol = self.connections.get(endpoint)
+        if protocol is not None and not protocol.closed:
+            self.connections.move_to_end(endpoint)
+            return protocol
+        task = self.connecting.get(endpoint)
+        if task is None:
+            task = asyncio.ensure_future(self._connect(endpoint))
+            self.connecting[endpoint] = task
+        return await asyncio.shield(task)
+
+    async def _connect(self, endpoint):
+        try:
+            transport, protocol = await asyncio.wait_for(connect_endpoint(TEDS_Client_Protocol, endpoint),
+                self.timeout)
+        finally:
+            del self.connecting[endpoint]
+        self.connections[endpoint] = protocol
+        self.connections.move_to_end(endpoint)
+        while len(self.connections) > self.max_connections:
+            self.connections.popitem(last=False)[1].close()
+        return protocol
+
+    def discard(self, endpoint):
+        protocol = self.connections.pop(endpoint, None)
+        if protocol is not None:
+            protocol.close()
+
+    def close(self):
+        for protocol in self.connections.values():
+            protocol.close()
+        self.connections.clear()
+
+class TEDS_Client():
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT, window=DEFAULT_WINDOW,
+            pool=None):
+        self.timeout = timeout
+        self.window = window
+        self.pool = TEDS_Connection_Pool(timeout=timeout) if pool is None else pool
+        # TIMs fetched at the same time by fetch_many
+        self.concurrency = concurrency
+
+    # Send a command and wait for its reply, the connection is dropped if the TIM does not answer
+    async def command(self, endpoint, channel, function, args, sink=None):
+        protocol = await self.pool.get(endpoint)
+        try:
+            return await asyncio.wait_for(protocol.send(pack_command(channel, function, args), sink), self.timeout)
+        except asyncio.TimeoutError:
+            self.pool.discard(endpoint)
+            raise
+
+    # Size, checksum and max segment size of a TEDS
+    async def query_teds(self, endpoint, channel, access_code):
+        success, data = await self.command(endpoint, channel, COMMON_CMD_FUNCTIONS.QueryTEDS,
+            query_args_struct.pack(access_code))
+        if not success:
+            raise ValueError("TIM {}, Query TEDS failed: {}".format(endpoint, bytes(data).decode("utf-8", "replace")))
+        if len(data) != query_reply_struct.size:
+            raise ValueError("TIM {}, Query TEDS reply: {} octets, should be: {}."
+                .format(endpoint, len(data), query_reply_struct.size))
+        attributes, status, size, checksum, max_segment = query_reply_struct.unpack(data)
+        return size, checksum, max_segment
+
+    # TEDS as stored in the TIM (length prefix, data block, checksum), its checksum checked
+    async def fetch_image(self, endpoint, channel, access_code):
+        size, checksum, max_segment = await self.query_teds(endpoint, channel, access_code)
+        if size < LENGTH_OCTETS + CHECKSUM_OCTETS or not max_segment:
+            raise ValueError("TIM {}, channel {}, TEDS size: {}, max segment: {}, not valid."
+                .format(endpoint, channel, size, max_segment))
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        offsets = list(range(0, size, max_segment))
+        for first in range(0, len(offsets), self.window):
+            # Send a window of segment reads, then wait for all of their replies
+            replies = await asyncio.gather(*[self.command(endpoint, channel, COMMON_CMD_FUNCTIONS.ReadTEDSSegment,
+                read_args_struct.pack(access_code, offset, max_segment), view[offset:offset + max_segment])
+                for offset in offsets[first:first + self.window]])
+            for offset, (success, received) in zip(offsets[first:first + self.window], replies):
+                if not success:
+                    raise ValueError("TIM {}, channel {}, Read TEDS segment at offset {} failed."
+                        .format(endpoint, channel, offset))
+                if received != min(max_segment, size - offset):
+                    raise ValueError("TIM {}, channel {}, TEDS segment at offset {}: {} octets, should be: {}."
+                        .format(endpoint, channel, offset, received, min(max_segment, size - offset)))
+        check_length_and_checksum(buffer)
+        if buffer[-CHECKSUM_OCTETS:] != checksum.to_bytes(CHECKSUM_OCTETS, "big"):
+            raise ValueError("TIM {}, channel {}, TEDS checksum does not match the Query TEDS reply."
+                .format(endpoint, channel))
+        return buffer
+
+    # Fetch a TEDS and decode it into a new data block of block_class
+    async def fetch_teds(self, endpoint, channel, access_code, block_class, lazy=False):
+        buffer = await self.fetch_image(endpoint, channel, access_code)
+        teds_data_block = block_class.create()
+        teds_data_block.load_from_bytearray(memoryview(buffer)[LENGTH_OCTETS:len(buffer) - CHECKSUM_OCTETS], lazy)
+        return teds_data_block
+
+    # Meta-TEDS and all TransducerChannel TEDS of a TIM
+    async def fetch_tim(self, endpoint, lazy=False):
+        meta_teds = await self.fetch_teds(endpoint, TIM_CHANNEL, TEDS_ACCESS_CODES.MetaTEDS, Meta_TEDS_Data_Block,
+            lazy)
+        channels = await asyncio.gather(*[self.fetch_teds(endpoint, channel, TEDS_ACCESS_CODES.ChanTEDS,
+            TransducerChannel_TEDS_Data_Block, lazy) for channel in range(1, int(meta_teds.max_chan_field.get_value()) + 1)])
+        return TEDS_TIM(meta_teds, channels)
+
+    # Fetch many TIMs, at most concurrency at a time
+    # Return a dictionary of the TEDS_TIM, or of the exception raised, by endpoint
+    async def fetch_many(self, endpoints, lazy=False):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = {}
+
+        async def fetch(endpoint):
+            async with semaphore:
+                try:
+                    results[endpoint] = await self.fetch_tim(endpoint, lazy)
+                except (ValueError, OSError, asyncio.TimeoutError) as e:
+                    results[endpoint] = e
+
+        await asyncio.gather(*[fetch(endpoint) for endpoint in endpoints])
+        return results
+
+    def close(self):
+        self.pool.close()
+
+async def run(options):
+    endpoints = list(options.endpoint)
+    if options.endpoints:
+        with open(options.endpoints) as fh:
+            endpoints.extend(line.strip() for line in fh if line.strip())
+    client = TEDS_Client(options.concurrency, options.timeout, options.window)
+    start = time.perf_counter()
+    try:
+        results = await client.fetch_many(endpoints)
+    finally:
+        client.close()
+    elapsed = time.perf_counter() - start
+    failures = 0
+    channels = 0
+    for endpoint, result in results.items():
+        if isinstance(result, Exception):
+            failures += 1
+            print("{}: {}".format(endpoint, result or type(result).__name__), file=sys.stderr)
+        else:
+            channels += len(result)
+    print("{} TIMs, {} channels, {} failed, in {:.2f} s.".format(len(results), channels, failures, elapsed))
+    return 1 if failures else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch the TEDS of many TIMs.")
+    parser.add_argument("endpoint", nargs="*", help="host:port or unix:path")
+    parser.add_argument("--endpoints", help="file with one endpoint per line")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="TIMs fetched at a time")
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT, help="seconds to wait for each reply")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW, help="segment reads sent before waiting")
+    options = parser.parse_args(argv)
+    return asyncio.run(run(options))
+
+if __name__ == "__main__":
+    sys.exit(main())
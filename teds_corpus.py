@@ -0,0 +1,223 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Seeded generator of synthetic TEDS corpora, for load tests
+# The images follow the field definitions of the data block classes: values are drawn from
+# the field enumerations, optional fields are randomly included, nested blocks are generated
+# the same way. A batch of images is built column by column with NumPy, one column of TLV
+# octets per field, so no data block object is created per image
+#
+#   python teds_corpus.py --seed 1 --meta 1000 --channel 100000 --output corpus/
+#   python teds_corpus.py --seed 1 --channel 1000000 --checksummed --stream corpus.bin
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from teds_utils import TL_OCTETS, LENGTH_OCTETS, CHECKSUM_OCTETS, MAX_TLV_LENGTH, PLAN_VALUE, \
+    PLAN_BLOCK, calc_segment_sums
+from teds_data_model import Meta_TEDS_Data_Block, TransducerChannel_TEDS_Data_Block
+
+DEFAULT_BATCH_SIZE = 10000
+DEFAULT_OPTIONAL_RATE = 0.5
+
+CORPUS_BLOCK_CLASSES = {
+    "meta": Meta_TEDS_Data_Block,
+    "channel": TransducerChannel_TEDS_Data_Block,
+}
+
+# Value generators of some fields, by field name, for realistic values
+# Each one returns n values of the field, other fields get uniform values of their data type
+UNIT_EXPONENTS = ("Radians", "SterRad", "Meters", "Kilogram", "Seconds", "Amperes", "Kelvins", "Moles", "Candelas")
+
+def _unit_exponents(rng, n, codec):
+    # Units are encoded as (2 * exponent) + 128, exponents from -2 to 2
+    return 128 + 2 * rng.integers(-2, 3, n)
+
+def _low_limits(rng, n, codec):
+    return rng.uniform(-1000.0, 1000.0, n)
+
+def _uncertainties(rng, n, codec):
+    return rng.uniform(0.0, 1.0, n)
+
+def _direction_angles(rng, n, codec):
+    return rng.uniform(0.0, 2 * np.pi, (n, codec.count))
+
+FIELD_GENERATORS = {name: _unit_exponents for name in UNIT_EXPONENTS}
+FIELD_GENERATORS.update({
+    "UnitsExt": lambda rng, n, codec: np.zeros(n),
+    "LowLimit": _low_limits,
+    "OError": _uncertainties,
+    "TSError": _uncertainties,
+    "MaxChan": lambda rng, n, codec: rng.integers(1, 17, n),
+    "ModLenth": lambda rng, n, codec: rng.integers(1, 9, n),
+    "SigBits": lambda rng, n, codec: rng.integers(1, 65, n),
+    "DAngles": _direction_angles,
+})
+
+# Values of a field for n images: enumeration members, or uniform values of the data type
+# Float values are times and limits, in seconds or units, from 0 to 1000
+def generate_field_values(rng, n, field, codec, columns):
+    generator = FIELD_GENERATORS.get(field.name)
+    if field.name == "HiLimit" and "LowLimit" in columns:
+        # Keep the upper limit above the lower one
+        values = columns["LowLimit"] + rng.uniform(0.1, 1000.0, n)
+    elif generator is not None:
+        values = generator(rng, n, codec)
+    elif field.enum is not None:
+        values = rng.choice(np.array([member.value for member in field.enum]), n)
+    else:
+        dtype = np.dtype(field.data_type)
+        shape = (n, codec.count) if codec.is_list else n
+        if dtype.kind == "f":
+            values = rng.uniform(0.0, 1000.0, shape)
+        else:
+            info = np.iinfo(dtype)
+            values = rng.integers(info.min, int(info.max) + 1, shape, dtype=np.int64)
+    columns[field.name] = values
+    return values
+
+# TLV octets of a field for n images, as an (n, octets) array
+def field_tlv_columns(field, codec, values):
+    n = len(values)
+    value_dtype = np.dtype(field.data_type).newbyteorder(">")
+    value_octets = np.ascontiguousarray(np.asarray(values).astype(value_dtype)).view(np.uint8).reshape(n, -1)
+    header = np.empty((n, TL_OCTETS), dtype=np.uint8)
+    header[:, 0] = field.type
+    header[:, 1] = codec.value_struct.size
+    return np.hstack([header, value_octets])
+
+# Octets and inclusion mask of n images of a data block, as two (n, octets) arrays
+# Each image is the row octets where the mask is set, nested blocks are generated recursively
+def generate_block_columns(rng, n, teds_data_block, optional_rate):
+    plan = teds_data_block.get_codec_plan()
+    octets = []
+    masks = []
+    columns = {}
+    for field, kind, codec in zip(teds_data_block.fields, plan.kinds, plan.codecs):
+        if kind == PLAN_VALUE:
+            values = generate_field_values(rng, n, field, codec, columns)
+            field_octets = field_tlv_columns(field, codec, values)
+            field_mask = np.ones(field_octets.shape, dtype=bool)
+        elif kind == PLAN_BLOCK:
+            nested_octets, nested_mask = generate_block_columns(rng, n, field.get_value(), optional_rate)
+            lengths = nested_mask.sum(axis=1)
+            if np.any(lengths > MAX_TLV_LENGTH):
+                raise ValueError("TEDS field: {}, generated nested block too long.".format(field.name))
+            header = np.empty((n, TL_OCTETS), dtype=np.uint8)
+            header[:, 0] = field.type
+            header[:, 1] = lengths
+            field_octets = np.hstack([header, nested_octets])
+            field_mask = np.hstack([np.ones((n, TL_OCTETS), dtype=bool), nested_mask])
+        else:
+            # Fixed TLVs, e.g. the TEDS Identification Header
+            tlv = bytearray(field.get_encoded_length())
+            field.encode_into(tlv, 0)
+            field_octets = np.tile(np.frombuffer(bytes(tlv), dtype=np.uint8), (n, 1))
+            field_mask = np.ones(field_octets.shape, dtype=bool)
+        if field.optional:
+            field_mask &= (rng.random(n) < optional_rate)[:, None]
+        octets.append(field_octets)
+        masks.append(field_mask)
+    return np.hstack(octets), np.hstack(masks)
+
+# Generate n images of a data block class
+# Return the images packed in one array and their offsets (n+1 positions)
+def generate_images(rng, n, block_class, optional_rate=DEFAULT_OPTIONAL_RATE):
+    octets, mask = generate_block_columns(rng, n, block_class.get_prototype(), optional_rate)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(mask.sum(axis=1), out=offsets[1:])
+    # Row-major selection concatenates the images
+    return octets[mask], offsets
+
+# Add the length prefix and the checksum to each image of a batch
+# Return the framed images packed in one array and their offsets
+def frame_images(data, offsets):
+    n = len(offsets) - 1
+    lengths = np.diff(offsets)
+    frame_octets = LENGTH_OCTETS + CHECKSUM_OCTETS
+    framed_offsets = offsets + frame_octets * np.arange(n + 1)
+    framed = np.empty(len(data) + frame_octets * n, dtype=np.uint8)
+    # Image octets move by the framing of the images before them and their own length prefix
+    image_index = np.repeat(np.arange(n), lengths)
+    framed[np.arange(len(data)) + frame_octets * image_index + LENGTH_OCTETS] = data
+    prefixes = (lengths + CHECKSUM_OCTETS).astype(">u4").view(np.uint8).reshape(n, LENGTH_OCTETS)
+    starts = framed_offsets[:-1]
+    framed[starts[:, None] + np.arange(LENGTH_OCTETS)] = prefixes
+    sums = calc_segment_sums(data, offsets[:-1], offsets[1:]) + prefixes.sum(axis=1, dtype=np.uint64)
+    checksums = (0xFFFF - sums % 0xFFFF).astype(">u2").view(np.uint8).reshape(n, CHECKSUM_OCTETS)
+    framed[(framed_offsets[1:] - CHECKSUM_OCTETS)[:, None] + np.arange(CHECKSUM_OCTETS)] = checksums
+    return framed, framed_offsets
+
+# Yield (kind, packed images, offsets) batches of a corpus
+# The corpus only depends on the seed, the counts, the batch size and the optional rate
+def iter_corpus_batches(seed, counts, batch_size=DEFAULT_BATCH_SIZE, optional_rate=DEFAULT_OPTIONAL_RATE,
+        checksummed=False):
+    rng = np.random.default_rng(seed)
+    remaining = dict(counts)
+    while any(remaining.values()):
+        for kind, block_class in CORPUS_BLOCK_CLASSES.items():
+            n = min(batch_size, remaining.get(kind, 0))
+            if not n:
+                continue
+            remaining[kind] -= n
+            data, offsets = generate_images(rng, n, block_class, optional_rate)
+            if checksummed:
+                data, offsets = frame_images(data, offsets)
+            yield kind, data, offsets
+
+def write_stream(path, batches):
+    count = 0
+    with open(path, "wb") as fh:
+        for kind, data, offsets in batches:
+            fh.write(data.tobytes())
+            count += len(offsets) - 1
+    return count
+
+def write_directory(path, batches):
+    os.makedirs(path, exist_ok=True)
+    count = 0
+    for kind, data, offsets in batches:
+        buffer = data.tobytes()
+        for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist()):
+            with open(os.path.join(path, "{}_teds_{:08d}.bin".format(kind, count)), "wb") as fh:
+                fh.write(buffer[start:end])
+            count += 1
+    return count
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a seeded synthetic corpus of TEDS images.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--meta", type=int, default=0, help="number of Meta-TEDS images")
+    parser.add_argument("--channel", type=int, default=0, help="number of TransducerChannel TEDS images")
+    parser.add_argument("--optional-rate", type=float, default=DEFAULT_OPTIONAL_RATE,
+        help="probability of including each optional field")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="images generated at once")
+    parser.add_argument("--checksummed", action="store_true", help="add the length and checksum framing")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("--output", "-o", help="directory, one file per image")
+    output.add_argument("--stream", help="single file with all images packed")
+    options = parser.parse_args(argv)
+    batches = iter_corpus_batches(options.seed, {"meta": options.meta, "channel": options.channel},
+        options.batch_size, options.optional_rate, options.checksummed)
+    if options.stream:
+        count = write_stream(options.stream, batches)
+    else:
+        count = write_directory(options.output, batches)
+    print("{} TEDS images written.".format(count))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
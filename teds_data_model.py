@@ -12,9 +12,9 @@
 # *****************************************************************************************
 
 import enum
-import enum
-from numpy import uint32, uint64, uint8, uint16, float32, frombuffer
-from pandas import array
+from numpy import uint8, uint16, float32
+from struct import Struct
+from copy import copy
 from teds_utils import TEDS_Data_Block, TEDS_Field, TEDS_TLV_Block, TL_OCTETS, generate_uuid
 
 #TEDS Access Codes for the TEDS defined by this standard
@@ -35,6 +35,9 @@ class TEDS_ACCESS_CODES(enum.IntEnum):
     GeoLocTEDS = 0x0E
     UnitsExtention = 0x0F
 
+# Type, length, family, class, version and tuple length octets of a TEDS Identification Header
+teds_id_struct = Struct(">BB4B")
+
 class TEDS_Identifier_Structure():
 
     def __init__(self, teds_class):
@@ -63,6 +66,20 @@ class TEDS_Identifier_Structure():
     def get_TLV(self):
         return TEDS_TLV_Block(self.type, self.length, self.get_bytes())
 
+    # Number of octets of this structure TLV
+    def get_encoded_length(self):
+        return self.get_total_length()
+
+    # Write this structure TLV in the buffer at offset, return the offset after it
+    def encode_into(self, buffer, offset):
+        teds_id_struct.pack_into(buffer, offset, self.type, self.length,
+            self.family, self.teds_class, self.version, self.tuple_length)
+        return offset + teds_id_struct.size
+
+    # Octet sum of this structure TLV
+    def get_byte_sum(self):
+        return self.type + self.length + self.family + int(self.teds_class) + self.version + self.tuple_length
+
     def get_bytes(self):
         return bytes([self.family, self.teds_class, self.version, self.tuple_length])
 
@@ -93,6 +110,9 @@ class TEDS_Identifier_Structure():
             except:
                 raise ValueError("TEDS Identifier Structure, loaded bytes don't match.")
 
+    def clone(self, parent=None):
+        return copy(self)
+
     def load_bytes_from_TLV(self, tlv_block):
         try:
             assert tlv_block.field_type == self.type
@@ -145,6 +165,13 @@ class Meta_TEDS_Data_Block(TEDS_Data_Block):
     def set_uuid(self, uuid):
         self.uuid_field_2.set_value(uuid)
 
+    def regenerate_uuid(self):
+        self.uuid_field.set_value_from_bytes(generate_uuid())
+
+    # Each block created from a prototype or template gets its own UUID
+    def init_clone(self):
+        self.regenerate_uuid()
+
 '''class UUID_TEDS_Data_Block(TEDS_Data_Block):
     def __init__(self):
         super().__init__()
@@ -562,6 +589,52 @@ class TransducerChannel_TEDS_Data_Block(TEDS_Data_Block):
         self.ESOption.is_optional()
         self.fields.append(self.ESOption)
 
+# TEDS data block classes implemented by this model, by TEDS access code
+TEDS_DATA_BLOCK_CLASSES = {
+    TEDS_ACCESS_CODES.MetaTEDS: Meta_TEDS_Data_Block,
+    TEDS_ACCESS_CODES.ChanTEDS: TransducerChannel_TEDS_Data_Block,
+}
+
+# Read the TEDS access code from the TEDS Identification Header at the start of an image
+def get_teds_access_code(barray, offset=0):
+    if len(barray) - offset < teds_id_struct.size:
+        raise ValueError("TEDS image too short for a TEDS Identification Header.")
+    field_type, field_length, family, teds_class, version, tuple_length = teds_id_struct.unpack_from(barray, offset)
+    if field_type != 0x03 or field_length != 0x04:
+        raise ValueError("TEDS image does not start with a TEDS Identification Header.")
+    return teds_class
+
+# Create the TEDS data block matching the image header and load the image into it
+# If lazy is set, values are only decoded when accessed
+def teds_data_block_from_bytes(barray, lazy=False):
+    teds_class = get_teds_access_code(barray)
+    try:
+        block_class = TEDS_DATA_BLOCK_CLASSES[teds_class]
+    except KeyError:
+        raise ValueError("TEDS access code: {}, no data block defined.".format(teds_class))
+    teds_data_block = block_class.create()
+    teds_data_block.load_from_bytearray(barray, lazy)
+    return teds_data_block
+
+# Values of a TEDS data block with its access code, as stored in JSON TEDS files
+def teds_data_block_to_dict(teds_data_block):
+    return {"TEDS": TEDS_ACCESS_CODES(teds_data_block.teds_id.teds_class).name,
+            "fields": teds_data_block.to_dict()}
+
+# Create the TEDS data block of a dictionary as returned by teds_data_block_to_dict
+# The access code can be given by name or by number
+def teds_data_block_from_dict(values):
+    teds_class = values.get("TEDS")
+    try:
+        if isinstance(teds_class, str):
+            teds_class = TEDS_ACCESS_CODES[teds_class]
+        block_class = TEDS_DATA_BLOCK_CLASSES[teds_class]
+    except KeyError:
+        raise ValueError("TEDS access code: {}, no data block defined.".format(teds_class))
+    teds_data_block = block_class.create()
+    teds_data_block.load_from_dict(values.get("fields", {}))
+    return teds_data_block
+
 # ba = Meta_TEDS_Data_Block()
 # print([ "0x%02x" % b for b in ba.to_bytes()])
 
@@ -0,0 +1,375 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# TLV level diff and patch of TEDS images
+# The TLVs of two images are walked in parallel, matched by type (and occurrence, for repeated
+# types), nested blocks are compared TLV by TLV too. A patch holds the operations on the TLVs of
+# the old image, by their position: insert a TLV before it, delete it, replace it, or patch the
+# nested block it holds. Applying a patch copies the unchanged octet ranges of the old image,
+# fixes the lengths of the nested blocks changed and updates the checksum from the octets
+# removed and added, without summing the whole image again
+#
+# Patch layout, big endian:
+#   header   magic "TEDP", version, flags, checksum of the old image, of the new image, op count
+#   ops      op code, TLV position, then the TLV (insert, replace), or op count and ops (nested)
+# Checksums are the ones of the images once framed (see calc_image_checksum)
+#
+#   python teds_diff.py diff old.bin new.bin              list the changed fields
+#   python teds_diff.py diff old.bin new.bin -o update.tedp
+#   python teds_diff.py apply old.bin update.tedp -o new.bin
+
+import argparse
+import sys
+from struct import Struct
+
+from teds_utils import TL_OCTETS, LENGTH_OCTETS, CHECKSUM_OCTETS, MAX_TLV_LENGTH, PLAN_VALUE, PLAN_BLOCK, \
+    length_struct, checksum_struct, iter_tlv, calc_byte_sum, checksum_from_sum, calc_image_checksum, \
+    check_length_and_checksum
+from teds_data_model import TEDS_DATA_BLOCK_CLASSES, get_teds_access_code
+from teds_stream import FRAMING_PLAIN, detect_framing
+
+PATCH_MAGIC = b"TEDP"
+PATCH_VERSION = 1
+
+# Magic, version, flags, old image checksum, new image checksum, op count
+patch_header_struct = Struct(">4sBBHHH")
+# Op code, TLV position in the old block
+op_struct = Struct(">BH")
+# Op count of a nested block patch
+count_struct = Struct(">H")
+
+OP_INSERT = 0x01
+OP_DELETE = 0x02
+OP_REPLACE = 0x03
+OP_NESTED = 0x04
+
+OP_NAMES = {OP_INSERT: "added", OP_DELETE: "removed", OP_REPLACE: "changed", OP_NESTED: "changed"}
+
+# TLVs of a block: key (type, occurrence of the type), type, start of the TLV, end of the TLV
+def _block_tlvs(buffer, offset, end):
+    tlvs = []
+    occurrences = {}
+    for field_type, field_length, seek in iter_tlv(buffer, offset, end):
+        occurrence = occurrences.get(field_type, 0)
+        occurrences[field_type] = occurrence + 1
+        tlvs.append(((field_type, occurrence), field_type, seek - TL_OCTETS, seek + field_length))
+    return tlvs
+
+# Data block class of each nested block TLV type of a block class
+def _nested_classes(block_class):
+    if block_class is None:
+        return {}
+    prototype = block_class.get_prototype()
+    plan = prototype.get_codec_plan()
+    return {int(field.type): type(field.get_value())
+        for field, kind in zip(prototype.fields, plan.kinds) if kind == PLAN_BLOCK}
+
+def _ops_length(ops):
+    length = 0
+    for op, index, payload in ops:
+        length += op_struct.size
+        if op == OP_NESTED:
+            length += count_struct.size + _ops_length(payload)
+        elif op != OP_DELETE:
+            length += len(payload)
+    return length
+
+# Ops turning the block old[old_offset:old_end] into new[new_offset:new_end]
+def diff_blocks(old, old_offset, old_end, new, new_offset, new_end, block_class=None):
+    old_tlvs = _block_tlvs(old, old_offset, old_end)
+    new_tlvs = _block_tlvs(new, new_offset, new_end)
+    nested_classes = _nested_classes(block_class)
+    old_keys = set(tlv[0] for tlv in old_tlvs)
+    new_keys = set(tlv[0] for tlv in new_tlvs)
+    ops = []
+    i = j = 0
+    while i < len(old_tlvs) or j < len(new_tlvs):
+        if j == len(new_tlvs):
+            ops.append((OP_DELETE, i, None))
+            old_keys.discard(old_tlvs[i][0])
+            i += 1
+            continue
+        new_key, field_type, new_start, new_stop = new_tlvs[j]
+        if i == len(old_tlvs):
+            ops.append((OP_INSERT, i, bytes(new[new_start:new_stop])))
+            new_keys.discard(new_key)
+            j += 1
+            continue
+        old_key, _, old_start, old_stop = old_tlvs[i]
+        if old_key == new_key:
+            if old[old_start:old_stop] != new[new_start:new_stop]:
+                tlv = bytes(new[new_start:new_stop])
+                op = (OP_REPLACE, i, tlv)
+                if field_type in nested_classes:
+                    # Patch the nested block, unless replacing it whole is shorter
+                    nested_ops = diff_blocks(old, old_start + TL_OCTETS, old_stop, new, new_start + TL_OCTETS,
+                        new_stop, nested_classes[field_type])
+                    if count_struct.size + _ops_length(nested_ops) < len(tlv):
+                        op = (OP_NESTED, i, nested_ops)
+                ops.append(op)
+            old_keys.discard(old_key)
+            new_keys.discard(new_key)
+            i += 1
+            j += 1
+        elif old_key not in new_keys:
+            ops.append((OP_DELETE, i, None))
+            old_keys.discard(old_key)
+            i += 1
+        elif new_key not in old_keys:
+            ops.append((OP_INSERT, i, bytes(new[new_start:new_stop])))
+            new_keys.discard(new_key)
+            j += 1
+        else:
+            # Both TLVs are in the other image, in another order: the old one is removed here
+            # and its type is inserted again when reached in the new image
+            ops.append((OP_DELETE, i, None))
+            old_keys.discard(old_key)
+            i += 1
+    return ops
+
+# Append the octet ranges of the patched block old[offset:end] to parts
+# Return the length of the patched block and the sums of the old octets removed and new octets added
+def apply_block_ops(old, offset, end, ops, parts):
+    tlvs = _block_tlvs(old, offset, end)
+    position = offset
+    length = removed = added = 0
+    last_index = 0
+    for op, index, payload in ops:
+        if index < last_index or index > len(tlvs) or (op != OP_INSERT and index == len(tlvs)):
+            raise ValueError("TEDS patch op at TLV position: {}, the block has {} TLVs.".format(index, len(tlvs)))
+        last_index = index if op == OP_INSERT else index + 1
+        tlv_start = tlvs[index][2] if index < len(tlvs) else end
+        if tlv_start > position:
+            parts.append(old[position:tlv_start])
+            length += tlv_start - position
+        position = tlv_start
+        if op == OP_INSERT:
+            parts.append(payload)
+            length += len(payload)
+            added += calc_byte_sum(payload)
+            continue
+        tlv_end = tlvs[index][3]
+        if op == OP_NESTED:
+            # Type octet kept, length octet rewritten once the nested block is patched
+            nested_parts = []
+            nested_length, nested_removed, nested_added = apply_block_ops(old, tlv_start + TL_OCTETS, tlv_end,
+                payload, nested_parts)
+            if nested_length > MAX_TLV_LENGTH:
+                raise ValueError("TEDS field type: {}, patched nested block length is: {}, maximum is: {}"
+                    .format(tlvs[index][1], nested_length, MAX_TLV_LENGTH))
+            parts.append(bytes((tlvs[index][1], nested_length)))
+            parts.extend(nested_parts)
+            length += TL_OCTETS + nested_length
+            removed += old[tlv_start + 1] + nested_removed
+            added += nested_length + nested_added
+        else:
+            removed += calc_byte_sum(old[tlv_start:tlv_end])
+            if op == OP_REPLACE:
+                parts.append(payload)
+                length += len(payload)
+                added += calc_byte_sum(payload)
+        position = tlv_end
+    if end > position:
+        parts.append(old[position:end])
+        length += end - position
+    return length, removed, added
+
+class TEDS_Patch():
+
+    def __init__(self, ops=None, old_checksum=0, new_checksum=0):
+        self.ops = ops or []
+        self.old_checksum = old_checksum
+        self.new_checksum = new_checksum
+
+    def __len__(self):
+        return len(self.ops)
+
+    def get_encoded_length(self):
+        return patch_header_struct.size + _ops_length(self.ops)
+
+    def to_bytes(self):
+        parts = [patch_header_struct.pack(PATCH_MAGIC, PATCH_VERSION, 0, self.old_checksum, self.new_checksum,
+            len(self.ops))]
+        _encode_ops(self.ops, parts)
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, buffer):
+        if len(buffer) < patch_header_struct.size:
+            raise ValueError("TEDS patch too short: {} octets.".format(len(buffer)))
+        magic, version, flags, old_checksum, new_checksum, count = patch_header_struct.unpack_from(buffer, 0)
+        if magic != PATCH_MAGIC:
+            raise ValueError("TEDS patch magic: {}, should be: {}.".format(bytes(magic), PATCH_MAGIC))
+        if version != PATCH_VERSION:
+            raise ValueError("TEDS patch version: {}, not supported.".format(version))
+        ops, offset = _decode_ops(memoryview(buffer), patch_header_struct.size, count)
+        if offset != len(buffer):
+            raise ValueError("TEDS patch has {} octets after its last op.".format(len(buffer) - offset))
+        return cls(ops, old_checksum, new_checksum)
+
+def _encode_ops(ops, parts):
+    for op, index, payload in ops:
+        parts.append(op_struct.pack(op, index))
+        if op == OP_NESTED:
+            parts.append(count_struct.pack(len(payload)))
+            _encode_ops(payload, parts)
+        elif op != OP_DELETE:
+            parts.append(payload)
+
+def _decode_ops(buffer, offset, count):
+    ops = []
+    for _ in range(count):
+        if offset + op_struct.size > len(buffer):
+            raise ValueError("TEDS patch truncated at offset {}.".format(offset))
+        op, index = op_struct.unpack_from(buffer, offset)
+        offset += op_struct.size
+        if op == OP_NESTED:
+            if offset + count_struct.size > len(buffer):
+                raise ValueError("TEDS patch truncated at offset {}.".format(offset))
+            nested_count = count_struct.unpack_from(buffer, offset)[0]
+            payload, offset = _decode_ops(buffer, offset + count_struct.size, nested_count)
+        elif op == OP_DELETE:
+            payload = None
+        elif op in (OP_INSERT, OP_REPLACE):
+            if offset + TL_OCTETS > len(buffer) or offset + TL_OCTETS + buffer[offset + 1] > len(buffer):
+                raise ValueError("TEDS patch truncated TLV at offset {}.".format(offset))
+            end = offset + TL_OCTETS + buffer[offset + 1]
+            payload = bytes(buffer[offset:end])
+            offset = end
+        else:
+            raise ValueError("TEDS patch op code: {}, unknown.".format(op))
+        ops.append((op, index, payload))
+    return ops, offset
+
+# Data block octets of a plain or checksummed image, and the image checksum
+# The checksum of a checksummed image is read from its trailer, and checked if verify is set
+def _split_image(image, verify=True):
+    view = memoryview(image)
+    if detect_framing(view) == FRAMING_PLAIN:
+        return view, calc_image_checksum(view), False
+    if verify:
+        start, end = check_length_and_checksum(view)
+    else:
+        start, end = LENGTH_OCTETS, len(view) - CHECKSUM_OCTETS
+    return view[start:end], checksum_struct.unpack_from(view, end)[0], True
+
+def _image_block_class(block):
+    return TEDS_DATA_BLOCK_CLASSES.get(get_teds_access_code(block))
+
+# Patch turning the old image into the new one, plain or checksummed images of the same TEDS
+def diff_images(old, new):
+    old_block, old_checksum, _ = _split_image(old)
+    new_block, new_checksum, _ = _split_image(new)
+    if get_teds_access_code(old_block) != get_teds_access_code(new_block):
+        raise ValueError("TEDS access codes differ: {}, {}.".format(get_teds_access_code(old_block),
+            get_teds_access_code(new_block)))
+    ops = diff_blocks(old_block, 0, len(old_block), new_block, 0, len(new_block), _image_block_class(old_block))
+    return TEDS_Patch(ops, old_checksum, new_checksum)
+
+# Apply a patch to an image, return the new image with the framing of the old one
+# The old image must be the one the patch was made from
+def apply_patch(image, patch, verify=True):
+    if not isinstance(patch, TEDS_Patch):
+        patch = TEDS_Patch.from_bytes(patch)
+    block, checksum, framed = _split_image(image, verify)
+    if checksum != patch.old_checksum:
+        raise ValueError("TEDS patch made for an image with checksum: {:#06x}, image checksum is: {:#06x}."
+            .format(patch.old_checksum, checksum))
+    parts = []
+    length, removed, added = apply_block_ops(block, 0, len(block), patch.ops, parts)
+    # Sum of the old block from its checksum: the checksum covers the length prefix too
+    old_prefix_sum = sum(length_struct.pack(len(block) + CHECKSUM_OCTETS))
+    new_prefix = length_struct.pack(length + CHECKSUM_OCTETS)
+    old_sum = (0xFFFF - checksum) - old_prefix_sum
+    new_checksum = checksum_from_sum((old_sum - removed + added + sum(new_prefix)) % 0xFFFF)
+    if new_checksum != patch.new_checksum:
+        raise ValueError("TEDS patched image checksum: {:#06x}, should be: {:#06x}."
+            .format(new_checksum, patch.new_checksum))
+    if framed:
+        parts.insert(0, new_prefix)
+        parts.append(checksum_struct.pack(new_checksum))
+    return b"".join(parts)
+
+# Value of a TLV as text, decoded with the field codec when the TLV is a known value field
+def _tlv_text(buffer, start, end, field_index, plan):
+    value = buffer[start + TL_OCTETS:end]
+    if field_index is not None and plan.kinds[field_index] == PLAN_VALUE:
+        codec = plan.codecs[field_index]
+        if len(value) == codec.value_struct.size:
+            return str(codec.unpack(value))
+    return bytes(value).hex()
+
+# Yield (field path, change, old value, new value) for each op of a patch, as text
+def iter_patch_changes(image, patch, verify=True):
+    if not isinstance(patch, TEDS_Patch):
+        patch = TEDS_Patch.from_bytes(patch)
+    block = _split_image(image, verify)[0]
+    yield from _iter_block_changes(block, 0, len(block), patch.ops, _image_block_class(block), "")
+
+def _iter_block_changes(block, offset, end, ops, block_class, prefix):
+    tlvs = _block_tlvs(block, offset, end)
+    prototype = block_class.get_prototype() if block_class is not None else None
+    plan = prototype.get_codec_plan() if prototype is not None else None
+    nested_classes = _nested_classes(block_class)
+    for op, index, payload in ops:
+        field_type = payload[0] if op == OP_INSERT else tlvs[index][1]
+        field_index = plan.index_by_type.get(field_type) if plan is not None else None
+        name = prototype.fields[field_index].name if field_index is not None else "TLV {}".format(field_type)
+        path = prefix + name
+        if op == OP_NESTED:
+            yield from _iter_block_changes(block, tlvs[index][2] + TL_OCTETS, tlvs[index][3], payload,
+                nested_classes.get(field_type), path + ".")
+            continue
+        old_text = _tlv_text(block, tlvs[index][2], tlvs[index][3], field_index, plan) if op != OP_INSERT else ""
+        new_text = _tlv_text(payload, 0, len(payload), field_index, plan) if op != OP_DELETE else ""
+        yield path, OP_NAMES[op], old_text, new_text
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TLV level diff and patch of TEDS images.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    diff = commands.add_parser("diff", help="list the changed fields, or write a patch")
+    diff.add_argument("old")
+    diff.add_argument("new")
+    diff.add_argument("--output", "-o", help="patch file")
+    apply = commands.add_parser("apply", help="apply a patch to an image")
+    apply.add_argument("image")
+    apply.add_argument("patch")
+    apply.add_argument("--output", "-o", required=True)
+    options = parser.parse_args(argv)
+    try:
+        if options.command == "diff":
+            with open(options.old, "rb") as fh:
+                old = fh.read()
+            with open(options.new, "rb") as fh:
+                new = fh.read()
+            patch = diff_images(old, new)
+            for path, change, old_text, new_text in iter_patch_changes(old, patch):
+                print("{} {}: {} -> {}".format(path, change, old_text or "-", new_text or "-"))
+            if options.output:
+                with open(options.output, "wb") as fh:
+                    fh.write(patch.to_bytes())
+                print("Patch: {} octets, image: {} octets.".format(patch.get_encoded_length(), len(new)))
+        else:
+            with open(options.image, "rb") as fh:
+                image = fh.read()
+            with open(options.patch, "rb") as fh:
+                patch = fh.read()
+            with open(options.output, "wb") as fh:
+                fh.write(apply_patch(image, patch))
+    except (ValueError, OSError) as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
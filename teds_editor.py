@@ -22,34 +22,18 @@ class Ui_editorMainWindow(object):
         self.metaTedsTab_2.setObjectName("metaTedsTab_2")
         self.metaTedsTab = QtWidgets.QWidget()
         self.metaTedsTab.setObjectName("metaTedsTab")
-        self.metaTedsTable = QtWidgets.QTableWidget(self.metaTedsTab)
+        self.metaTedsTable = QtWidgets.QTableView(self.metaTedsTab)
         self.metaTedsTable.setGeometry(QtCore.QRect(10, 10, 861, 461))
-        self.metaTedsTable.setColumnCount(3)
         self.metaTedsTable.setObjectName("metaTedsTable")
-        self.metaTedsTable.setRowCount(0)
-        item = QtWidgets.QTableWidgetItem()
-        self.metaTedsTable.setHorizontalHeaderItem(0, item)
-        item = QtWidgets.QTableWidgetItem()
-        self.metaTedsTable.setHorizontalHeaderItem(1, item)
-        item = QtWidgets.QTableWidgetItem()
-        self.metaTedsTable.setHorizontalHeaderItem(2, item)
         self.pushButton = QtWidgets.QPushButton(self.metaTedsTab)
         self.pushButton.setGeometry(QtCore.QRect(10, 480, 93, 41))
         self.pushButton.setObjectName("pushButton")
         self.metaTedsTab_2.addTab(self.metaTedsTab, "")
         self.channelTedsTab_2 = QtWidgets.QWidget()
         self.channelTedsTab_2.setObjectName("channelTedsTab_2")
-        self.transducerChannelTable = QtWidgets.QTableWidget(self.channelTedsTab_2)
+        self.transducerChannelTable = QtWidgets.QTableView(self.channelTedsTab_2)
         self.transducerChannelTable.setGeometry(QtCore.QRect(10, 11, 861, 461))
-        self.transducerChannelTable.setColumnCount(3)
         self.transducerChannelTable.setObjectName("transducerChannelTable")
-        self.transducerChannelTable.setRowCount(0)
-        item = QtWidgets.QTableWidgetItem()
-        self.transducerChannelTable.setHorizontalHeaderItem(0, item)
-        item = QtWidgets.QTableWidgetItem()
-        self.transducerChannelTable.setHorizontalHeaderItem(1, item)
-        item = QtWidgets.QTableWidgetItem()
-        self.transducerChannelTable.setHorizontalHeaderItem(2, item)
         self.metaTedsTab_2.addTab(self.channelTedsTab_2, "")
         editorMainWindow.setCentralWidget(self.centralwidget)
         self.menubar = QtWidgets.QMenuBar(editorMainWindow)
@@ -82,20 +66,8 @@ class Ui_editorMainWindow(object):
     def retranslateUi(self, editorMainWindow):
         _translate = QtCore.QCoreApplication.translate
         editorMainWindow.setWindowTitle(_translate("editorMainWindow", "IEEE 1451.0 TEDS Editor"))
-        item = self.metaTedsTable.horizontalHeaderItem(0)
-        item.setText(_translate("editorMainWindow", "Field"))
-        item = self.metaTedsTable.horizontalHeaderItem(1)
-        item.setText(_translate("editorMainWindow", "Value"))
-        item = self.metaTedsTable.horizontalHeaderItem(2)
-        item.setText(_translate("editorMainWindow", "Include"))
         self.pushButton.setText(_translate("editorMainWindow", "Generate UUID"))
         self.metaTedsTab_2.setTabText(self.metaTedsTab_2.indexOf(self.metaTedsTab), _translate("editorMainWindow", "Meta TEDS"))
-        item = self.transducerChannelTable.horizontalHeaderItem(0)
-        item.setText(_translate("editorMainWindow", "Field"))
-        item = self.transducerChannelTable.horizontalHeaderItem(1)
-        item.setText(_translate("editorMainWindow", "Value"))
-        item = self.transducerChannelTable.horizontalHeaderItem(2)
-        item.setText(_translate("editorMainWindow", "Include"))
         self.metaTedsTab_2.setTabText(self.metaTedsTab_2.indexOf(self.channelTedsTab_2), _translate("editorMainWindow", "TransducerChannel TEDS"))
         self.menuFile.setTitle(_translate("editorMainWindow", "File"))
         self.actionSave_bin.setText(_translate("editorMainWindow", "Save .bin"))
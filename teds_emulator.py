@@ -0,0 +1,252 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Emulated TIMs serving their TEDS with the commands of teds_protocol, over TCP or Unix sockets
+# All emulated TIMs run in one asyncio event loop, each one listens on its own endpoint.
+# Emulated TIMs made from the same TEDS share the channel data blocks, each one gets its own
+# Meta-TEDS copy with a new UUID. A TEDS written by an NCAP replaces the one of that TIM only.
+#
+#   python teds_emulator.py --meta meta.bin --channel channel.bin --count 1000 --port 15000
+#   python teds_emulator.py --tim tim.bin --count 2000 --unix-dir /tmp/tims --endpoints tims.txt
+
+import argparse
+import asyncio
+import os
+import sys
+from struct import error as StructError
+
+from teds_utils import CHECKSUM_OCTETS, checksum_struct, check_length_and_checksum
+from teds_data_model import TEDS_ACCESS_CODES, Meta_TEDS_Data_Block, TransducerChannel_TEDS_Data_Block, \
+    teds_data_block_from_bytes
+from teds_tim import TEDS_TIM
+from teds_protocol import command_struct, reply_struct, query_args_struct, query_reply_struct, read_args_struct, \
+    read_reply_struct, write_args_struct, update_args_struct, COMMON_CMD_CLASS, COMMON_CMD_FUNCTIONS, \
+    REPLY_SUCCESS, TIM_CHANNEL, TEDS_STATUS_VALID, MAX_SEGMENT_OCTETS, pack_reply
+
+# Data block class of the TEDS held by the TIM (channel 0) and by its TransducerChannels
+TIM_TEDS_CLASSES = {TEDS_ACCESS_CODES.MetaTEDS: Meta_TEDS_Data_Block}
+CHANNEL_TEDS_CLASSES = {TEDS_ACCESS_CODES.ChanTEDS: TransducerChannel_TEDS_Data_Block}
+
+class TEDS_TIM_Emulator():
+
+    def __init__(self, tim, max_segment=MAX_SEGMENT_OCTETS, latency=0.0):
+        self.tim = tim
+        self.max_segment = min(max_segment, MAX_SEGMENT_OCTETS)
+        # Delay before each reply, in seconds, to emulate the link and the TIM processing
+        self.latency = latency
+        # Framed TEDS images by (channel, access code), encoded when first requested
+        self.images = {}
+        # TEDS written by the NCAP and not updated yet, by (channel, access code)
+        self.written = {}
+        self.endpoint = None
+        self.server = None
+        # Writers of the open NCAP connections, closed when the emulator stops
+        self.connections = set()
+        self.commands = 0
+
+    # Data block class of a TEDS, None if this TIM does not hold it
+    def get_block_class(self, channel, access_code):
+        if channel == TIM_CHANNEL:
+            return TIM_TEDS_CLASSES.get(access_code)
+        if channel <= len(self.tim):
+            return CHANNEL_TEDS_CLASSES.get(access_code)
+        return None
+
+    def get_image(self, channel, access_code):
+        key = (channel, access_code)
+        image = self.images.get(key)
+        if image is None:
+            if self.get_block_class(channel, access_code) is None:
+                raise KeyError(key)
+            teds_data_block = self.tim.meta_teds if channel == TIM_CHANNEL else self.tim.get_channel(channel - 1)
+            image = bytes(teds_data_block.to_bytes_with_length_and_checksum())
+            self.images[key] = image
+        return image
+
+    # Reply to a command, as a list of octet buffers
+    def handle_command(self, channel, command_class, function, args):
+        self.commands += 1
+        try:
+            if command_class != COMMON_CMD_CLASS:
+                raise ValueError("command class: {}, not supported".format(command_class))
+            if function == COMMON_CMD_FUNCTIONS.ReadTEDSSegment:
+                access_code, offset, max_length = read_args_struct.unpack_from(args)
+                image = self.get_image(channel, access_code)
+                if offset > len(image):
+                    raise ValueError("TEDS offset: {}, TEDS size is: {}".format(offset, len(image)))
+                segment = memoryview(image)[offset:offset + min(max_length, self.max_segment)]
+                return [reply_struct.pack(REPLY_SUCCESS, read_reply_struct.size + len(segment)),
+                    read_reply_struct.pack(offset), segment]
+            elif function == COMMON_CMD_FUNCTIONS.QueryTEDS:
+                access_code = query_args_struct.unpack_from(args)[0]
+                image = self.get_image(channel, access_code)
+                checksum = checksum_struct.unpack_from(image, len(image) - CHECKSUM_OCTETS)[0]
+                return [pack_reply(True, query_reply_struct.pack(0, TEDS_STATUS_VALID, len(image), checksum,
+                    self.max_segment))]
+            elif function == COMMON_CMD_FUNCTIONS.WriteTEDSSegment:
+                access_code, offset = write_args_struct.unpack_from(args)
+                if self.get_block_class(channel, access_code) is None:
+                    raise KeyError((channel, access_code))
+                written = self.written.setdefault((channel, access_code), bytearray())
+                if offset > len(written):
+                    raise ValueError("TEDS offset: {}, written so far: {}".format(offset, len(written)))
+                written[offset:offset + len(args) - write_args_struct.size] = args[write_args_struct.size:]
+                return [pack_reply(True)]
+            elif function == COMMON_CMD_FUNCTIONS.UpdateTEDS:
+                access_code = update_args_struct.unpack_from(args)[0]
+                self.update_teds(channel, access_code)
+                return [pack_reply(True)]
+            raise ValueError("command function: {}, not supported".format(function))
+        except KeyError:
+            message = "channel: {}, no TEDS with access code: {}".format(channel, args[0] if args else None)
+        except (ValueError, StructError) as e:
+            message = str(e)
+        return [pack_reply(False, message.encode("utf-8")[:0xFFFF])]
+
+    # Check the TEDS written by the NCAP and use it from now on
+    def update_teds(self, channel, access_code):
+        key = (channel, access_code)
+        if key not in self.written:
+            raise ValueError("no TEDS written with access code: {}".format(access_code))
+        image = bytes(self.written.pop(key))
+        start, end = check_length_and_checksum(image)
+        teds_data_block = teds_data_block_from_bytes(memoryview(image)[start:end])
+        if not isinstance(teds_data_block, self.get_block_class(channel, access_code)):
+            raise ValueError("written TEDS access code does not match: {}".format(access_code))
+        if channel == TIM_CHANNEL:
+            self.tim.meta_teds = teds_data_block
+            self.tim.update_max_chan()
+        else:
+            self.tim.set_channel(channel - 1, teds_data_block)
+        self.images[key] = image
+
+    # Serve the commands of one NCAP connection, in order
+    async def serve_connection(self, reader, writer):
+        self.connections.add(writer)
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(command_struct.size)
+                except asyncio.IncompleteReadError:
+                    break
+                channel, command_class, function, length = command_struct.unpack(header)
+                args = await reader.readexactly(length) if length else b""
+                reply = self.handle_command(channel, command_class, function, args)
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                writer.writelines(reply)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    # Listen on a TCP port (0 for any free port) or on a Unix socket path
+    async def start(self, host="127.0.0.1", port=0, path=None):
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self.serve_connection, path)
+            self.endpoint = "unix:" + path
+        else:
+            self.server = await asyncio.start_server(self.serve_connection, host, port)
+            host, port = self.server.sockets[0].getsockname()[:2]
+            self.endpoint = "{}:{}".format(host, port)
+        return self.endpoint
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            for writer in list(self.connections):
+                writer.close()
+            await self.server.wait_closed()
+            self.server = None
+
+# count emulated TIMs with the same TEDS, each with its own Meta-TEDS UUID
+def make_emulators(count, meta_teds, channels, max_segment=MAX_SEGMENT_OCTETS, latency=0.0):
+    emulators = []
+    for _ in range(count):
+        tim_meta_teds = meta_teds.clone()
+        tim_meta_teds.regenerate_uuid()
+        emulators.append(TEDS_TIM_Emulator(TEDS_TIM(tim_meta_teds, channels), max_segment, latency))
+    return emulators
+
+# Start the emulators on consecutive TCP ports from port (any free ports if port is 0),
+# or on Unix sockets in unix_dir. Return their endpoints
+async def start_emulators(emulators, host="127.0.0.1", port=0, unix_dir=None):
+    endpoints = []
+    for index, emulator in enumerate(emulators):
+        if unix_dir is not None:
+            path = os.path.join(unix_dir, "tim_{:05d}.sock".format(index))
+            if os.path.exists(path):
+                os.remove(path)
+            endpoints.append(await emulator.start(path=path))
+        else:
+            endpoints.append(await emulator.start(host, port + index if port else 0))
+    return endpoints
+
+async def stop_emulators(emulators):
+    await asyncio.gather(*[emulator.stop() for emulator in emulators])
+
+def load_blocks(path):
+    # The CLI helper reads plain and checksummed files, with one or more images
+    from teds_cli import read_images
+    return [teds_data_block_from_bytes(image) for image in read_images(path)[1]]
+
+async def run(options):
+    if options.tim:
+        with open(options.tim, "rb") as fh:
+            tim = TEDS_TIM.from_bytes(fh.read())
+        meta_teds, channels = tim.meta_teds, list(tim.iter_channels())
+    else:
+        meta_teds = load_blocks(options.meta)[0] if options.meta else Meta_TEDS_Data_Block.create()
+        channels = []
+        for path in options.channel:
+            channels.extend(load_blocks(path))
+    emulators = make_emulators(options.count, meta_teds, channels, options.max_segment, options.latency)
+    if options.unix_dir:
+        os.makedirs(options.unix_dir, exist_ok=True)
+    endpoints = await start_emulators(emulators, options.host, options.port, options.unix_dir)
+    if options.endpoints:
+        with open(options.endpoints, "w") as fh:
+            fh.write("\n".join(endpoints) + "\n")
+    print("{} TIMs with {} channels, from {} to {}.".format(len(emulators), len(channels), endpoints[0],
+        endpoints[-1]), flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await stop_emulators(emulators)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Emulated TIMs serving their TEDS over TCP or Unix sockets.")
+    parser.add_argument("--meta", help="Meta-TEDS file, plain or checksummed")
+    parser.add_argument("--channel", action="append", default=[], help="TransducerChannel TEDS file, repeatable")
+    parser.add_argument("--tim", help="TIM container file, instead of --meta and --channel")
+    parser.add_argument("--count", "-n", type=int, default=1, help="number of emulated TIMs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="port of the first TIM, 0 for any free ports")
+    parser.add_argument("--unix-dir", help="serve on Unix sockets in this directory instead of TCP")
+    parser.add_argument("--endpoints", help="file to write the TIM endpoints to, one per line")
+    parser.add_argument("--max-segment", type=int, default=MAX_SEGMENT_OCTETS, help="largest TEDS segment replied")
+    parser.add_argument("--latency", type=float, default=0.0, help="delay before each reply, in seconds")
+    options = parser.parse_args(argv)
+    try:
+        asyncio.run(run(options))
+    except KeyboardInterrupt:
+        pass
+    except (ValueError, OSError) as e:
+        print("Error: {}".format(e), file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Values of TEDS fields as shown and edited in the editor tables, without PyQt
+# The table model only converts them to and from the Qt roles (e.g. the include check state)
+
+from teds_utils import TEDS_Data_Block, TEDS_Field
+from teds_data_model import TEDS_ACCESS_CODES
+
+NESTED_BLOCK_TEXT = "Edit"
+
+def is_optional_field(field):
+    return isinstance(field, TEDS_Field) and field.optional
+
+def is_nested_block_field(field):
+    return isinstance(field, TEDS_Field) and isinstance(field.get_value(), TEDS_Data_Block)
+
+# Fields whose value is edited in the table: not the identification header nor nested blocks
+def is_editable_field(field):
+    return isinstance(field, TEDS_Field) and not isinstance(field.get_value(), TEDS_Data_Block)
+
+# Value of a field as shown in the table
+def value_text(field):
+    if not isinstance(field, TEDS_Field):
+        # TEDS Identification Header
+        return TEDS_ACCESS_CODES(field.teds_class).name
+    value = field.get_value()
+    if isinstance(value, TEDS_Data_Block):
+        return NESTED_BLOCK_TEXT
+    if field.enum:
+        try:
+            return field.enum(value).name
+        except ValueError:
+            pass
+    return field.get_value_as_string()
+
+# Name and value of each member of an enumeration field, as listed in its combo box
+def enum_items(field):
+    return [(member.name, int(member.value)) for member in field.enum]
+
+# Value of an enumeration field from a member value or a member name
+def enum_value(field, value):
+    if isinstance(value, str):
+        try:
+            return field.enum[value].value
+        except KeyError:
+            raise ValueError("TEDS field: {}, has no value named: {}.".format(field.get_name(), value))
+    return field.enum(value).value
+
+# Value of a field from its text, lists are written as in the table: [1.0, 2.0]
+def value_from_text(field, text):
+    value = field.value_from_string(str(text).strip())
+    if field.codec.is_list and (not isinstance(value, list) or len(value) != field.codec.count):
+        raise ValueError("TEDS field: {}, needs a list of {} values, got: {}.".format(field.get_name(),
+            field.codec.count, text))
+    return value
+
+# Set a field from its edited value cell: an enumeration member (value or name) or a text
+def set_value_from_edit(field, value):
+    if field.enum:
+        field.set_value(enum_value(field, value))
+    else:
+        field.set_value(value_from_text(field, value))
+
+# Include state of a field, None for fields that are always included
+def include_state(field):
+    return field.include if is_optional_field(field) else None
+
+# Include or exclude an optional field, return False for fields that are always included
+def set_include(field, include):
+    if not is_optional_field(field):
+        return False
+    field.include = bool(include)
+    return True
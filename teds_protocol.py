@@ -0,0 +1,81 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# TEDS access commands between an NCAP and a TIM, after the IEEE 1451.0 common commands
+# A command message is a header (TransducerChannel number, command class, command function,
+# argument length) and its arguments. A reply is a header (success flag, length) and its data.
+# Replies come in the order of the commands, so commands can be sent before earlier ones are
+# answered. TransducerChannel 0 addresses the TIM itself (Meta-TEDS).
+#
+#   Query TEDS          access code                     -> attributes, status, size, checksum, max segment
+#   Read TEDS segment   access code, offset, max length -> offset, TEDS octets
+#   Write TEDS segment  access code, offset, octets     -> nothing
+#   Update TEDS         access code                     -> nothing, the written TEDS is checked and used
+# The TEDS octets are the TEDS as stored in the TIM: length prefix, data block and checksum.
+# The max length argument is an addition, a TIM replies with at most max length octets.
+
+import asyncio
+import enum
+from struct import Struct
+
+# TransducerChannel number, command class, command function, argument length
+command_struct = Struct(">HBBH")
+# Success flag, data length
+reply_struct = Struct(">BH")
+
+# Access code
+query_args_struct = Struct(">B")
+# Attributes, status, TEDS size, TEDS checksum, max segment size
+query_reply_struct = Struct(">BBIHI")
+# Access code, offset, max length
+read_args_struct = Struct(">BII")
+# Offset, then the TEDS octets
+read_reply_struct = Struct(">I")
+# Access code, offset, then the TEDS octets
+write_args_struct = Struct(">BI")
+# Access code
+update_args_struct = Struct(">B")
+
+COMMON_CMD_CLASS = 0x01
+
+class COMMON_CMD_FUNCTIONS(enum.IntEnum):
+    QueryTEDS = 0x01
+    ReadTEDSSegment = 0x02
+    WriteTEDSSegment = 0x03
+    UpdateTEDS = 0x04
+
+REPLY_FAIL = 0x00
+REPLY_SUCCESS = 0x01
+
+TIM_CHANNEL = 0x0000
+
+# TEDS status bits of the Query TEDS reply
+TEDS_STATUS_VALID = 0x01
+
+# Largest TEDS segment sent in a reply, the reply length is 2 octets
+MAX_SEGMENT_OCTETS = 0xFFFF - read_reply_struct.size
+
+def pack_command(channel, function, args=b""):
+    return command_struct.pack(channel, COMMON_CMD_CLASS, function, len(args)) + args
+
+def pack_reply(success, data=b""):
+    return reply_struct.pack(REPLY_SUCCESS if success else REPLY_FAIL, len(data)) + data
+
+# Connect a protocol to an endpoint, "host:port" for TCP or "unix:path" for a Unix socket
+# Return the transport and the protocol
+async def connect_endpoint(protocol_factory, endpoint):
+    loop = asyncio.get_running_loop()
+    if endpoint.startswith("unix:"):
+        return await loop.create_unix_connection(protocol_factory, endpoint[len("unix:"):])
+    host, port = endpoint.rsplit(":", 1)
+    return await loop.create_connection(protocol_factory, host.strip("[]"), int(port))
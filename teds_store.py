@@ -0,0 +1,173 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Content addressed store of TEDS, identical images and nested blocks are stored once
+# Each data block (a whole image or a nested block, e.g. Units or Sampling) is keyed by the
+# hash of its encoded TLVs. Its stored object holds its TLVs, with each nested block replaced
+# by a reference to the key of that block, so a nested block shared by many images is stored once
+#
+# Object layout, a sequence of segments:
+#   0x00, length (2 octets), TLV octets      TLVs stored as they are
+#   0x01, TLV type, key                      nested block TLV, its value is the referenced block
+
+import hashlib
+import os
+from struct import Struct
+
+from teds_utils import TL_OCTETS, PLAN_BLOCK, iter_tlv
+from teds_data_model import TEDS_DATA_BLOCK_CLASSES, get_teds_access_code, teds_data_block_from_bytes
+
+KEY_OCTETS = 16
+
+SEGMENT_RAW = 0x00
+SEGMENT_BLOCK = 0x01
+
+raw_segment_struct = Struct(">BH")
+block_segment_struct = Struct(">BB{}s".format(KEY_OCTETS))
+
+# Key of a data block image
+def content_key(image):
+    return hashlib.blake2b(image, digest_size=KEY_OCTETS).digest()
+
+# Store objects as files in a directory, named by the key in hexadecimal
+# The first two digits are a subdirectory, so no directory holds too many files
+class TEDS_Directory_Backend():
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def object_path(self, key):
+        name = key.hex()
+        return os.path.join(self.path, name[:2], name[2:])
+
+    def __contains__(self, key):
+        return os.path.exists(self.object_path(key))
+
+    def __getitem__(self, key):
+        try:
+            with open(self.object_path(key), "rb") as fh:
+                return fh.read()
+        except FileNotFoundError:
+            raise KeyError(key.hex())
+
+    def __setitem__(self, key, value):
+        path = self.object_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write and rename, so an object file is always complete
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as fh:
+            fh.write(value)
+        os.replace(temp_path, path)
+
+class TEDS_Content_Store():
+
+    # Objects are kept in the backend, a dictionary (the default) or a TEDS_Directory_Backend
+    def __init__(self, backend=None):
+        self.backend = {} if backend is None else backend
+        # Octets of the images saved, and of the objects actually stored
+        self.logical_octets = 0
+        self.stored_octets = 0
+        self.objects = 0
+
+    # Save a data block, return its key
+    def save(self, teds_data_block):
+        return self.save_image(teds_data_block.to_bytes(), type(teds_data_block))
+
+    # Save a data block image, its block class tells which TLVs are nested blocks
+    # If no block class is given, it is chosen from the access code in the image header
+    def save_image(self, image, block_class=None):
+        image = bytes(image)
+        if block_class is None:
+            block_class = TEDS_DATA_BLOCK_CLASSES[get_teds_access_code(image)]
+        self.logical_octets += len(image)
+        return self._save_block(image, block_class)
+
+    def _save_block(self, image, block_class):
+        key = content_key(image)
+        if key in self.backend:
+            # The block and all its nested blocks are already stored
+            return key
+        prototype = block_class.get_prototype()
+        plan = prototype.get_codec_plan()
+        segments = []
+        raw_start = 0
+        for field_type, field_length, seek in iter_tlv(image):
+            index = plan.index_by_type.get(field_type)
+            if index is None or plan.kinds[index] != PLAN_BLOCK:
+                continue
+            # Nested block: store it apart, and the TLVs before it as they are
+            if seek - TL_OCTETS > raw_start:
+                segments.append(self._raw_segment(image[raw_start:seek - TL_OCTETS]))
+            nested_class = type(prototype.fields[index].get_value())
+            nested_key = self._save_block(image[seek:seek + field_length], nested_class)
+            segments.append(block_segment_struct.pack(SEGMENT_BLOCK, field_type, nested_key))
+            raw_start = seek + field_length
+        if raw_start < len(image):
+            segments.append(self._raw_segment(image[raw_start:]))
+        stored = b"".join(segments)
+        self.backend[key] = stored
+        self.stored_octets += len(stored)
+        self.objects += 1
+        return key
+
+    def _raw_segment(self, octets):
+        # Runs longer than the 2 octets length are split
+        segments = []
+        for start in range(0, len(octets), 0xFFFF):
+            run = octets[start:start + 0xFFFF]
+            segments.append(raw_segment_struct.pack(SEGMENT_RAW, len(run)) + run)
+        return b"".join(segments)
+
+    # Image of a stored block, with its nested blocks put back
+    def get_image(self, key):
+        stored = self.backend[key]
+        parts = []
+        offset = 0
+        while offset < len(stored):
+            kind = stored[offset]
+            if kind == SEGMENT_RAW:
+                length = raw_segment_struct.unpack_from(stored, offset)[1]
+                offset += raw_segment_struct.size
+                parts.append(stored[offset:offset + length])
+                offset += length
+            elif kind == SEGMENT_BLOCK:
+                field_type, nested_key = block_segment_struct.unpack_from(stored, offset)[1:]
+                offset += block_segment_struct.size
+                nested = self.get_image(nested_key)
+                parts.append(bytes([field_type, len(nested)]))
+                parts.append(nested)
+            else:
+                raise ValueError("TEDS store object: {}, unknown segment: {}.".format(key.hex(), kind))
+        image = b"".join(parts)
+        if content_key(image) != key:
+            raise ValueError("TEDS store object: {}, content does not match its key.".format(key.hex()))
+        return image
+
+    # Load a stored data block, of the class given or else of the class in its image header
+    def load(self, key, block_class=None, lazy=False):
+        image = self.get_image(key)
+        if block_class is None:
+            return teds_data_block_from_bytes(image, lazy)
+        teds_data_block = block_class.create()
+        teds_data_block.load_from_bytearray(image, lazy)
+        return teds_data_block
+
+    def __contains__(self, key):
+        return key in self.backend
+
+    # Octets saved over the octets stored
+    def get_dedup_ratio(self):
+        if not self.stored_octets:
+            return 0.0
+        return self.logical_octets / self.stored_octets
@@ -0,0 +1,139 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Incremental readers of TEDS images from binary streams (files, pipes, socket files)
+# A stream holds one or more concatenated TEDS images, either plain, as written by to_bytes,
+# or framed with a length prefix and a checksum, as written by to_bytes_with_length_and_checksum
+
+from teds_utils import TL_OCTETS, LENGTH_OCTETS, CHECKSUM_OCTETS, length_struct, check_length_and_checksum, parse_tlv_blocks
+from teds_data_model import teds_data_block_from_bytes
+
+# Stream framings
+FRAMING_PLAIN = "plain"
+FRAMING_CHECKSUMMED = "checksummed"
+
+# TLV type of the TEDS Identification Header, first TLV of every plain TEDS image
+TEDS_ID_TYPE = 0x03
+
+# Octets requested from the stream on each read
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+# Buffer over a binary stream, holds only the octets not yet consumed
+class TEDS_Stream_Buffer():
+
+    def __init__(self, stream, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        # Position of the first octet not yet consumed
+        self.start = 0
+        self.eof = False
+
+    def available(self):
+        return len(self.buffer) - self.start
+
+    # Read from the stream until n octets are available, return False if the stream ends first
+    def fill(self, n):
+        while self.available() < n and not self.eof:
+            if self.start:
+                # Drop the consumed octets before growing the buffer
+                del self.buffer[:self.start]
+                self.start = 0
+            chunk = self.stream.read(max(self.chunk_size, n - self.available()))
+            if not chunk:
+                self.eof = True
+            else:
+                self.buffer += chunk
+        return self.available() >= n
+
+    def peek(self, index):
+        return self.buffer[self.start + index]
+
+    # Consume n octets and return a copy of them
+    def take(self, n):
+        data = bytes(self.buffer[self.start:self.start + n])
+        self.start += n
+        return data
+
+# Yield each plain TEDS image of the stream
+# Images are split at the TEDS Identification Header TLV that starts each one
+def _iter_plain_images(reader):
+    while reader.fill(1):
+        if reader.peek(0) != TEDS_ID_TYPE:
+            raise ValueError("TEDS stream, image does not start with a TEDS Identification Header.")
+        length = 0
+        while True:
+            if not reader.fill(length + TL_OCTETS):
+                if reader.available() != length:
+                    raise ValueError("TEDS stream, truncated TLV at the end of the stream.")
+                break
+            if length and reader.peek(length) == TEDS_ID_TYPE:
+                # Next image header
+                break
+            tlv_length = TL_OCTETS + reader.peek(length + 1)
+            if not reader.fill(length + tlv_length):
+                raise ValueError("TEDS stream, truncated TLV at the end of the stream.")
+            length += tlv_length
+        yield reader.take(length)
+
+# Yield the TEDS data block of each checksummed TEDS image of the stream
+def _iter_checksummed_images(reader, verify):
+    while reader.fill(1):
+        if not reader.fill(LENGTH_OCTETS):
+            raise ValueError("TEDS stream, truncated length at the end of the stream.")
+        length = length_struct.unpack_from(reader.buffer, reader.start)[0]
+        if not reader.fill(LENGTH_OCTETS + length):
+            raise ValueError("TEDS stream, truncated image at the end of the stream.")
+        image = reader.take(LENGTH_OCTETS + length)
+        if verify:
+            start, end = check_length_and_checksum(image)
+        else:
+            start, end = LENGTH_OCTETS, len(image) - CHECKSUM_OCTETS
+        yield memoryview(image)[start:end]
+
+# Framing of a buffer holding TEDS images
+# Plain images start with the Identification Header TLV, checksummed ones with a length prefix,
+# whose first octet is only 0x03 for images of 48 MiB or more
+def detect_framing(buffer):
+    if len(buffer) and buffer[0] == TEDS_ID_TYPE:
+        return FRAMING_PLAIN
+    return FRAMING_CHECKSUMMED
+
+# Yield the TEDS data block octets of each image of a binary stream
+# Checksummed images yield only the data block, and are checked if verify is set
+def iter_teds_images(stream, framing=FRAMING_PLAIN, verify=True, chunk_size=DEFAULT_CHUNK_SIZE):
+    reader = TEDS_Stream_Buffer(stream, chunk_size)
+    if framing == FRAMING_PLAIN:
+        return _iter_plain_images(reader)
+    elif framing == FRAMING_CHECKSUMMED:
+        return _iter_checksummed_images(reader, verify)
+    raise ValueError("TEDS stream framing: {}, unknown.".format(framing))
+
+# Yield a decoded TEDS data block for each image of a binary stream
+# If no block class is given, it is chosen from the access code in each image header
+# If lazy is set, values are only decoded when accessed
+def iter_teds_blocks(stream, framing=FRAMING_PLAIN, block_class=None, verify=True, chunk_size=DEFAULT_CHUNK_SIZE,
+        lazy=False):
+    for image in iter_teds_images(stream, framing, verify, chunk_size):
+        if block_class is None:
+            yield teds_data_block_from_bytes(image, lazy)
+        else:
+            teds_data_block = block_class.create()
+            teds_data_block.load_from_bytearray(image, lazy)
+            yield teds_data_block
+
+# Yield the image index and each top level TLV of each image of a binary stream, without decoding
+def iter_tlv_records(stream, framing=FRAMING_PLAIN, verify=True, chunk_size=DEFAULT_CHUNK_SIZE):
+    for index, image in enumerate(iter_teds_images(stream, framing, verify, chunk_size)):
+        for tlv_block in parse_tlv_blocks(image):
+            yield index, tlv_block
@@ -17,17 +17,9 @@ class Ui_auxWindow(object):
         auxWindow.resize(800, 600)
         self.centralwidget = QtWidgets.QWidget(auxWindow)
         self.centralwidget.setObjectName("centralwidget")
-        self.tableWidget = QtWidgets.QTableWidget(self.centralwidget)
+        self.tableWidget = QtWidgets.QTableView(self.centralwidget)
         self.tableWidget.setGeometry(QtCore.QRect(20, 10, 761, 491))
         self.tableWidget.setObjectName("tableWidget")
-        self.tableWidget.setColumnCount(3)
-        self.tableWidget.setRowCount(0)
-        item = QtWidgets.QTableWidgetItem()
-        self.tableWidget.setHorizontalHeaderItem(0, item)
-        item = QtWidgets.QTableWidgetItem()
-        self.tableWidget.setHorizontalHeaderItem(1, item)
-        item = QtWidgets.QTableWidgetItem()
-        self.tableWidget.setHorizontalHeaderItem(2, item)
         auxWindow.setCentralWidget(self.centralwidget)
         self.menubar = QtWidgets.QMenuBar(auxWindow)
         self.menubar.setGeometry(QtCore.QRect(0, 0, 800, 26))
@@ -43,12 +35,6 @@ class Ui_auxWindow(object):
     def retranslateUi(self, auxWindow):
         _translate = QtCore.QCoreApplication.translate
         auxWindow.setWindowTitle(_translate("auxWindow", "TEDS Sub-Block"))
-        item = self.tableWidget.horizontalHeaderItem(0)
-        item.setText(_translate("auxWindow", "Field"))
-        item = self.tableWidget.horizontalHeaderItem(1)
-        item.setText(_translate("auxWindow", "Value"))
-        item = self.tableWidget.horizontalHeaderItem(2)
-        item.setText(_translate("auxWindow", "Include"))
 
 
 if __name__ == "__main__":
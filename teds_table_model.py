@@ -0,0 +1,153 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Table model of the fields of a TEDS data block, for the editor table views
+# One row per field: description, value and, for optional fields, an include check box.
+# The view reads the fields through the model, no widget is created per row: enumeration values
+# are edited with a combo box and other values with a line edit, created by the delegate only
+# while a cell is being edited. Nested blocks show "Edit", a click opens them in their own window.
+
+from PyQt5 import QtWidgets, QtCore
+
+from teds_utils import TEDS_Field
+from teds_field_values import is_optional_field, is_nested_block_field, is_editable_field, value_text, enum_items, \
+    set_value_from_edit, include_state, set_include
+
+COLUMN_FIELD = 0
+COLUMN_VALUE = 1
+COLUMN_INCLUDE = 2
+
+TABLE_HEADERS = ("Field", "Value", "Include")
+
+class TEDS_Table_Model(QtCore.QAbstractTableModel):
+
+    def __init__(self, teds_data_block, parent=None):
+        super(TEDS_Table_Model, self).__init__(parent)
+        self.teds_data_block = teds_data_block
+
+    # Show another data block, e.g. one just loaded from a file
+    def set_teds_data_block(self, teds_data_block):
+        self.beginResetModel()
+        self.teds_data_block = teds_data_block
+        self.endResetModel()
+
+    def get_field(self, index):
+        return self.teds_data_block.fields[index.row()]
+
+    # The value of a field was changed outside the model, e.g. a new UUID
+    def field_changed(self, row):
+        value_index = self.index(row, COLUMN_VALUE)
+        self.dataChanged.emit(value_index, value_index)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.teds_data_block.fields)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(TABLE_HEADERS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole:
+            return TABLE_HEADERS[section]
+        return super(TEDS_Table_Model, self).headerData(section, orientation, role)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        field = self.get_field(index)
+        column = index.column()
+        if column == COLUMN_FIELD and role == QtCore.Qt.DisplayRole:
+            return field.get_description()
+        if column == COLUMN_VALUE and role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            return value_text(field)
+        if column == COLUMN_INCLUDE and role == QtCore.Qt.CheckStateRole:
+            include = include_state(field)
+            if include is not None:
+                return QtCore.Qt.Checked if include else QtCore.Qt.Unchecked
+        return None
+
+    def flags(self, index):
+        flags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+        field = self.get_field(index)
+        if index.column() == COLUMN_VALUE and is_editable_field(field):
+            flags |= QtCore.Qt.ItemIsEditable
+        elif index.column() == COLUMN_INCLUDE and is_optional_field(field):
+            flags |= QtCore.Qt.ItemIsUserCheckable
+        return flags
+
+    def setData(self, index, value, role=QtCore.Qt.EditRole):
+        if not index.isValid():
+            return False
+        field = self.get_field(index)
+        if index.column() == COLUMN_VALUE and role == QtCore.Qt.EditRole:
+            try:
+                # Enumeration values come from the combo box, as the member value
+                set_value_from_edit(field, value)
+            except (ValueError, TypeError, OverflowError) as err:
+                print('Invalid value for {}: {}'.format(field.get_name(), err))
+                return False
+        elif index.column() == COLUMN_INCLUDE and role == QtCore.Qt.CheckStateRole:
+            if not set_include(field, value == QtCore.Qt.Checked):
+                return False
+        else:
+            return False
+        self.dataChanged.emit(index, index)
+        return True
+
+# Creates the editor of a value cell when it is edited, and drops it after
+class TEDS_Field_Delegate(QtWidgets.QStyledItemDelegate):
+
+    def createEditor(self, parent, option, index):
+        field = index.model().get_field(index)
+        if isinstance(field, TEDS_Field) and field.enum:
+            combo = QtWidgets.QComboBox(parent)
+            for name, value in enum_items(field):
+                combo.addItem(name, value)
+            # Commit as soon as a value is chosen
+            combo.activated.connect(lambda value, editor=combo: self.commitData.emit(editor))
+            return combo
+        return super(TEDS_Field_Delegate, self).createEditor(parent, option, index)
+
+    def setEditorData(self, editor, index):
+        if isinstance(editor, QtWidgets.QComboBox):
+            position = editor.findData(int(index.model().get_field(index).get_value()))
+            editor.setCurrentIndex(max(position, 0))
+            return
+        super(TEDS_Field_Delegate, self).setEditorData(editor, index)
+
+    def setModelData(self, editor, model, index):
+        if isinstance(editor, QtWidgets.QComboBox):
+            model.setData(index, editor.currentData(), QtCore.Qt.EditRole)
+            return
+        super(TEDS_Field_Delegate, self).setModelData(editor, model, index)
+
+# Show a data block in a table view, return its model
+# open_block is called with the field of a nested block when its value cell is clicked
+def setup_teds_table_view(view, teds_data_block, open_block=None):
+    model = TEDS_Table_Model(teds_data_block, view)
+    view.setModel(model)
+    view.setItemDelegateForColumn(COLUMN_VALUE, TEDS_Field_Delegate(view))
+    view.setEditTriggers(QtWidgets.QAbstractItemView.DoubleClicked | QtWidgets.QAbstractItemView.SelectedClicked
+        | QtWidgets.QAbstractItemView.EditKeyPressed | QtWidgets.QAbstractItemView.AnyKeyPressed)
+    if open_block is not None:
+        def clicked(index):
+            field = model.get_field(index)
+            if index.column() == COLUMN_VALUE and is_nested_block_field(field):
+                open_block(field)
+        view.clicked.connect(clicked)
+    return model
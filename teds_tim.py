@@ -0,0 +1,201 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# TIM container: the Meta-TEDS of a TIM and its TransducerChannel TEDS in one image
+# MaxChan of the Meta-TEDS is kept equal to the number of channels
+#
+# Image layout, big endian, offsets from the start of the image:
+#   header        magic "TIMT", version, flags (0), channel count, Meta-TEDS offset and length
+#   offset table  offset and length of each channel image, in channel order
+#   images        Meta-TEDS and channels, each with the length and checksum framing
+# A channel is read from its table entry alone, the channels before it are not decoded
+
+from struct import Struct
+
+from teds_utils import LENGTH_OCTETS, CHECKSUM_OCTETS, check_length_and_checksum
+from teds_data_model import Meta_TEDS_Data_Block, TransducerChannel_TEDS_Data_Block
+
+TIM_MAGIC = b"TIMT"
+TIM_VERSION = 1
+
+# Magic, version, flags, channel count, Meta-TEDS offset, Meta-TEDS length
+tim_header_struct = Struct(">4sBBHII")
+# Channel image offset and length
+tim_entry_struct = Struct(">II")
+
+# Offset and length of the Meta-TEDS and of each channel image of a TIM image
+def read_tim_table(buffer):
+    if len(buffer) < tim_header_struct.size:
+        raise ValueError("TIM image too short: {} octets.".format(len(buffer)))
+    magic, version, flags, count, meta_offset, meta_length = tim_header_struct.unpack_from(buffer, 0)
+    if magic != TIM_MAGIC:
+        raise ValueError("TIM image magic: {}, should be: {}.".format(bytes(magic), TIM_MAGIC))
+    if version != TIM_VERSION:
+        raise ValueError("TIM image version: {}, not supported.".format(version))
+    if tim_header_struct.size + count * tim_entry_struct.size > len(buffer):
+        raise ValueError("TIM image truncated offset table.")
+    entries = [tim_entry_struct.unpack_from(buffer, tim_header_struct.size + index * tim_entry_struct.size)
+        for index in range(count)]
+    for offset, length in [(meta_offset, meta_length)] + entries:
+        if offset + length > len(buffer):
+            raise ValueError("TIM image entry at offset {}, exceeds the image.".format(offset))
+    return (meta_offset, meta_length), entries
+
+# Load a framed TEDS image at buffer[offset:offset+length] into a data block
+def _load_framed(teds_data_block, buffer, offset, length, verify, lazy):
+    end = offset + length
+    if verify:
+        start, block_end = check_length_and_checksum(buffer, offset, end)
+    else:
+        start, block_end = offset + LENGTH_OCTETS, end - CHECKSUM_OCTETS
+    teds_data_block.load_from_buffer(buffer, start, block_end, lazy)
+    return teds_data_block
+
+# Decode channel index (0 for the first channel) of a TIM image, without decoding any other channel
+def read_tim_channel(buffer, index, verify=True, lazy=False):
+    view = memoryview(buffer)
+    if len(view) < tim_header_struct.size:
+        raise ValueError("TIM image too short: {} octets.".format(len(view)))
+    count = tim_header_struct.unpack_from(view, 0)[3]
+    if not 0 <= index < count:
+        raise IndexError("TIM channel index: {}, the TIM has {} channels.".format(index, count))
+    offset, length = tim_entry_struct.unpack_from(view, tim_header_struct.size + index * tim_entry_struct.size)
+    if offset + length > len(view):
+        raise ValueError("TIM channel {}, exceeds the image.".format(index))
+    return _load_framed(TransducerChannel_TEDS_Data_Block.create(), view, offset, length, verify, lazy)
+
+class TEDS_TIM():
+
+    def __init__(self, meta_teds=None, channels=None):
+        if meta_teds is None:
+            meta_teds = Meta_TEDS_Data_Block.create()
+        self.meta_teds = meta_teds
+        # Decoded channels, None for the channels of a loaded image not accessed yet
+        self.channels = []
+        # Framed image of each channel in the loaded buffer, None for new, replaced or decoded channels
+        self.channel_images = []
+        self.buffer = None
+        self.verify = True
+        for teds_data_block in channels or []:
+            self.channels.append(teds_data_block)
+            self.channel_images.append(None)
+        self.update_max_chan()
+
+    def __len__(self):
+        return len(self.channels)
+
+    # Keep MaxChan equal to the number of channels
+    def update_max_chan(self):
+        if self.meta_teds.max_chan_field.get_value() != len(self.channels):
+            self.meta_teds.max_chan_field.set_value(len(self.channels))
+
+    # Channel at index (0 for the first channel), decoded on first access
+    def get_channel(self, index):
+        teds_data_block = self.channels[index]
+        if teds_data_block is None:
+            offset, length = self.channel_images[index]
+            teds_data_block = _load_framed(TransducerChannel_TEDS_Data_Block.create(), self.buffer,
+                offset, length, self.verify, False)
+            self.channels[index] = teds_data_block
+            # The decoded block may be changed, it is encoded from now on
+            self.channel_images[index] = None
+        return teds_data_block
+
+    def iter_channels(self):
+        for index in range(len(self.channels)):
+            yield self.get_channel(index)
+
+    # Add a channel (a new default one if none is given), return it
+    def add_channel(self, teds_data_block=None):
+        if teds_data_block is None:
+            teds_data_block = TransducerChannel_TEDS_Data_Block.create()
+        self.channels.append(teds_data_block)
+        self.channel_images.append(None)
+        self.update_max_chan()
+        return teds_data_block
+
+    def set_channel(self, index, teds_data_block):
+        self.channels[index] = teds_data_block
+        self.channel_images[index] = None
+
+    def remove_channel(self, index):
+        teds_data_block = self.channels.pop(index)
+        self.channel_images.pop(index)
+        self.update_max_chan()
+        return teds_data_block
+
+    # Number of octets of the framed image of a channel
+    # Channels of the loaded image that were not accessed keep their image
+    def _channel_length(self, index):
+        if self.channel_images[index] is not None:
+            return self.channel_images[index][1]
+        return self.channels[index].get_encoded_length() + LENGTH_OCTETS + CHECKSUM_OCTETS
+
+    def _encode_channel_into(self, index, buffer, offset):
+        teds_data_block = self.channels[index]
+        if self.channel_images[index] is not None:
+            image_offset, length = self.channel_images[index]
+            buffer[offset:offset+length] = self.buffer[image_offset:image_offset+length]
+            return offset + length
+        return teds_data_block.encode_with_length_and_checksum_into(buffer, offset)
+
+    def get_encoded_length(self):
+        self.update_max_chan()
+        length = tim_header_struct.size + len(self.channels) * tim_entry_struct.size
+        length += self.meta_teds.get_encoded_length() + LENGTH_OCTETS + CHECKSUM_OCTETS
+        for index in range(len(self.channels)):
+            length += self._channel_length(index)
+        return length
+
+    # Write the TIM image in the buffer at offset, return the offset after it
+    # The offsets in the image are counted from its start
+    def encode_into(self, buffer, offset):
+        self.update_max_chan()
+        start = offset
+        offset += tim_header_struct.size + len(self.channels) * tim_entry_struct.size
+        meta_offset = offset
+        offset = self.meta_teds.encode_with_length_and_checksum_into(buffer, offset)
+        tim_header_struct.pack_into(buffer, start, TIM_MAGIC, TIM_VERSION, 0, len(self.channels),
+            meta_offset - start, offset - meta_offset)
+        for index in range(len(self.channels)):
+            channel_offset = offset
+            offset = self._encode_channel_into(index, buffer, offset)
+            tim_entry_struct.pack_into(buffer, start + tim_header_struct.size + index * tim_entry_struct.size,
+                channel_offset - start, offset - channel_offset)
+        return offset
+
+    def to_bytes(self):
+        barray = bytearray(self.get_encoded_length())
+        self.encode_into(barray, 0)
+        return barray
+
+    # Load a TIM image, the Meta-TEDS is decoded, the channels only when accessed
+    # The buffer is kept (not copied) and must not change while the container uses it
+    def load_from_bytearray(self, buffer, verify=True):
+        view = memoryview(buffer)
+        (meta_offset, meta_length), entries = read_tim_table(view)
+        meta_teds = _load_framed(Meta_TEDS_Data_Block.create(), view, meta_offset, meta_length, verify, False)
+        if meta_teds.max_chan_field.get_value() != len(entries):
+            raise ValueError("TIM image MaxChan is: {}, the image has {} channels."
+                .format(meta_teds.max_chan_field.get_value(), len(entries)))
+        self.meta_teds = meta_teds
+        self.buffer = view
+        self.verify = verify
+        self.channels = [None] * len(entries)
+        self.channel_images = list(entries)
+
+    @classmethod
+    def from_bytes(cls, buffer, verify=True):
+        tim = cls()
+        tim.load_from_bytearray(buffer, verify)
+        return tim
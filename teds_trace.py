@@ -0,0 +1,131 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Tracing hooks of the TEDS encoder and decoder
+# The encoder and decoder only check if the subscribers list is empty,
+# events are created and dispatched only when a subscriber is attached
+
+from sys import stdout
+from time import perf_counter
+from contextlib import contextmanager
+
+# Trace events
+TRACE_ENCODE = "encode"
+TRACE_DECODE = "decode"
+
+# Attached subscribers, the list object is shared with the encoder and decoder
+subscribers = []
+
+def subscribe(subscriber):
+    subscribers.append(subscriber)
+    return subscriber
+
+def unsubscribe(subscriber):
+    subscribers.remove(subscriber)
+
+# Attach a subscriber while a block of code runs
+@contextmanager
+def tracing(subscriber):
+    subscribe(subscriber)
+    try:
+        yield subscriber
+    finally:
+        unsubscribe(subscriber)
+
+# Dispatch functions, called by the encoder and decoder only when subscribers is not empty
+def block_start(event, block):
+    for subscriber in subscribers:
+        subscriber.block_start(event, block)
+
+def block_end(event, block, buffer, start, end):
+    for subscriber in subscribers:
+        subscriber.block_end(event, block, buffer, start, end)
+
+# The field TLV is buffer[start:end], field is None for TLV types unknown to the block
+def field_event(event, block, field, buffer, start, end):
+    for subscriber in subscribers:
+        subscriber.field(event, block, field, buffer, start, end)
+
+# Base subscriber, ignores all events
+class TEDS_Trace_Subscriber():
+
+    def block_start(self, event, block):
+        pass
+
+    def block_end(self, event, block, buffer, start, end):
+        pass
+
+    def field(self, event, block, field, buffer, start, end):
+        pass
+
+# Log each field encoded or decoded
+class TEDS_Logging_Subscriber(TEDS_Trace_Subscriber):
+
+    # logging is only imported when a logging subscriber is created
+    def __init__(self, logger=None, level=None):
+        import logging
+        self.logger = logger or logging.getLogger("teds")
+        self.level = logging.DEBUG if level is None else level
+
+    def block_start(self, event, block):
+        self.logger.log(self.level, "Start %s of block: %s", event, type(block).__name__)
+
+    def block_end(self, event, block, buffer, start, end):
+        self.logger.log(self.level, "End %s of block: %s, length: %d", event, type(block).__name__, end - start)
+
+    def field(self, event, block, field, buffer, start, end):
+        if field is None:
+            self.logger.log(self.level, "Skipped unknown field type: %d, length: %d", buffer[start], end - start - 2)
+        elif event == TRACE_ENCODE:
+            self.logger.log(self.level, "Writing bytes from field: %s, value: %s", field.name, field.get_value())
+        else:
+            self.logger.log(self.level, "Loading field: %s, value: %s", field.name, field.get_value())
+
+# Write the type, length and value octets of each field TLV, as hex
+class TEDS_Hex_Dump_Subscriber(TEDS_Trace_Subscriber):
+
+    def __init__(self, stream=stdout):
+        self.stream = stream
+
+    def field(self, event, block, field, buffer, start, end):
+        if event == TRACE_ENCODE:
+            prefix = "Writing"
+        else:
+            prefix = "Loading"
+        self.stream.write("{} field type: {}, length: {}, value: {}\n".format(prefix, buffer[start],
+            buffer[start+1], bytes(buffer[start+2:end]).hex('-')))
+
+# Accumulate the count and time of encodings and decodings, by event and block class
+# Time of nested blocks is also counted in the blocks holding them
+class TEDS_Timing_Subscriber(TEDS_Trace_Subscriber):
+
+    def __init__(self):
+        # (event, block class name): [count, total seconds]
+        self.totals = {}
+        self.started = []
+
+    def block_start(self, event, block):
+        self.started.append(perf_counter())
+
+    def block_end(self, event, block, buffer, start, end):
+        elapsed = perf_counter() - self.started.pop()
+        total = self.totals.setdefault((event, type(block).__name__), [0, 0.0])
+        total[0] += 1
+        total[1] += elapsed
+
+    def report(self):
+        lines = []
+        for (event, name), (count, seconds) in sorted(self.totals.items()):
+            lines.append("{} {}: {} times, {:.6f} s total, {:.2f} us each"
+                .format(event, name, count, seconds, 1e6 * seconds / count))
+        return "\n".join(lines)
@@ -11,30 +11,76 @@
 # * http://digi2.fe.up.pt                                                                 *
 # *****************************************************************************************
 
-from ctypes import sizeof
-from dataclasses import fields
-from operator import length_hint
-import uuid
-from sys import getsizeof, stdout
+import enum
 import numpy as np
-from numpy import uint64 ,float32, uint16, int16, uint32, int32, uint8, int8, frombuffer
-from struct import unpack, pack
+from numpy import uint64 ,float32, uint16, int16, uint32, int32, uint8, int8
+from struct import Struct, error as StructError
 from json import loads
+import teds_trace
+from teds_trace import subscribers as trace_subscribers, TRACE_ENCODE, TRACE_DECODE
 
 # Type 4, UUID, Globally Unique Identifier UUID, size 10
-# TO-DO, implement as in the standard definition
+# IEEE 1451.0 UUID of a location (north and west in degrees) and date, see teds_uuid
+# Without a location, the default generator of teds_uuid is used if one is set, else random octets
 def generate_uuid(north = None, west = None, year = None, date = None, sequence = None):
+    import teds_uuid
+    if north is not None or west is not None:
+        return teds_uuid.make_uuid(north or 0.0, west or 0.0, 0, year, date, sequence or 0)
+    if teds_uuid.get_default_generator() is not None:
+        return teds_uuid.get_default_generator().generate(date)
+    # uuid (and platform, which it imports) is only loaded when a UUID is generated
+    import uuid
     return uuid.uuid4().bytes[:10]
 
-def calc_length(data_block):
-    return getsizeof(data_block, 0)
 def calc_checksum(byte_array):
-    
-    sum=0
-    for byte in byte_array:
-        sum += byte
-    
-    return 0xFFFF - (sum%0xFFFF)
+    return checksum_from_sum(calc_byte_sum(byte_array))
+
+# Checksum from the sum of all octets it covers
+def checksum_from_sum(byte_sum):
+    return 0xFFFF - (byte_sum%0xFFFF)
+
+# Sum of all octets of a buffer (bytes, bytearray, memoryview, mmap)
+def calc_byte_sum(byte_array):
+    try:
+        octets = np.frombuffer(byte_array, dtype=np.uint8)
+    except TypeError:
+        # Not a buffer, e.g. a list of octets
+        return sum(byte_array)
+    return int(octets.sum(dtype=np.uint64))
+
+# Sum of the octets of each image in a batch packed in one buffer
+# offsets has N+1 positions, image i is buffer[offsets[i]:offsets[i+1]]
+def calc_byte_sums(buffer, offsets):
+    offsets = np.asarray(offsets, dtype=np.int64)
+    return calc_segment_sums(buffer, offsets[:-1], offsets[1:])
+
+# Sum of the octets of each segment buffer[starts[i]:ends[i]]
+# Segments must be sorted and must not overlap
+def calc_segment_sums(buffer, starts, ends):
+    octets = np.frombuffer(buffer, dtype=np.uint8)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if len(starts) and (starts[0] < 0 or ends[-1] > len(octets) or np.any(ends < starts)
+            or np.any(starts[1:] < ends[:-1])):
+        raise ValueError("TEDS image offsets out of the buffer or not sorted.")
+    sums = np.zeros(len(starts), dtype=np.uint64)
+    # reduceat does not handle empty segments, their sum stays 0
+    non_empty = ends > starts
+    if not np.any(non_empty):
+        return sums
+    # reduceat sums from each bound to the next one, the segment ends are interleaved
+    # so that the octets after each segment fall in a separate, discarded, segment
+    bounds = np.empty(2 * np.count_nonzero(non_empty), dtype=np.int64)
+    bounds[0::2] = starts[non_empty]
+    bounds[1::2] = ends[non_empty]
+    if bounds[-1] == len(octets):
+        bounds = bounds[:-1]
+    sums[non_empty] = np.add.reduceat(octets, bounds, dtype=np.uint64)[0::2]
+    return sums
+
+# Checksum of each image in a batch packed in one buffer, see calc_byte_sums
+def calc_checksums(buffer, offsets):
+    return (0xFFFF - (calc_byte_sums(buffer, offsets) % 0xFFFF)).astype(np.uint16)
 
 # Utility functions to convert data
 # Functions to convert a string to simple type
@@ -47,233 +93,964 @@ string_to_int32 = lambda value : int32(value)
 string_to_uint64 = lambda value : uint64(value)
 string_to_float32 = lambda value : float32(value)
 # Functions to convert a literal string list to list of type
-string_list_to_uint8 = lambda flist : np.array(loads(flist),dtype="uint8")[0]
-string_list_to_int8 = lambda flist : np.array(loads(flist),dtype="int8")[0]
-string_list_to_uint16 = lambda flist : np.array(loads(flist),dtype="uint16")[0]
-string_list_to_int16 = lambda flist : np.array(loads(flist),dtype="int16")[0]
-string_list_to_uint32 = lambda flist : np.array(loads(flist),dtype="uint32")[0]
-string_list_to_int32 = lambda flist : np.array(loads(flist),dtype="int32")[0]
-string_list_to_float32 = lambda flist : np.array(loads(flist),dtype="float")[0]
-string_list_to_uint64 = lambda flist : np.array(loads(flist),dtype="uint64")[0]
-
-# Functions to convert bytes to simple type
-bytes_to_uint8 = lambda value : unpack('>B', value)[0]
-bytes_to_int8 = lambda value : unpack('>b', value)[0]
-bytes_to_uint16 = lambda value : unpack('>H', value)[0]
-bytes_to_int16 = lambda value : unpack('>h', value)[0]
-bytes_to_uint32 = lambda value : unpack('>I', value)[0]
-bytes_to_int32 = lambda value : unpack('>i', value)[0]
-bytes_to_float32 = lambda value : unpack('>f', value)[0]
-bytes_to_uint64 = lambda value : unpack('>L', value)[0]
-
-# Functions to convert simple type to bytes
-uint8_to_bytes = lambda value : bytearray(pack(">B", value))
-int8_to_bytes = lambda value : bytearray(pack(">b", value))
-uint16_to_bytes = lambda value : bytearray(pack(">H", value))
-int16_to_bytes = lambda value : bytearray(pack(">h", value))
-uint32_to_bytes = lambda value : bytearray(pack(">I", value)) 
-int32_to_bytes = lambda value : bytearray(pack(">i", value)) 
-uint64_to_bytes = lambda value : bytearray(pack(">L", value)) 
-float32_to_bytes = lambda value : bytearray(pack(">f", value)) 
-# Functions to convert list of types to list of bytes
-list_of_uint8_to_bytes = lambda flist : b''.join([pack(">B",x) for x in flist])
-list_of_int8_to_bytes = lambda flist : b''.join([pack(">b",x) for x in flist])
-list_of_uint16_to_bytes = lambda flist : b''.join([pack(">H",x) for x in flist])
-list_of_int16_to_bytes = lambda flist : b''.join([pack(">h",x) for x in flist])
-list_of_uint32_to_bytes = lambda flist : b''.join([pack(">I",x) for x in flist])
-list_of_int32_to_bytes = lambda flist : b''.join([pack(">i",x) for x in flist])
-list_of_uint64_to_bytes = lambda flist : b''.join([pack(">L",x) for x in flist])
-list_of_float32_to_bytes = lambda flist : b''.join([pack(">f",x) for x in flist])
-# Functions to convert bytes to list of type
-byte_list_to_uint8 = lambda flist : [unpack('>B',flist[x:x+1])[0] for x in range(0,len(flist))]
-byte_list_to_int8 = lambda flist : [unpack('>b',flist[x:x+1])[0] for x in range(0,len(flist))]
-byte_list_to_uint16 = lambda flist : [unpack('>H',flist[x:x+2])[0] for x in range(0,len(flist),2)]
-byte_list_to_int16 = lambda flist : [unpack('>h',flist[x:x+2])[0] for x in range(0,len(flist),2)]
-byte_list_to_uint32 = lambda flist : [unpack('>I',flist[x:x+4])[0] for x in range(0,len(flist),4)]
-byte_list_to_int32 = lambda flist : [unpack('>i',flist[x:x+4])[0] for x in range(0,len(flist),4)]
-byte_list_to_uint64 = lambda flist : [unpack('>L',flist[x:x+4])[0] for x in range(0,len(flist),8)]
-byte_list_to_float32 = lambda flist : [unpack('>f',flist[x:x+4])[0] for x in range(0,len(flist),4)]
-
-# Infer what conversion function is most appropriate to a TEDS Field
-def infer_conversion_functions(teds_field):
+string_list_to_uint8 = lambda flist : np.array(loads(flist),dtype="uint8").tolist()
+string_list_to_int8 = lambda flist : np.array(loads(flist),dtype="int8").tolist()
+string_list_to_uint16 = lambda flist : np.array(loads(flist),dtype="uint16").tolist()
+string_list_to_int16 = lambda flist : np.array(loads(flist),dtype="int16").tolist()
+string_list_to_uint32 = lambda flist : np.array(loads(flist),dtype="uint32").tolist()
+string_list_to_int32 = lambda flist : np.array(loads(flist),dtype="int32").tolist()
+string_list_to_float32 = lambda flist : np.array(loads(flist),dtype="float").tolist()
+string_list_to_uint64 = lambda flist : np.array(loads(flist),dtype="uint64").tolist()
+
+# Struct format character and octet size of each supported TEDS field data type
+STRUCT_FORMATS = {
+    uint8: ('B', 1),
+    int8: ('b', 1),
+    uint16: ('H', 2),
+    int16: ('h', 2),
+    uint32: ('I', 4),
+    int32: ('i', 4),
+    uint64: ('Q', 8),
+    float32: ('f', 4),
+}
+
+# String converters of each data type, for a single value and for a list of values
+STRING_CONVERTERS = {
+    uint8: (string_to_uint8, string_list_to_uint8),
+    int8: (string_to_int8, string_list_to_int8),
+    uint16: (string_to_uint16, string_list_to_uint16),
+    int16: (string_to_int16, string_list_to_int16),
+    uint32: (string_to_uint32, string_list_to_uint32),
+    int32: (string_to_int32, string_list_to_int32),
+    uint64: (string_to_uint64, string_list_to_uint64),
+    float32: (string_to_float32, string_list_to_float32),
+}
+
+# Precompiled encoder/decoder of a TEDS field value with a given data type and length
+# The value struct packs the value alone, the TLV struct packs type, length and value at once
+class TEDS_Field_Codec():
 
-    if teds_field.data_type == uint8:
-        # Keep this attribute to help in data conversions
-        teds_field.dtype_octets = 1
+    def __init__(self, data_type, n_octets):
+        fmt, self.dtype_octets = STRUCT_FORMATS[data_type]
+        self.n_octets = int(n_octets)
         # If the data type octets are less than the field value octets
         # Then assume the value is a list with N values
         # N = field_octets/dtype_octets
-        if teds_field.dtype_octets < teds_field.get_value_length():
-            teds_field.value_from_bytes = byte_list_to_uint8
-            teds_field.value_from_string = string_list_to_uint8
-            teds_field.value_as_bytes = list_of_uint8_to_bytes
+        self.is_list = self.dtype_octets < self.n_octets
+        self.count = max(1, self.n_octets // self.dtype_octets)
+        self.value_struct = Struct(">{}{}".format(self.count, fmt))
+        self.tlv_struct = Struct(">BB{}{}".format(self.count, fmt))
+        if self.is_list:
+            self.from_string = STRING_CONVERTERS[data_type][1]
         else:
-            teds_field.value_from_bytes = bytes_to_uint8
-            teds_field.value_from_string = string_to_uint8
-            teds_field.value_as_bytes = uint8_to_bytes
-    elif teds_field.data_type == int8:
-        teds_field.dtype_octets = 1
-        if teds_field.dtype_octets < teds_field.get_value_length():
-            teds_field.value_from_bytes = byte_list_to_int8
-            teds_field.value_from_string = string_list_to_int8
-            teds_field.value_as_bytes = list_of_int8_to_bytes
-        else:
-            teds_field.value_from_bytes = bytes_to_int8
-            teds_field.value_from_string = string_to_int8
-            teds_field.value_as_bytes = int8_to_bytes
-    elif teds_field.data_type == uint16:
-        teds_field.dtype_octets = 2
-        if teds_field.dtype_octets < teds_field.get_value_length():
-            teds_field.value_from_bytes = byte_list_to_uint16
-            teds_field.value_from_string = string_list_to_uint16
-            teds_field.value_as_bytes = list_of_uint16_to_bytes
-        else:
-            teds_field.value_from_bytes = bytes_to_uint16
-            teds_field.value_from_string = string_to_uint16
-            teds_field.value_as_bytes = uint16_to_bytes
-    elif teds_field.data_type == int16:
-        teds_field.dtype_octets = 2
-        if teds_field.dtype_octets < teds_field.get_value_length():
-            teds_field.value_from_bytes = byte_list_to_int16
-            teds_field.value_from_string = string_list_to_int16
-            teds_field.value_as_bytes = list_of_int16_to_bytes
-        else:
-            teds_field.value_from_bytes = bytes_to_int16
-            teds_field.value_from_string = string_to_int16
-            teds_field.value_as_bytes = int16_to_bytes
-    elif teds_field.data_type == uint32:
-        teds_field.dtype_octets = 4
-        if teds_field.dtype_octets < teds_field.get_value_length():
-            teds_field.value_from_bytes = byte_list_to_uint32
-            teds_field.value_from_string = string_list_to_uint32
-            teds_field.value_as_bytes = list_of_uint32_to_bytes
-        else:
-            teds_field.value_from_bytes = bytes_to_uint32
-            teds_field.value_from_string = string_to_uint32
-            teds_field.value_as_bytes = uint32_to_bytes
-    elif teds_field.data_type == int32:
-        teds_field.dtype_octets = 4
-        if teds_field.dtype_octets < teds_field.get_value_length():
-            teds_field.value_from_bytes = byte_list_to_int32
-            teds_field.value_from_string = string_list_to_int32
-            teds_field.value_as_bytes = list_of_int32_to_bytes
-        else:
-            teds_field.value_from_bytes = bytes_to_int32
-            teds_field.value_from_string = string_to_int32
-            teds_field.value_as_bytes = int32_to_bytes
-    elif teds_field.data_type == uint64:
-        teds_field.dtype_octets = 8
-        if teds_field.dtype_octets < teds_field.get_value_length():
-            teds_field.value_from_bytes = byte_list_to_uint64
-            teds_field.value_from_string = string_list_to_uint64
-            teds_field.value_as_bytes = list_of_uint64_to_bytes
-        else:
-            teds_field.value_from_bytes = bytes_to_uint64
-            teds_field.value_from_string = string_to_uint64
-            teds_field.value_as_bytes = uint64_to_bytes
-    elif teds_field.data_type == float32:
-        teds_field.dtype_octets = 4
-        if teds_field.dtype_octets < teds_field.get_value_length():
-            teds_field.value_from_bytes = byte_list_to_float32
-            teds_field.value_from_string = string_list_to_float32
-            teds_field.value_as_bytes = list_of_float32_to_bytes
+            self.from_string = STRING_CONVERTERS[data_type][0]
+
+    def unpack(self, buffer):
+        return self.unpack_from(buffer, 0)
+
+    def unpack_from(self, buffer, offset):
+        values = self.value_struct.unpack_from(buffer, offset)
+        if self.is_list:
+            return list(values)
+        return values[0]
+
+    def pack(self, value):
+        if self.is_list:
+            return self.value_struct.pack(*value)
+        return self.value_struct.pack(value)
+
+    def pack_tlv(self, field_type, value):
+        if self.is_list:
+            return self.tlv_struct.pack(field_type, self.value_struct.size, *value)
+        return self.tlv_struct.pack(field_type, self.value_struct.size, value)
+
+    # Write type, length and value in the buffer at offset, return the offset after it
+    def pack_tlv_into(self, buffer, offset, field_type, value):
+        if self.is_list:
+            self.tlv_struct.pack_into(buffer, offset, field_type, self.value_struct.size, *value)
         else:
-            teds_field.value_from_bytes = bytes_to_float32
-            teds_field.value_from_string = string_to_float32
-            teds_field.value_as_bytes = float32_to_bytes
+            self.tlv_struct.pack_into(buffer, offset, field_type, self.value_struct.size, value)
+        return offset + self.tlv_struct.size
+
+# Codecs are shared by all fields with the same data type and length
+_field_codecs = {}
+
+def get_field_codec(data_type, n_octets):
+    key = (data_type, int(n_octets))
+    codec = _field_codecs.get(key)
+    if codec is None:
+        if data_type not in STRUCT_FORMATS:
+            # Nested TEDS data blocks have no value codec
+            return None
+        codec = TEDS_Field_Codec(data_type, n_octets)
+        _field_codecs[key] = codec
+    return codec
+
+# Infer what conversion function is most appropriate to a TEDS Field schema
+def infer_conversion_functions(teds_field):
+    codec = get_field_codec(teds_field.data_type, teds_field.get_value_length())
+    if codec is None:
+        return
+    teds_field.codec = codec
+    # Keep this attribute to help in data conversions
+    teds_field.dtype_octets = codec.dtype_octets
+    teds_field.value_from_bytes = codec.unpack
+    teds_field.value_from_string = codec.from_string
+    teds_field.value_as_bytes = codec.pack
+
+# Key of the unknown TLVs in the dictionaries of TEDS data block values
+UNKNOWN_TLVS_KEY = "UnknownTLVs"
+
+# Convert a field value (NumPy scalars, enumerations, lists of them) to plain Python types
+def to_plain_value(value):
+    if isinstance(value, (list, tuple)):
+        return [to_plain_value(item) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, enum.Enum):
+        return value.value
+    return value
+
+# Named TEDS data block template, e.g. a "PT100 temperature channel"
+# Holds a prototype block with the template values, new blocks are clones of it
+# Values are given by field name, nested fields with the path of names, e.g. "PhyUnits.Kelvins"
+class TEDS_Template():
+
+    def __init__(self, name, teds_data_block, values=None):
+        self.name = name
+        self.prototype = teds_data_block.clone()
+        set_field_values(self.prototype, values)
+        self.prototype.share()
+
+    # New block from this template, with the given values set over the template ones
+    def create(self, values=None):
+        teds_data_block = self.prototype.clone()
+        teds_data_block.init_clone()
+        set_field_values(teds_data_block, values)
+        return teds_data_block
+
+# Set field values by name (or path of names for nested blocks), optional fields are included
+def set_field_values(teds_data_block, values):
+    if not values:
+        return
+    for path, value in values.items():
+        field = get_field_by_path(teds_data_block, path)
+        field.set_value(value)
+        if field.optional:
+            field.include = True
+
+# Field of a block from its name, or a path of names separated by dots for nested blocks
+def get_field_by_path(teds_data_block, path):
+    field = None
+    for name in path.split('.'):
+        if field is not None:
+            teds_data_block = field.get_value()
+            if not isinstance(teds_data_block, TEDS_Data_Block):
+                raise KeyError("TEDS field path: {}, {} is not a data block.".format(path, field.name))
+        field = teds_data_block.field_by_name(name)
+        if field is None:
+            raise KeyError("TEDS field path: {}, no field named {}.".format(path, name))
+    return field
+
+# Templates registered by name
+_templates = {}
+
+def register_template(template):
+    _templates[template.name] = template
+    return template
+
+def get_template(name):
+    return _templates[name]
 
 # Number of octets in Type, Length of a TEDS TLV field
 TL_OCTETS = 2
+# Number of octets of the length prefix and checksum of a checksummed TEDS
+LENGTH_OCTETS = 4
+CHECKSUM_OCTETS = 2
+# Maximum value length of a TLV, the length is a single octet
+MAX_TLV_LENGTH = 0xFF
+
+length_struct = Struct(">I")
+checksum_struct = Struct(">H")
+
+# Walk the TLVs in buffer[offset:end] without copying
+# Yield the type, the length and the offset of the value of each TLV
+def iter_tlv(buffer, offset=0, end=None):
+    if end is None:
+        end = len(buffer)
+    while offset < end:
+        if offset + TL_OCTETS > end:
+            raise ValueError("TEDS TLV at offset {}, truncated type and length.".format(offset))
+        field_type = buffer[offset]
+        field_length = buffer[offset + 1]
+        offset += TL_OCTETS
+        if offset + field_length > end:
+            raise ValueError("TEDS TLV type: {}, length: {}, exceeds the data block."
+                .format(field_type, field_length))
+        yield field_type, field_length, offset
+        offset += field_length
+
+# Walk the TLVs in a buffer and yield them as TEDS TLV blocks
+# The TLV values are memoryview slices of the buffer, not copies
+def parse_tlv_blocks(buffer, offset=0, end=None):
+    view = memoryview(buffer)
+    for field_type, field_length, seek in iter_tlv(view, offset, end):
+        yield TEDS_TLV_Block(uint8(field_type), uint8(field_length), view[seek:seek+field_length])
+
+# Check the length prefix and the checksum of a checksummed TEDS image in barray[offset:end]
+# Return the offset and end of the TEDS data block inside it
+def check_length_and_checksum(barray, offset=0, end=None):
+    if end is None:
+        end = len(barray)
+    if end - offset < LENGTH_OCTETS + CHECKSUM_OCTETS:
+        raise ValueError("Checksummed TEDS too short: {} octets.".format(end - offset))
+    length = length_struct.unpack_from(barray, offset)[0]
+    if length != end - offset - LENGTH_OCTETS:
+        raise ValueError("Checksummed TEDS length is: {}, should be: {}"
+            .format(length, end - offset - LENGTH_OCTETS))
+    block_end = end - CHECKSUM_OCTETS
+    checksum = checksum_struct.unpack_from(barray, block_end)[0]
+    if checksum != calc_checksum(memoryview(barray)[offset:block_end]):
+        raise ValueError("Checksummed TEDS checksum: {:#06x}, does not match.".format(checksum))
+    return offset + LENGTH_OCTETS, block_end
+
+# Checksum of a TEDS data block image once framed, as get_checksum of the block it holds
+def calc_image_checksum(image):
+    length = len(image) + CHECKSUM_OCTETS
+    return checksum_from_sum(calc_byte_sum(image) + sum(length_struct.pack(length)))
+
+# Offsets (N+1 positions) of the checksummed TEDS images concatenated in a buffer
+# Only the length prefixes are read, one per image
+def find_checksummed_offsets(buffer, offset=0, end=None):
+    if end is None:
+        end = len(buffer)
+    offsets = [offset]
+    while offset < end:
+        if end - offset < LENGTH_OCTETS:
+            raise ValueError("Checksummed TEDS at offset {}, truncated length.".format(offset))
+        offset += LENGTH_OCTETS + length_struct.unpack_from(buffer, offset)[0]
+        if offset > end:
+            raise ValueError("Checksummed TEDS at offset {}, truncated image.".format(offsets[-1]))
+        offsets.append(offset)
+    return np.array(offsets, dtype=np.int64)
+
+# Check the length prefix and checksum of each checksummed TEDS image in a batch
+# offsets has N+1 positions, as returned by find_checksummed_offsets
+# Return an array of N booleans, True for each valid image
+def verify_checksummed_images(buffer, offsets):
+    octets = np.frombuffer(buffer, dtype=np.uint8)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    starts = offsets[:-1]
+    ends = offsets[1:]
+    valid = (ends - starts) >= LENGTH_OCTETS + CHECKSUM_OCTETS
+    result = np.zeros(len(starts), dtype=bool)
+    if not np.any(valid):
+        return result
+    # Images too short to hold a length and a checksum are not valid
+    starts = starts[valid]
+    ends = ends[valid]
+    block_ends = ends - CHECKSUM_OCTETS
+    head = octets[starts[:, None] + np.arange(LENGTH_OCTETS)].astype(np.int64)
+    lengths = (head[:, 0] << 24) | (head[:, 1] << 16) | (head[:, 2] << 8) | head[:, 3]
+    tail = octets[block_ends[:, None] + np.arange(CHECKSUM_OCTETS)].astype(np.int64)
+    stored = (tail[:, 0] << 8) | tail[:, 1]
+    checksums = 0xFFFF - (calc_segment_sums(buffer, starts, block_ends).astype(np.int64) % 0xFFFF)
+    result[valid] = (lengths == ends - starts - LENGTH_OCTETS) & (stored == checksums)
+    return result
+
+# Write the type of a TLV and the value of a nested block after it
+# The length octet is only known, and written, after the block is encoded
+def encode_block_tlv_into(buffer, offset, field_type, teds_data_block):
+    buffer[offset] = field_type
+    end = teds_data_block.encode_into(buffer, offset + TL_OCTETS)
+    length = end - offset - TL_OCTETS
+    if length > MAX_TLV_LENGTH:
+        raise ValueError("TEDS field type: {}, nested block length is: {}, maximum is: {}"
+            .format(field_type, length, MAX_TLV_LENGTH))
+    buffer[offset + 1] = length
+    return end
 
 # Utility classes
 
-class TEDS_Block:
+# Field kinds in a compiled codec plan
+PLAN_VALUE = 0
+PLAN_BLOCK = 1
+PLAN_OTHER = 2
 
-    def __init__(self, teds_data_block):
-        self.teds_data_block = teds_data_block
-        self.length = calc_length(self.value)
-        self.checksum = calc_checksum(self.teds_data_block)
+# Codec plan compiled once per TEDS data block class from its field list
+# Holds, for each field position, how the field is encoded and its codec
+# and maps from the TLV type and the field name to the field position
+class TEDS_Codec_Plan():
+
+    def __init__(self, fields):
+        self.kinds = []
+        self.codecs = []
+        self.optional = []
+        self.index_by_type = {}
+        self.index_by_name = {}
+        for index, field in enumerate(fields):
+            codec = getattr(field, 'codec', None)
+            if not isinstance(field, TEDS_Field):
+                # Fields with their own TLV handling (e.g. TEDS Identification Header)
+                self.kinds.append(PLAN_OTHER)
+            elif codec is None:
+                self.kinds.append(PLAN_BLOCK)
+            else:
+                self.kinds.append(PLAN_VALUE)
+            self.codecs.append(codec)
+            self.optional.append(bool(field.optional))
+            # Keep the first field with a given type, as the linear search did
+            self.index_by_type.setdefault(int(field.type), index)
+            self.index_by_name.setdefault(field.name, index)
 
 # Utility class that holds functions and attributes common to all TEDS data blocks
 class TEDS_Data_Block():
 
+    # Set on prototypes, whose clones share their fields until accessed, see share()
+    shared = False
+
     def __init__(self):
         # List to hold references to all teds fields
         self.fields = []
+        # Field holding this block, when it is nested in another block
+        self.parent = None
+        # Encoded bytes of the block, valid while the block is not dirty
+        self.cached_bytes = None
+        self.dirty = True
+        # Running sum of the encoded block octets, None until computed
+        # Fields changed since are subtracted and kept pending, to be added back when needed
+        self.byte_sum = None
+        self.pending_sums = []
+        # Loaded TLVs with types unknown to this block, written back as is after the fields
+        self.unknown_tlvs = []
+
+    # Shared blocks (prototypes) are never changed, a clone of them is changed instead
+    def check_not_shared(self):
+        if self.shared:
+            raise ValueError("TEDS data block: {}, is shared by its clones and can not be changed, change a clone of it."
+                .format(type(self).__name__))
+
+    # Invalidate the encoded bytes of this block and of the blocks holding it
+    # Must be called after changing a field value in place (e.g. an item of a list value)
+    def mark_dirty(self):
+        self.check_not_shared()
+        # The changed field is not known, the byte sum is recomputed from all fields
+        self.byte_sum = None
+        self.pending_sums = []
+        for field in self.fields:
+            if isinstance(field, TEDS_Field):
+                field.byte_sum = None
+                if field._value is not UNDECODED:
+                    field.cached_tlv = None
+                    field.dirty = True
+        self.dirty = True
+        self.cached_bytes = None
+        if self.parent is not None:
+            self.parent.mark_dirty()
+
+    # Called by a field of this block when it changes, with the octet sum it contributed
+    def field_changed(self, field, old_sum):
+        self.check_not_shared()
+        if old_sum is not None and self.byte_sum is not None:
+            self.byte_sum -= old_sum
+            self.pending_sums.append(field)
+        was_dirty = self.dirty
+        self.dirty = True
+        self.cached_bytes = None
+        # The field holding this block must know when it stops being clean
+        # or when its octet sum, counted by its own block, changes
+        if self.parent is not None and (not was_dirty or self.parent.byte_sum is not None):
+            self.parent.mark_dirty()
+
+    def is_dirty(self):
+        return self.dirty
+
+    # Default block of this class, built once with the constructor and cloned by create()
+    # The prototype is shared by its clones and must not be changed
+    @classmethod
+    def get_prototype(cls):
+        prototype = cls.__dict__.get('_prototype')
+        if prototype is None:
+            prototype = cls()
+            prototype.share()
+            cls._prototype = prototype
+        return prototype
+
+    # Make this block and its nested blocks shared: clones of it are copy on write,
+    # they only hold its encoding and clone its fields the first time they are accessed.
+    # The block must not be changed afterwards.
+    def share(self):
+        # Encode it once, so clones start with the encoding cached
+        self.get_byte_sum()
+        self.to_bytes()
+        for field in self.fields:
+            if isinstance(field, TEDS_Field) and isinstance(field._value, TEDS_Data_Block):
+                field._value.share()
+        self.shared = True
+
+    # New block of this class, a clone of the class prototype instead of a constructor run
+    @classmethod
+    def create(cls):
+        teds_data_block = cls.get_prototype().clone()
+        teds_data_block.init_clone()
+        return teds_data_block
+
+    # Called on blocks created from a prototype or a template
+    # Subclasses override it to set values that must not be shared (e.g. a UUID)
+    def init_clone(self):
+        pass
+
+    # Structural copy of this block: fields and nested blocks are copied, values and
+    # schemas are shared when immutable, cached encodings are kept
+    # Clones of a shared block (or of a clone not accessed yet) are copy on write, see share()
+    def clone(self):
+        source = self.__dict__.get('_clone_source')
+        if self.shared or source is not None:
+            teds_data_block = object.__new__(type(self))
+            teds_data_block.__dict__.update(_clone_source=source or self, parent=None,
+                cached_bytes=self.cached_bytes, dirty=self.dirty, byte_sum=self.byte_sum,
+                pending_sums=[], unknown_tlvs=list(self.unknown_tlvs))
+            return teds_data_block
+        teds_data_block = object.__new__(type(self))
+        self.clone_into(teds_data_block)
+        return teds_data_block
+
+    # Copy the fields and attributes of this block into another, new, block
+    def clone_into(self, teds_data_block):
+        fields = [field.clone(teds_data_block) for field in self.fields]
+        # Attributes referencing fields (e.g. self.CalKey) must reference the copies
+        copies = dict(zip(map(id, self.fields), fields))
+        state = teds_data_block.__dict__
+        for name, attribute in self.__dict__.items():
+            state[name] = copies.get(id(attribute), attribute)
+        state.pop('shared', None)
+        teds_data_block.fields = fields
+        teds_data_block.parent = None
+        teds_data_block.unknown_tlvs = list(self.unknown_tlvs)
+        teds_data_block.pending_sums = []
+        if self.pending_sums:
+            # The pending fields have no octet sum, it is recomputed
+            teds_data_block.byte_sum = None
+
+    # Only called for attributes not set, e.g. the fields of a copy on write clone:
+    # the fields are cloned from the shared block, the clone keeps its own encoding state
+    def __getattr__(self, name):
+        state = self.__dict__
+        source = state.pop('_clone_source', None)
+        if source is None:
+            raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+        own = dict(state)
+        source.clone_into(self)
+        state.update(own)
+        return getattr(self, name)
+
+    # Return the codec plan of this block class, compile it with the first instance
+    def get_codec_plan(self):
+        cls = type(self)
+        plan = cls.__dict__.get('_codec_plan')
+        if plan is None:
+            plan = TEDS_Codec_Plan(self.fields)
+            cls._codec_plan = plan
+        return plan
+
+    # Position of the field with the given TLV type in the fields list, None if not defined
+    def field_index_by_type(self, field_type):
+        return self.get_codec_plan().index_by_type.get(int(field_type))
+
+    # Position of the field with the given name in the fields list, None if not defined
+    def field_index_by_name(self, name):
+        return self.get_codec_plan().index_by_name.get(name)
+
+    # Field with the given TLV type, None if not defined
+    def field_by_type(self, field_type):
+        index = self.field_index_by_type(field_type)
+        if index is None:
+            return None
+        return self.fields[index]
+
+    # Field with the given name, None if not defined
+    def field_by_name(self, name):
+        index = self.field_index_by_name(name)
+        if index is None:
+            return None
+        return self.fields[index]
+
+    # Sum of the encoded block octets, only changed fields are encoded to update it
+    def get_byte_sum(self):
+        if self.byte_sum is None:
+            plan = self.get_codec_plan()
+            byte_sum = 0
+            for field, kind in zip(self.fields, plan.kinds):
+                if kind == PLAN_OTHER:
+                    if not field.optional or field.include:
+                        byte_sum += field.get_byte_sum()
+                else:
+                    # Link the field so its changes update this sum
+                    field.parent = self
+                    byte_sum += field.get_sum_contribution()
+            for tlv in self.unknown_tlvs:
+                byte_sum += sum(tlv)
+            self.byte_sum = byte_sum
+        else:
+            for field in self.pending_sums:
+                self.byte_sum += field.get_sum_contribution()
+        self.pending_sums = []
+        return self.byte_sum
+
+    # Checksum of the image written by to_bytes_with_length_and_checksum, without encoding it
+    def get_checksum(self):
+        length = self.get_encoded_length() + CHECKSUM_OCTETS
+        return checksum_from_sum(self.get_byte_sum() + sum(length_struct.pack(length)))
+
+    # Check a stored checksum (e.g. read from a checksummed image) against this block
+    def verify_checksum(self, checksum):
+        return int(checksum) == self.get_checksum()
 
     def to_bytes_with_length_and_checksum(self):
-        barray = self.to_bytes()
-        barray = uint32_to_bytes((len(barray)+2)) + barray
-        checksum = calc_checksum(barray)
-        barray = barray + uint16_to_bytes(uint16(checksum))
+        barray = bytearray(self.get_encoded_length() + LENGTH_OCTETS + CHECKSUM_OCTETS)
+        self.encode_with_length_and_checksum_into(barray, 0)
         return barray
 
+    # Write the length prefix, the block and the checksum in the buffer at offset
+    # The length counts the block and the checksum, the checksum covers the length and the block
+    # Return the offset after the checksum
+    def encode_with_length_and_checksum_into(self, buffer, offset):
+        end = self.encode_into(buffer, offset + LENGTH_OCTETS)
+        length_struct.pack_into(buffer, offset, end - offset - LENGTH_OCTETS + CHECKSUM_OCTETS)
+        checksum_struct.pack_into(buffer, end, self.get_checksum())
+        return end + CHECKSUM_OCTETS
 
     def to_bytes(self):
-        barray = bytearray(b'')
-        for field in self.fields:
+        barray = bytearray(self.get_encoded_length())
+        self.encode_into(barray, 0)
+        return barray
+
+    # Number of octets of the encoded block, all included fields TLVs
+    def get_encoded_length(self):
+        if not self.dirty and self.cached_bytes is not None:
+            return len(self.cached_bytes)
+        plan = self.get_codec_plan()
+        length = 0
+        for field, kind, codec in zip(self.fields, plan.kinds, plan.codecs):
             if field.optional and field.include == False:
-                # If the teds field is optional, and not set for inclusion, skip it
                 continue
-            try:
-                print("Writing bytes from field: {}, value: {}".format(field.name, field.get_value()))
-                print("Value as bytes: ")
-                stdout.write(field.get_value_as_bytes().hex('-'))
-                print("")
-                stdout.flush()
-            except:
-                pass
-            try:
-                barray.append(field.get_TLV().get_bytes())
-            except:
-                barray.extend(field.get_TLV().get_bytes())
-        return barray
+            if kind == PLAN_VALUE:
+                length += codec.tlv_struct.size
+            else:
+                length += field.get_encoded_length()
+        for tlv in self.unknown_tlvs:
+            length += len(tlv)
+        return length
+
+    # Write all included fields TLVs in the buffer at offset, return the offset after them
+    # The buffer must have room for get_encoded_length() octets
+    # A block that did not change since its last encoding copies its cached bytes
+    def encode_into(self, buffer, offset):
+        traced = bool(trace_subscribers)
+        if traced:
+            teds_trace.block_start(TRACE_ENCODE, self)
+        start = offset
+        if not self.dirty and self.cached_bytes is not None:
+            offset += len(self.cached_bytes)
+            buffer[start:offset] = self.cached_bytes
+        else:
+            plan = self.get_codec_plan()
+            for field, kind in zip(self.fields, plan.kinds):
+                if kind != PLAN_OTHER:
+                    # Link the field so its changes invalidate this block
+                    field.parent = self
+                if field.optional and field.include == False:
+                    # If the teds field is optional, and not set for inclusion, skip it
+                    continue
+                field_start = offset
+                offset = field.encode_into(buffer, offset)
+                if traced:
+                    teds_trace.field_event(TRACE_ENCODE, self, field, buffer, field_start, offset)
+            for tlv in self.unknown_tlvs:
+                field_start = offset
+                offset += len(tlv)
+                buffer[field_start:offset] = tlv
+                if traced:
+                    teds_trace.field_event(TRACE_ENCODE, self, None, buffer, field_start, offset)
+            self.cached_bytes = bytes(buffer[start:offset])
+            self.dirty = False
+        if traced:
+            teds_trace.block_end(TRACE_ENCODE, self, buffer, start, offset)
+        return offset
 
     # This method will only load a TEDS with the fields defined in the constructor
     # A Meta TEDS will all fields will fail to load
-    def load_from_bytearray(self, bytearr):
-        # bytearr must be 'bytearray object
-        assert isinstance(bytearr, bytearray)
-
-        # Current position in bytearray
-        seek = 0
-        while seek < len(bytearr):
-            field_type = uint8(bytearr[seek])
-            seek += 1
-            field_length = uint8(bytearr[seek])
-            seek +=1
-            field_value = bytearr[seek:seek+field_length]
-            seek += field_length
-            print("Loading field type: {}, length: {}, value: ".format(field_type, field_length), end='')
-            stdout.write(field_value.hex('-'))
-            print("")
-            stdout.flush()
-            self.set_field(TEDS_TLV_Block(field_type, field_length, field_value))
+    # Any buffer object can be used (bytes, bytearray, memoryview, mmap), it is not copied
+    # If lazy is set, values are only decoded when accessed, see load_raw_from_buffer
+    def load_from_bytearray(self, bytearr, lazy=False):
+        with memoryview(bytearr) as view:
+            self.load_from_buffer(view, 0, len(view), lazy)
 
-    def set_field(self, tlv_block):
+    # Load an image written by to_bytes_with_length_and_checksum
+    # The length prefix and the checksum are checked first if verify is set
+    def load_from_bytearray_with_length_and_checksum(self, bytearr, verify=True, lazy=False):
+        with memoryview(bytearr) as view:
+            if verify:
+                start, end = check_length_and_checksum(view)
+            else:
+                start, end = LENGTH_OCTETS, len(view) - CHECKSUM_OCTETS
+            self.load_from_buffer(view, start, end, lazy)
+
+    # Load the TLVs in buffer[offset:end], nested blocks are loaded from the same buffer
+    # Values are only unpacked for the fields of this block, unknown TLVs are kept as is
+    def load_from_buffer(self, buffer, offset, end, lazy=False):
+        self.check_not_shared()
+        if lazy:
+            self.load_raw_from_buffer(buffer, offset, end)
+            return
+        traced = bool(trace_subscribers)
+        if traced:
+            teds_trace.block_start(TRACE_DECODE, self)
+        if self.unknown_tlvs:
+            self.unknown_tlvs = []
+            self.mark_dirty()
+        plan = self.get_codec_plan()
+        fields = self.fields
+        for field_type, field_length, seek in iter_tlv(buffer, offset, end):
+            index = plan.index_by_type.get(field_type)
+            if index is None:
+                self.unknown_tlvs.append(bytes(buffer[seek-TL_OCTETS:seek+field_length]))
+                self.mark_dirty()
+                if traced:
+                    teds_trace.field_event(TRACE_DECODE, self, None, buffer, seek - TL_OCTETS, seek + field_length)
+                continue
+            field = fields[index]
+            kind = plan.kinds[index]
+            if kind == PLAN_VALUE:
+                codec = plan.codecs[index]
+                if field_length != codec.n_octets:
+                    raise ValueError("TEDS Field: {}, loaded bytes don't match.".format(field.name))
+                field.value = codec.unpack_from(buffer, seek)
+            elif kind == PLAN_BLOCK:
+                field.value.load_from_buffer(buffer, seek, seek+field_length)
+            else:
+                field.load_bytes_from_TLV(TEDS_TLV_Block(uint8(field_type), uint8(field_length),
+                    memoryview(buffer)[seek:seek+field_length]))
+            field.include = True
+            if traced:
+                teds_trace.field_event(TRACE_DECODE, self, field, buffer, seek - TL_OCTETS, seek + field_length)
+        if traced:
+            teds_trace.block_end(TRACE_DECODE, self, buffer, offset, end)
+
+    # Load the TLVs in buffer[offset:end] without decoding them
+    # Each field keeps a copy of its raw TLV, decoded the first time its value is accessed,
+    # and written back as is while it is not changed. Nested blocks are loaded the same way.
+    # If the TLVs are in the order this block encodes them, the whole block is written back as is
+    # Return True in that case
+    def load_raw_from_buffer(self, buffer, offset, end):
+        self.check_not_shared()
+        # One copy of the block, the raw TLVs kept by the fields are slices of it
+        canonical = self._load_raw_from_buffer(bytes(buffer[offset:end]), 0, end - offset)
+        # The blocks holding this one are invalidated once, not for each loaded field
+        if self.parent is not None:
+            self.parent.mark_dirty()
+        return canonical
+
+    # The field states are set directly, without the invalidation of the field setters:
+    # fields not in the buffer keep their value and cached TLV, this block is invalidated as a whole
+    # buffer is a bytes copy, slices of it are kept
+    def _load_raw_from_buffer(self, buffer, offset, end):
+        traced = bool(trace_subscribers)
+        if traced:
+            teds_trace.block_start(TRACE_DECODE, self)
+        unknown_tlvs = self.unknown_tlvs = []
+        self.byte_sum = None
+        self.pending_sums = []
+        self.cached_bytes = None
+        self.dirty = True
+        plan = self.get_codec_plan()
+        index_by_type = plan.index_by_type
+        kinds = plan.kinds
+        fields = self.fields
+        # Field positions in the order of the TLVs, to check if the block can be kept as is
+        loaded = []
+        canonical = True
+        # The TLVs are walked as in iter_tlv, inline as this is the hot loop of lazy loads
+        tlv_start = offset
+        while tlv_start < end:
+            if tlv_start + TL_OCTETS > end:
+                raise ValueError("TEDS TLV at offset {}, truncated type and length.".format(tlv_start))
+            field_type = buffer[tlv_start]
+            field_length = buffer[tlv_start + 1]
+            seek = tlv_start + TL_OCTETS
+            tlv_end = seek + field_length
+            if tlv_end > end:
+                raise ValueError("TEDS TLV type: {}, length: {}, exceeds the data block."
+                    .format(field_type, field_length))
+            index = index_by_type.get(field_type)
+            if index is None:
+                unknown_tlvs.append(buffer[tlv_start:tlv_end])
+            else:
+                if unknown_tlvs:
+                    # Unknown TLVs are written after all fields
+                    canonical = False
+                field = fields[index]
+                kind = kinds[index]
+                if kind == PLAN_VALUE:
+                    if field_length != plan.codecs[index].n_octets:
+                        raise ValueError("TEDS Field: {}, loaded bytes don't match.".format(field.name))
+                    # The value is decoded from the raw TLV when accessed
+                    field._value = UNDECODED
+                    field.cached_tlv = buffer[tlv_start:tlv_end]
+                    field.dirty = False
+                elif kind == PLAN_BLOCK:
+                    canonical = field._value._load_raw_from_buffer(buffer, seek, tlv_end) and canonical
+                    field.dirty = True
+                else:
+                    field.load_bytes_from_TLV(TEDS_TLV_Block(uint8(field_type), uint8(field_length),
+                        memoryview(buffer)[seek:tlv_end]))
+                if kind != PLAN_OTHER:
+                    field.byte_sum = None
+                    field._include = True
+                    field.parent = self
+                loaded.append(index)
+            if traced:
+                teds_trace.field_event(TRACE_DECODE, self, None if index is None else fields[index],
+                    buffer, tlv_start, tlv_end)
+            tlv_start = tlv_end
+        if canonical:
+            included = [index for index, optional in enumerate(plan.optional)
+                if not optional or fields[index]._include]
+            canonical = loaded == included
+        if canonical:
+            self.cached_bytes = buffer if offset == 0 and end == len(buffer) else buffer[offset:end]
+            self.dirty = False
+        if traced:
+            teds_trace.block_end(TRACE_DECODE, self, buffer, offset, end)
+        return canonical
+
+    # Values of the included fields by field name, nested blocks as nested dictionaries
+    # Values are plain Python types (int, float, list), so the result can be dumped to JSON
+    # Unknown TLVs are kept as hexadecimal strings under UNKNOWN_TLVS_KEY
+    def to_dict(self):
+        values = {}
         for field in self.fields:
-            if field.type == tlv_block.field_type:
-                field.load_bytes_from_TLV(tlv_block)
-                field.include = True
-                break
+            if not isinstance(field, TEDS_Field):
+                # The identification header is given by the block class
+                continue
+            if field.optional and field.include == False:
+                continue
+            value = field.get_value()
+            if isinstance(value, TEDS_Data_Block):
+                values[field.name] = value.to_dict()
+            else:
+                values[field.name] = to_plain_value(value)
+        if self.unknown_tlvs:
+            values[UNKNOWN_TLVS_KEY] = [bytes(tlv).hex() for tlv in self.unknown_tlvs]
+        return values
 
-class TEDS_Field():
+    # Set the field values from a dictionary as returned by to_dict
+    # Optional fields missing from it are excluded, other fields keep their value
+    def load_from_dict(self, values):
+        self.check_not_shared()
+        names = set(values)
+        names.discard(UNKNOWN_TLVS_KEY)
+        for field in self.fields:
+            if not isinstance(field, TEDS_Field):
+                continue
+            if field.name not in values:
+                if field.optional:
+                    field.include = False
+                continue
+            names.discard(field.name)
+            value = values[field.name]
+            if isinstance(field.get_value(), TEDS_Data_Block):
+                if not isinstance(value, dict):
+                    raise ValueError("TEDS Field: {}, a data block needs a dictionary of values.".format(field.name))
+                field.get_value().load_from_dict(value)
+            else:
+                field.set_value(value)
+            field.include = True
+        if names:
+            raise ValueError("TEDS data block: {}, unknown fields: {}.".format(type(self).__name__, ", ".join(sorted(names))))
+        self.unknown_tlvs = [bytes.fromhex(tlv) for tlv in values.get(UNKNOWN_TLVS_KEY, [])]
+        self.mark_dirty()
 
-    def __init__(self, type, name, description, data_type, n_octets):
+    def set_field(self, tlv_block):
+        self.check_not_shared()
+        field = self.field_by_type(tlv_block.field_type)
+        if field is not None:
+            field.load_bytes_from_TLV(tlv_block)
+            field.include = True
+        else:
+            self.unknown_tlvs.append(bytes(tlv_block.get_bytes()))
+            self.mark_dirty()
+
+# Definition of a TEDS field: type, name, description, data type, length, enumeration,
+# optional flag and converters. Schemas are interned and shared by all fields with
+# the same definition, so they can not be changed once created
+class TEDS_Field_Schema():
+
+    __slots__ = ('type', 'name', 'description', 'data_type', 'length', 'enum', 'optional',
+        'codec', 'dtype_octets', 'value_from_bytes', 'value_from_string', 'value_as_bytes', '_frozen')
+
+    def __init__(self, type, name, description, data_type, n_octets, enum=None, optional=False):
         self.type = uint8(type)
         self.name = name
         self.description = description
         self.data_type = data_type
         self.length = uint8(n_octets)
-        self.value = None
-        self.tlv = None
-        self.enum = None
-        self.optional = False
-        self.include = False
+        self.enum = enum
+        self.optional = optional
+        self.codec = None
+        self.dtype_octets = None
         self.value_from_bytes = None
         self.value_from_string = None
         self.value_as_bytes = None
         infer_conversion_functions(self)
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError("TEDS field schema {} is shared and can not be changed.".format(self.name))
+        object.__setattr__(self, name, value)
+
+    def get_value_length(self):
+        return self.length
+
+    # Same schema with another enumeration or optional flag
+    def derive(self, enum=None, optional=None):
+        if enum is None:
+            enum = self.enum
+        if optional is None:
+            optional = self.optional
+        return get_field_schema(self.type, self.name, self.description, self.data_type, self.length,
+            enum, optional)
+
+_field_schemas = {}
+
+def get_field_schema(type, name, description, data_type, n_octets, enum=None, optional=False):
+    key = (int(type), name, description, data_type, int(n_octets), enum, optional)
+    schema = _field_schemas.get(key)
+    if schema is None:
+        schema = TEDS_Field_Schema(type, name, description, data_type, n_octets, enum, optional)
+        _field_schemas[key] = schema
+    return schema
+
+# Value of a field loaded lazily and not decoded yet
+UNDECODED = object()
+
+# Read only access to a schema attribute from a field
+def _schema_attribute(name):
+    return property(lambda self: getattr(self.schema, name))
+
+# A TEDS field holds its shared schema and its own state: value, inclusion and cached encoding
+class TEDS_Field():
+
+    __slots__ = ('schema', '_value', '_include', 'parent', 'cached_tlv', 'dirty', 'byte_sum')
+
+    type = _schema_attribute('type')
+    name = _schema_attribute('name')
+    description = _schema_attribute('description')
+    data_type = _schema_attribute('data_type')
+    length = _schema_attribute('length')
+    enum = _schema_attribute('enum')
+    optional = _schema_attribute('optional')
+    codec = _schema_attribute('codec')
+    dtype_octets = _schema_attribute('dtype_octets')
+    value_from_bytes = _schema_attribute('value_from_bytes')
+    value_from_string = _schema_attribute('value_from_string')
+    value_as_bytes = _schema_attribute('value_as_bytes')
+
+    def __init__(self, type, name, description, data_type, n_octets):
+        self.schema = get_field_schema(type, name, description, data_type, n_octets)
+        # Data block holding this field, set when the block is encoded
+        self.parent = None
+        # Encoded TLV of the field, valid while the field is not dirty
+        self.cached_tlv = None
+        self.dirty = True
+        # Octet sum this field contributes to its block, None until computed
+        self.byte_sum = None
+        self._value = None
+        self._include = False
+
+    # Changes to the value or the inclusion invalidate the cached encoding
+    # A value loaded lazily is decoded from the raw TLV on first access
+    @property
+    def value(self):
+        if self._value is UNDECODED:
+            self._value = self.schema.codec.unpack_from(self.cached_tlv, TL_OCTETS)
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        if self.parent is not None:
+            self.parent.check_not_shared()
+        self._value = value
+        if isinstance(value, TEDS_Data_Block):
+            value.parent = self
+        self.mark_dirty()
+
+    @property
+    def include(self):
+        return self._include
+
+    @include.setter
+    def include(self, include):
+        if self.parent is not None:
+            self.parent.check_not_shared()
+        if include != self._include:
+            self._include = include
+            self.mark_dirty()
+
+    # Copy of this field for the parent block, nested blocks and list values are copied
+    def clone(self, parent=None):
+        field = TEDS_Field.__new__(TEDS_Field)
+        field.schema = self.schema
+        value = self._value
+        if type(value) is list:
+            value = list(value)
+        elif isinstance(value, TEDS_Data_Block):
+            # Nested blocks of a shared block are cloned copy on write too
+            value = value.clone()
+            value.parent = field
+        field._value = value
+        field._include = self._include
+        field.parent = parent
+        field.cached_tlv = self.cached_tlv
+        field.dirty = self.dirty
+        field.byte_sum = self.byte_sum
+        return field
+
+    # Invalidate the encoded TLV of this field and of the blocks holding it
+    # The block subtracts the octet sum this field contributed, and adds the new one when needed
+    def mark_dirty(self):
+        if self._value is UNDECODED:
+            # Decode the value before its raw TLV is dropped
+            self.value
+        old_sum = self.byte_sum
+        self.byte_sum = None
+        self.dirty = True
+        self.cached_tlv = None
+        if self.parent is not None and (old_sum is not None or not self.parent.dirty):
+            self.parent.field_changed(self, old_sum)
+
+    # Octet sum of this field TLV in its block, 0 if it is not included
+    # Only called by the block holding the field, which keeps the running sum
+    def get_sum_contribution(self):
+        if self.byte_sum is None:
+            if self.optional and not self._include:
+                self.byte_sum = 0
+            elif isinstance(self._value, TEDS_Data_Block):
+                self.byte_sum = (int(self.type) + self._value.get_encoded_length()
+                    + self._value.get_byte_sum())
+            elif not self.dirty and self.cached_tlv is not None:
+                self.byte_sum = sum(self.cached_tlv)
+            else:
+                try:
+                    self.byte_sum = sum(self.codec.pack_tlv(self.type, self._value))
+                except StructError:
+                    raise ValueError("TEDS field type: {}, value encoding length should be: {}"
+                        .format(self.type, self.length))
+        return self.byte_sum
+
+    def is_dirty(self):
+        return self.dirty
 
     def get_type(self):
         return self.type
@@ -297,10 +1074,10 @@ class TEDS_Field():
 
     def set_value_enum(self,enum):
         # If the value is based in an enumeration, keep a reference
-        self.enum = enum
+        self.schema = self.schema.derive(enum=enum)
 
     def is_optional(self):
-        self.optional = True
+        self.schema = self.schema.derive(optional=True)
 
     def set_value_from_bytes(self, barray):
         self.value = self.value_from_bytes(barray)
@@ -337,20 +1114,48 @@ class TEDS_Field():
     def get_TLV(self):
         if isinstance(self.value, TEDS_Data_Block):
             barray = self.value.to_bytes()
-            self.tlv = TEDS_TLV_Block(self.type, len(barray), barray)
-        else:
-            self.tlv = TEDS_TLV_Block(self.type, self.length, self.get_value_as_bytes())
-        return self.tlv
+            return TEDS_TLV_Block(self.type, len(barray), barray)
+        return TEDS_TLV_Block(self.type, self.length, self.get_value_as_bytes())
 
     def get_bytes(self):
-        return self.get_TLV().get_bytes()
+        barray = bytearray(self.get_encoded_length())
+        self.encode_into(barray, 0)
+        return barray
+
+    # Number of octets of this field TLV
+    def get_encoded_length(self):
+        if isinstance(self._value, TEDS_Data_Block):
+            return self._value.get_encoded_length() + TL_OCTETS
+        return self.get_total_length()
+
+    # Write this field TLV in the buffer at offset, return the offset after it
+    # A field that did not change since its last encoding copies its cached TLV
+    # Nested blocks keep their own cache, so their TLV is not cached here
+    def encode_into(self, buffer, offset):
+        schema = self.schema
+        if isinstance(self._value, TEDS_Data_Block):
+            end = encode_block_tlv_into(buffer, offset, schema.type, self._value)
+            self.dirty = False
+            return end
+        if not self.dirty and self.cached_tlv is not None:
+            end = offset + len(self.cached_tlv)
+            buffer[offset:end] = self.cached_tlv
+            return end
+        try:
+            end = schema.codec.pack_tlv_into(buffer, offset, schema.type, self._value)
+        except StructError:
+            raise ValueError("TEDS field type: {}, value encoding length should be: {}"
+                .format(schema.type, schema.length))
+        self.cached_tlv = bytes(buffer[offset:end])
+        self.dirty = False
+        return end
 
     def load_bytes_from_TLV(self, tlv_block):
         try:
             # Assert this is the correct field
             assert tlv_block.field_type == self.type
-            # Assert the TLV value is a bytearray
-            assert isinstance(tlv_block.field_value, bytearray)
+            # Assert the TLV value is a bytes-like object
+            assert isinstance(tlv_block.field_value, (bytes, bytearray, memoryview))
             # Assert the bytearray has the length anounced
             assert tlv_block.field_length == len(tlv_block.field_value)
             # If this field type is a TEDS Data Block
@@ -376,28 +1181,34 @@ class TEDS_TLV_Block():
         self.field_length = field_length
         self.field_value = field_value
 
-    #TO-DO correct this method
     def get_bytes(self):
-        barr = bytearray(b'')
-        barr.append(self.field_type)
+        barr = bytearray(self.get_encoded_length())
+        self.encode_into(barr, 0)
+        return barr
+
+    # Number of octets of this TLV
+    def get_encoded_length(self):
+        if isinstance(self.field_value, TEDS_Data_Block):
+            return self.field_value.get_encoded_length() + TL_OCTETS
+        return int(self.field_length) + TL_OCTETS
+
+    # Write this TLV in the buffer at offset, return the offset after it
+    def encode_into(self, buffer, offset):
         # If it is another TEDS data block, use specific approach
         if isinstance(self.field_value, TEDS_Data_Block):
-            # Get the data block bytes
-            subarray = self.field_value.to_bytes()
-            # This field size is the number of octets in the block + 2
-            self.field_length = uint8(len(subarray))
-            barr.append(self.field_length)
-            try:
-                barr.extend(subarray)
-            except:
-                barr.append(subarray)
-        else:
-            barr.append(self.field_length)
-            try:
-                barr.extend(self.field_value)
-            except:                    
-                barr.append(self.field_value)
-            if len(barr) != self.field_length + TL_OCTETS:
-                raise ValueError("TEDS field type: {}, value encoding length is: {}, should be: {}"
-                    .format(self.field_type, len(barr)-TL_OCTETS, self.field_length))
-        return barr
\ No newline at end of file
+            end = encode_block_tlv_into(buffer, offset, self.field_type, self.field_value)
+            # This field size is the number of octets in the block
+            self.field_length = uint8(end - offset - TL_OCTETS)
+            return end
+        value = self.field_value
+        if isinstance(value, (int, np.integer)):
+            # A single octet value
+            value = bytes([value])
+        if len(value) != self.field_length:
+            raise ValueError("TEDS field type: {}, value encoding length is: {}, should be: {}"
+                .format(self.field_type, len(value), self.field_length))
+        buffer[offset] = self.field_type
+        buffer[offset + 1] = self.field_length
+        offset += TL_OCTETS
+        buffer[offset:offset + len(value)] = value
+        return offset + len(value)
\ No newline at end of file
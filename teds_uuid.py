@@ -0,0 +1,243 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# IEEE 1451.0 TEDS UUID (TEDSID), 80 bits, most significant first:
+#   location      42 bits  latitude:  1 bit North (1) / South (0), 20 bits arcseconds
+#                          longitude: 1 bit East (1) / West (0), 20 bits arcseconds
+#   manufacturer   4 bits  tells apart the UUID generators of a manufacturer at a location
+#   year          12 bits
+#   time          22 bits  ten second intervals since the start of the year (UTC)
+# Two UUIDs of a generator never share a year and time value: when several UUIDs are made in
+# the same ten seconds, the following time values are used. A sequence file keeps the last
+# value of each generator, so separate processes (or runs) continue after each other
+
+import argparse
+import datetime
+import json
+import os
+import sys
+
+import numpy as np
+
+UUID_OCTETS = 10
+LATITUDE_BITS = 20
+LONGITUDE_BITS = 20
+MANUFACTURER_BITS = 4
+YEAR_BITS = 12
+TIME_BITS = 22
+TIME_UNIT_SECONDS = 10
+MAX_TIME = (1 << TIME_BITS) - 1
+
+# Time field of a date, ten second intervals since the start of its year
+def uuid_time(date):
+    start = date.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+    return int((date - start).total_seconds()) // TIME_UNIT_SECONDS
+
+def utc_now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+# 42 bits location field from a latitude and a longitude in degrees (North and East positive)
+def location_bits(latitude, longitude):
+    latitude = np.asarray(latitude, dtype=np.float64)
+    longitude = np.asarray(longitude, dtype=np.float64)
+    if np.any(np.abs(latitude) > 90) or np.any(np.abs(longitude) > 180):
+        raise ValueError("TEDS UUID location out of range: latitude {}, longitude {}.".format(latitude, longitude))
+    north = (latitude >= 0).astype(np.uint64)
+    east = (longitude >= 0).astype(np.uint64)
+    latitude_seconds = np.rint(np.abs(latitude) * 3600).astype(np.uint64)
+    longitude_seconds = np.rint(np.abs(longitude) * 3600).astype(np.uint64)
+    latitude_field = (north << np.uint64(LATITUDE_BITS)) | latitude_seconds
+    longitude_field = (east << np.uint64(LONGITUDE_BITS)) | longitude_seconds
+    return (latitude_field << np.uint64(LONGITUDE_BITS + 1)) | longitude_field
+
+# Pack the UUID fields (scalars or arrays, broadcast together) into an (n, 10) array of octets
+def pack_uuids(location, manufacturer, year, time):
+    location, manufacturer, year, time = np.broadcast_arrays(
+        np.asarray(location, dtype=np.uint64), np.asarray(manufacturer, dtype=np.uint64),
+        np.asarray(year, dtype=np.uint64), np.asarray(time, dtype=np.uint64))
+    if np.any(manufacturer >> np.uint64(MANUFACTURER_BITS)) or np.any(year >> np.uint64(YEAR_BITS)) \
+            or np.any(time >> np.uint64(TIME_BITS)):
+        raise ValueError("TEDS UUID manufacturer, year or time field out of range.")
+    # The 80 bits are split in two 40 bits halves, each one fits an uint64
+    high_fields = (location << np.uint64(MANUFACTURER_BITS)) | manufacturer
+    low_fields = (year << np.uint64(TIME_BITS)) | time
+    upper = high_fields >> np.uint64(6)
+    lower = ((high_fields & np.uint64(0x3F)) << np.uint64(YEAR_BITS + TIME_BITS)) | low_fields
+    shifts = np.arange(32, -8, -8, dtype=np.uint64)
+    octets = np.empty(upper.shape + (UUID_OCTETS,), dtype=np.uint8)
+    octets[..., :5] = (upper[..., None] >> shifts) & np.uint64(0xFF)
+    octets[..., 5:] = (lower[..., None] >> shifts) & np.uint64(0xFF)
+    return octets.reshape(-1, UUID_OCTETS)
+
+# Fields of a UUID (10 octets), latitude and longitude in degrees
+def unpack_uuid(octets):
+    value = int.from_bytes(bytes(octets), "big")
+    time = value & MAX_TIME
+    year = (value >> TIME_BITS) & ((1 << YEAR_BITS) - 1)
+    manufacturer = (value >> (TIME_BITS + YEAR_BITS)) & ((1 << MANUFACTURER_BITS) - 1)
+    location = value >> (TIME_BITS + YEAR_BITS + MANUFACTURER_BITS)
+    longitude = (location & ((1 << LONGITUDE_BITS) - 1)) / 3600
+    if not (location >> LONGITUDE_BITS) & 1:
+        longitude = -longitude
+    latitude_field = location >> (LONGITUDE_BITS + 1)
+    latitude = (latitude_field & ((1 << LATITUDE_BITS) - 1)) / 3600
+    if not (latitude_field >> LATITUDE_BITS) & 1:
+        latitude = -latitude
+    return {"latitude": latitude, "longitude": longitude, "manufacturer": manufacturer,
+            "year": year, "time": time}
+
+# File lock, to share the sequence file between processes
+class _File_Lock():
+
+    def __init__(self, fh):
+        self.fh = fh
+
+    def __enter__(self):
+        try:
+            import fcntl
+            fcntl.flock(self.fh.fileno(), fcntl.LOCK_EX)
+        except ImportError:
+            import msvcrt
+            self.fh.seek(0)
+            msvcrt.locking(self.fh.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            import fcntl
+            fcntl.flock(self.fh.fileno(), fcntl.LOCK_UN)
+        except ImportError:
+            import msvcrt
+            self.fh.seek(0)
+            msvcrt.locking(self.fh.fileno(), msvcrt.LK_UNLCK, 1)
+
+# Year and time fields together, as one counter: (year << 22) | time
+def uuid_clock(date):
+    return (date.year << TIME_BITS) | uuid_time(date)
+
+# Next free clock value of a generator: now, or after the last one it gave
+# A generator giving more UUIDs than ten second intervals passed keeps ahead of the clock, past
+# the end of the year its time values continue in the next year
+def next_clock(now, last, count):
+    start = now if last is None else max(now, last + 1)
+    if (start + count - 1) >> (TIME_BITS + YEAR_BITS):
+        raise ValueError("TEDS UUID year field exhausted: {} UUIDs requested.".format(count))
+    return start
+
+# Last clock value given by each generator (location and manufacturer), kept in a JSON file
+class TEDS_UUID_Sequence():
+
+    def __init__(self, path):
+        self.path = path
+
+    # Reserve count consecutive clock values, return the first one
+    def reserve(self, generator_key, now, count):
+        with open(self.path, "a+") as fh:
+            with _File_Lock(fh):
+                fh.seek(0)
+                content = fh.read()
+                sequences = json.loads(content) if content.strip() else {}
+                start = next_clock(now, sequences.get(generator_key), count)
+                sequences[generator_key] = start + count - 1
+                fh.seek(0)
+                fh.truncate()
+                json.dump(sequences, fh)
+                fh.flush()
+                os.fsync(fh.fileno())
+        return start
+
+# UUID generator of a location and manufacturer field
+# Without a sequence file, uniqueness only holds within this generator object
+class TEDS_UUID_Generator():
+
+    def __init__(self, latitude, longitude, manufacturer=0, sequence_path=None):
+        self.location = int(location_bits(latitude, longitude))
+        self.manufacturer = int(manufacturer)
+        self.sequence = TEDS_UUID_Sequence(sequence_path) if sequence_path else None
+        self.last = None
+        # Check the manufacturer field range
+        pack_uuids(self.location, self.manufacturer, 0, 0)
+
+    def get_key(self):
+        return "{:011x}-{:x}".format(self.location, self.manufacturer)
+
+    # Reserve count clock values for a date, return the first one
+    def reserve(self, count, date=None):
+        now = uuid_clock(utc_now() if date is None else date)
+        if self.sequence is not None:
+            start = self.sequence.reserve(self.get_key(), now, count)
+        else:
+            start = next_clock(now, self.last, count)
+        self.last = start + count - 1
+        return start
+
+    # count UUIDs at once, as an (count, 10) array of octets
+    def generate_batch(self, count, date=None):
+        start = self.reserve(count, date)
+        clocks = np.arange(start, start + count, dtype=np.uint64)
+        return pack_uuids(self.location, self.manufacturer, clocks >> np.uint64(TIME_BITS),
+            clocks & np.uint64(MAX_TIME))
+
+    # A single UUID, as 10 octets
+    def generate(self, date=None):
+        return self.generate_batch(1, date)[0].tobytes()
+
+# Generator used by generate_uuid when no location is given, see set_default_generator
+_default_generator = None
+
+def set_default_generator(generator):
+    global _default_generator
+    _default_generator = generator
+
+def get_default_generator():
+    return _default_generator
+
+# UUID of a location (north and west in degrees, South and East negative) and date
+# The sequence is added to the time field, for several UUIDs made in the same ten seconds
+def make_uuid(north, west, manufacturer=0, year=None, date=None, sequence=0):
+    date = utc_now() if date is None else date
+    year = date.year if year is None else year
+    location = int(location_bits(north, -west))
+    return pack_uuids(location, manufacturer, year, uuid_time(date) + sequence)[0].tobytes()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate IEEE 1451.0 TEDS UUIDs, one per line in hexadecimal.")
+    parser.add_argument("--latitude", type=float, required=True, help="degrees, North positive")
+    parser.add_argument("--longitude", type=float, required=True, help="degrees, East positive")
+    parser.add_argument("--manufacturer", type=int, default=0, help="manufacturer field, 0 to 15")
+    parser.add_argument("--count", "-n", type=int, default=1)
+    parser.add_argument("--sequence-file", help="file keeping the last time value, shared by all runs")
+    parser.add_argument("--output", "-o", help="output file, standard output by default")
+    options = parser.parse_args(argv)
+    try:
+        generator = TEDS_UUID_Generator(options.latitude, options.longitude, options.manufacturer,
+            options.sequence_file)
+        uuids = generator.generate_batch(options.count)
+    except (ValueError, OSError) as error:
+        print(error, file=sys.stderr)
+        return 1
+    # Hexadecimal digits of all UUIDs at once
+    digits = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+    text = np.empty((len(uuids), 2 * UUID_OCTETS + 1), dtype=np.uint8)
+    text[:, 0:-1:2] = digits[uuids >> 4]
+    text[:, 1:-1:2] = digits[uuids & 0x0F]
+    text[:, -1] = ord("\n")
+    if options.output:
+        with open(options.output, "wb") as fh:
+            fh.write(text.tobytes())
+    else:
+        sys.stdout.buffer.write(text.tobytes())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
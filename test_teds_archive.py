@@ -0,0 +1,48 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Tests of the TEDS archive, run with: python -m pytest
+
+import pytest
+
+from teds_archive import TEDS_Archive, main
+from teds_data_model import TEDS_ACCESS_CODES, TransducerChannel_TEDS_Data_Block
+
+UUID = "00112233445566778899"
+
+def make_channel(high):
+    teds_data_block = TransducerChannel_TEDS_Data_Block.create()
+    teds_data_block.HiLimit.set_value(high)
+    return teds_data_block
+
+# Two images with the same UUID and access code in one append would hide the first one
+def test_append_rejects_duplicate_keys(tmp_path):
+    path = str(tmp_path / "fleet.tedsa")
+    with TEDS_Archive(path, "a") as archive:
+        with pytest.raises(ValueError):
+            archive.append([make_channel(1.0), make_channel(2.0)], [UUID, UUID])
+        assert len(archive) == 0
+        # Replacing an entry in a later append is still allowed
+        archive.append([make_channel(1.0)], [UUID])
+        archive.append([make_channel(2.0)], [UUID])
+        assert archive.load(UUID, TEDS_ACCESS_CODES.ChanTEDS).HiLimit.get_value() == 2.0
+
+def test_add_command_names_the_clashing_files(tmp_path, capsys):
+    paths = []
+    for name in ("a.bin", "b.bin"):
+        path = tmp_path / name
+        path.write_bytes(bytes(make_channel(1.0).to_bytes()))
+        paths.append(str(path))
+    assert main(["add", "--uuid", UUID, str(tmp_path / "fleet.tedsa")] + paths) == 1
+    error = capsys.readouterr().err
+    assert paths[0] in error and paths[1] in error
@@ -0,0 +1,233 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Tests of the cached encodings, running byte sums, lazy loads and copy on write clones
+# Each edit is applied to the block under test and replayed on a block built with the
+# constructor and encoded from scratch: bytes, length and checksum must match.
+
+import random
+
+import numpy as np
+import pytest
+
+from teds_utils import TEDS_Data_Block, TEDS_Field, STRUCT_FORMATS, calc_image_checksum, get_field_by_path
+from teds_data_model import Meta_TEDS_Data_Block, TransducerChannel_TEDS_Data_Block
+
+BLOCK_CLASSES = [Meta_TEDS_Data_Block, TransducerChannel_TEDS_Data_Block]
+
+# Paths of the fields with a value (not a nested block), nested fields included
+def value_field_paths(teds_data_block, prefix=""):
+    paths = []
+    for field in teds_data_block.fields:
+        if not isinstance(field, TEDS_Field):
+            continue
+        if isinstance(field.get_value(), TEDS_Data_Block):
+            paths.extend(value_field_paths(field.get_value(), prefix + field.name + "."))
+        else:
+            paths.append(prefix + field.name)
+    return paths
+
+def optional_field_paths(teds_data_block, prefix=""):
+    paths = []
+    for field in teds_data_block.fields:
+        if not isinstance(field, TEDS_Field):
+            continue
+        if field.optional:
+            paths.append(prefix + field.name)
+        if isinstance(field.get_value(), TEDS_Data_Block):
+            paths.extend(optional_field_paths(field.get_value(), prefix + field.name + "."))
+    return paths
+
+def random_item(rng, data_type):
+    fmt = STRUCT_FORMATS[data_type][0]
+    if fmt == 'f':
+        return float(np.float32(rng.uniform(-1e3, 1e3)))
+    info = np.iinfo(data_type)
+    return rng.randint(int(info.min), min(int(info.max), 1 << 31))
+
+# A value the field can encode
+def random_value(rng, field):
+    if field.enum:
+        return rng.choice(list(field.enum))
+    if field.codec.is_list:
+        return [random_item(rng, field.data_type) for _ in range(field.codec.count)]
+    return random_item(rng, field.data_type)
+
+# Block built with the constructor, the Meta-TEDS UUID is random and is set to a fixed one
+def new_block(block_class):
+    teds_data_block = block_class()
+    if block_class is Meta_TEDS_Data_Block:
+        teds_data_block.uuid_field.set_value(list(range(10)))
+    return teds_data_block
+
+# Edits, as functions applied both to the block under test and to the reference block
+def random_edit(rng, teds_data_block):
+    if rng.random() < 0.3:
+        path = rng.choice(optional_field_paths(teds_data_block))
+        include = rng.random() < 0.5
+        def edit(block):
+            get_field_by_path(block, path).include = include
+    else:
+        path = rng.choice(value_field_paths(teds_data_block))
+        value = random_value(rng, get_field_by_path(teds_data_block, path))
+        def edit(block):
+            get_field_by_path(block, path).set_value(value)
+    return edit
+
+# Encoding of a block built with the constructor, with the edits applied, and no cache used
+# If base is given, the block is first loaded from it
+def reference_bytes(block_class, edits, base=None):
+    teds_data_block = new_block(block_class)
+    if base is not None:
+        teds_data_block.load_from_bytearray(base)
+    for edit in edits:
+        edit(teds_data_block)
+    teds_data_block.mark_dirty()
+    return bytes(teds_data_block.to_bytes())
+
+def check_block(teds_data_block, expected):
+    assert teds_data_block.get_encoded_length() == len(expected)
+    assert teds_data_block.get_checksum() == calc_image_checksum(expected)
+    assert bytes(teds_data_block.to_bytes()) == expected
+    # Cached bytes, once encoded
+    assert bytes(teds_data_block.to_bytes()) == expected
+    assert teds_data_block.get_checksum() == calc_image_checksum(expected)
+    framed = teds_data_block.to_bytes_with_length_and_checksum()
+    loaded = type(teds_data_block)()
+    loaded.load_from_bytearray_with_length_and_checksum(framed)
+    assert bytes(loaded.to_bytes()) == expected
+
+# Replace the block under test by a reload or a clone, the content is unchanged
+def reload_lazy(teds_data_block):
+    image = bytes(teds_data_block.to_bytes())
+    teds_data_block.load_from_bytearray(image, lazy=True)
+    return teds_data_block
+
+def reload_eager(teds_data_block):
+    image = bytes(teds_data_block.to_bytes())
+    teds_data_block.load_from_bytearray(image)
+    return teds_data_block
+
+def load_into_created(teds_data_block):
+    loaded = type(teds_data_block).create()
+    loaded.load_from_bytearray(teds_data_block.to_bytes(), lazy=True)
+    return loaded
+
+def clone(teds_data_block):
+    return teds_data_block.clone()
+
+REPLACEMENTS = [reload_lazy, reload_eager, load_into_created, clone]
+
+@pytest.mark.parametrize("block_class", BLOCK_CLASSES)
+@pytest.mark.parametrize("seed", range(8))
+def test_random_edits_match_a_fresh_encoding(block_class, seed):
+    rng = random.Random(seed)
+    teds_data_block = new_block(block_class)
+    edits = []
+    base = None
+    for step in range(60):
+        edit = random_edit(rng, teds_data_block)
+        edit(teds_data_block)
+        edits.append(edit)
+        if rng.random() < 0.3:
+            # Only sometimes encoded between edits, so changes pile up on a dirty block
+            check_block(teds_data_block, reference_bytes(block_class, edits, base))
+        if rng.random() < 0.15:
+            replacement = rng.choice(REPLACEMENTS)
+            if replacement is load_into_created:
+                # Values of the excluded optional fields are not in the image, the reference is
+                # loaded from the same image
+                base = bytes(teds_data_block.to_bytes())
+                edits = []
+            teds_data_block = replacement(teds_data_block)
+    check_block(teds_data_block, reference_bytes(block_class, edits, base))
+
+# An in place change of a list value is only seen after mark_dirty
+def test_list_value_changed_in_place():
+    teds_data_block = TransducerChannel_TEDS_Data_Block()
+    teds_data_block.DAngles.include = True
+    teds_data_block.to_bytes()
+    teds_data_block.get_checksum()
+    teds_data_block.DAngles.get_value()[1] = 2.5
+    teds_data_block.mark_dirty()
+    reference = TransducerChannel_TEDS_Data_Block()
+    reference.DAngles.include = True
+    reference.DAngles.set_value([0.0, 2.5])
+    check_block(teds_data_block, bytes(reference.to_bytes()))
+
+# Edits of nested blocks through a clone of the shared prototype
+def test_clone_of_prototype_nested_edit():
+    prototype_bytes = bytes(TransducerChannel_TEDS_Data_Block.get_prototype().to_bytes())
+    teds_data_block = TransducerChannel_TEDS_Data_Block.create()
+    check_block(teds_data_block, prototype_bytes)
+    teds_data_block.PhyUnits.get_value().field_by_name("UnitType").set_value(1)
+    teds_data_block.PhyUnits.get_value().field_by_name("Radians").include = True
+    def edit(block):
+        block.PhyUnits.get_value().field_by_name("UnitType").set_value(1)
+        block.PhyUnits.get_value().field_by_name("Radians").include = True
+    check_block(teds_data_block, reference_bytes(TransducerChannel_TEDS_Data_Block, [edit]))
+    # Neither the prototype nor other clones see the edit
+    assert bytes(TransducerChannel_TEDS_Data_Block.get_prototype().to_bytes()) == prototype_bytes
+    check_block(TransducerChannel_TEDS_Data_Block.create(), prototype_bytes)
+
+# Clones taken before and after an edit are independent of each other
+def test_clones_are_independent():
+    teds_data_block = TransducerChannel_TEDS_Data_Block.create()
+    untouched = teds_data_block.clone()
+    teds_data_block.HiLimit.set_value(4.0)
+    edited = teds_data_block.clone()
+    edited.LowLimit.set_value(-4.0)
+    def high(block):
+        block.HiLimit.set_value(4.0)
+    def low(block):
+        block.LowLimit.set_value(-4.0)
+    check_block(untouched, reference_bytes(TransducerChannel_TEDS_Data_Block, []))
+    check_block(teds_data_block, reference_bytes(TransducerChannel_TEDS_Data_Block, [high]))
+    check_block(edited, reference_bytes(TransducerChannel_TEDS_Data_Block, [high, low]))
+
+# Values loaded lazily are only decoded when read, edits after the load are kept
+def test_lazy_load_then_edit():
+    source = TransducerChannel_TEDS_Data_Block()
+    source.HiLimit.set_value(7.0)
+    source.MRange.include = True
+    image = bytes(source.to_bytes())
+    teds_data_block = TransducerChannel_TEDS_Data_Block()
+    teds_data_block.load_from_bytearray(image, lazy=True)
+    check_block(teds_data_block, image)
+    assert teds_data_block.HiLimit.get_value() == 7.0
+    teds_data_block.LowLimit.set_value(-1.0)
+    def edit(block):
+        block.HiLimit.set_value(7.0)
+        block.MRange.include = True
+        block.LowLimit.set_value(-1.0)
+    check_block(teds_data_block, reference_bytes(TransducerChannel_TEDS_Data_Block, [edit]))
+
+# The shared prototype refuses changes, created blocks are not affected
+def test_shared_prototype_is_not_changed():
+    prototype = TransducerChannel_TEDS_Data_Block.get_prototype()
+    prototype_bytes = bytes(prototype.to_bytes())
+    with pytest.raises(ValueError):
+        prototype.HiLimit.set_value(4.0)
+    with pytest.raises(ValueError):
+        prototype.MRange.include = True
+    with pytest.raises(ValueError):
+        prototype.PhyUnits.get_value().field_by_name("UnitType").set_value(1)
+    with pytest.raises(ValueError):
+        prototype.mark_dirty()
+    with pytest.raises(ValueError):
+        prototype.load_from_bytearray(prototype_bytes)
+    assert bytes(prototype.to_bytes()) == prototype_bytes
+    teds_data_block = TransducerChannel_TEDS_Data_Block.create()
+    teds_data_block.HiLimit.set_value(4.0)
+    teds_data_block.MRange.include = True
+    check_block(TransducerChannel_TEDS_Data_Block.create(), prototype_bytes)
@@ -0,0 +1,119 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Tests of the NCAP TEDS cache, against an emulated TIM, run with: python -m pytest
+
+import asyncio
+
+from teds_cache import TEDS_Cache
+from teds_client import TEDS_Client
+from teds_emulator import make_emulators, start_emulators, stop_emulators
+from teds_protocol import write_args_struct, update_args_struct, COMMON_CMD_FUNCTIONS, REPLY_SUCCESS
+from teds_data_model import TEDS_ACCESS_CODES, Meta_TEDS_Data_Block, TransducerChannel_TEDS_Data_Block
+
+TTL = 10.0
+
+def make_channel(high):
+    teds_data_block = TransducerChannel_TEDS_Data_Block.create()
+    teds_data_block.HiLimit.set_value(high)
+    return teds_data_block
+
+class Clock():
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+# Run a test with a cache of a client, an emulated TIM with two channels and a clock set by the test
+def run_cache(test, **cache_options):
+    async def run():
+        emulator = make_emulators(1, Meta_TEDS_Data_Block.create(), [make_channel(1.0), make_channel(2.0)])[0]
+        endpoint = (await start_emulators([emulator]))[0]
+        client = TEDS_Client(timeout=5)
+        clock = Clock()
+        cache = TEDS_Cache(client, ttl=TTL, clock=clock, **cache_options)
+        uuid = bytes(emulator.tim.meta_teds.uuid_field.get_value())
+        try:
+            await asyncio.wait_for(test(cache, clock, client, emulator, endpoint, uuid), 10)
+        finally:
+            client.close()
+            await stop_emulators([emulator])
+    asyncio.run(run())
+
+async def write_channel(client, endpoint, channel, teds_data_block):
+    image = bytes(teds_data_block.to_bytes_with_length_and_checksum())
+    success, _ = await client.command(endpoint, channel, COMMON_CMD_FUNCTIONS.WriteTEDSSegment,
+        write_args_struct.pack(TEDS_ACCESS_CODES.ChanTEDS, 0) + image)
+    assert success == REPLY_SUCCESS
+    success, _ = await client.command(endpoint, channel, COMMON_CMD_FUNCTIONS.UpdateTEDS,
+        update_args_struct.pack(TEDS_ACCESS_CODES.ChanTEDS))
+    assert success == REPLY_SUCCESS
+
+def test_fresh_entry_is_not_fetched_again():
+    async def test(cache, clock, client, emulator, endpoint, uuid):
+        teds_data_block = await cache.get_teds(endpoint, uuid, 1, TEDS_ACCESS_CODES.ChanTEDS)
+        assert teds_data_block.HiLimit.get_value() == 1.0
+        commands = emulator.commands
+        clock.now = TTL / 2
+        assert await cache.get_teds(endpoint, uuid, 1, TEDS_ACCESS_CODES.ChanTEDS) is teds_data_block
+        assert cache.get(cache.make_key(uuid, 1, TEDS_ACCESS_CODES.ChanTEDS)) is teds_data_block
+        assert emulator.commands == commands
+        assert (cache.hits, cache.misses) == (2, 1)
+    run_cache(test)
+
+# A stale entry is kept after a Query TEDS if the TEDS did not change, fetched again after an Update
+def test_revalidation_after_update():
+    async def test(cache, clock, client, emulator, endpoint, uuid):
+        teds_data_block = await cache.get_teds(endpoint, uuid, 1, TEDS_ACCESS_CODES.ChanTEDS)
+        clock.now = TTL * 2
+        commands = emulator.commands
+        assert await cache.get_teds(endpoint, uuid, 1, TEDS_ACCESS_CODES.ChanTEDS) is teds_data_block
+        # Only the Query TEDS was sent
+        assert emulator.commands == commands + 1
+        assert (cache.revalidations, cache.refetches) == (1, 0)
+        # Fresh again from the revalidation
+        assert cache.get(cache.make_key(uuid, 1, TEDS_ACCESS_CODES.ChanTEDS)) is teds_data_block
+        await write_channel(client, endpoint, 1, make_channel(5.0))
+        # Still fresh, the cache does not see the change before the ttl ends
+        assert await cache.get_teds(endpoint, uuid, 1, TEDS_ACCESS_CODES.ChanTEDS) is teds_data_block
+        clock.now = TTL * 4
+        updated = await cache.get_teds(endpoint, uuid, 1, TEDS_ACCESS_CODES.ChanTEDS)
+        assert updated is not teds_data_block
+        assert updated.HiLimit.get_value() == 5.0
+        assert (cache.revalidations, cache.refetches) == (2, 1)
+        # The other channel is not affected
+        assert (await cache.get_teds(endpoint, uuid, 2, TEDS_ACCESS_CODES.ChanTEDS)).HiLimit.get_value() == 2.0
+    run_cache(test)
+
+def test_concurrent_misses_fetch_once():
+    async def test(cache, clock, client, emulator, endpoint, uuid):
+        blocks = await asyncio.gather(*[cache.get_teds(endpoint, uuid, 2, TEDS_ACCESS_CODES.ChanTEDS)
+            for _ in range(8)])
+        assert all(teds_data_block is blocks[0] for teds_data_block in blocks)
+        assert cache.misses == 1
+    run_cache(test)
+
+def test_invalidate_and_eviction():
+    async def test(cache, clock, client, emulator, endpoint, uuid):
+        await cache.get_teds(endpoint, uuid, 1, TEDS_ACCESS_CODES.ChanTEDS)
+        await cache.get_teds(endpoint, uuid, 2, TEDS_ACCESS_CODES.ChanTEDS)
+        await cache.get_teds(endpoint, uuid, 0, TEDS_ACCESS_CODES.MetaTEDS)
+        # The least recently used entry is dropped
+        assert len(cache) == 2
+        assert cache.make_key(uuid, 1, TEDS_ACCESS_CODES.ChanTEDS) not in cache
+        assert cache.octets == sum(len(entry.image) for entry in cache.entries.values())
+        cache.invalidate_tim(uuid)
+        assert len(cache) == 0 and cache.octets == 0
+    run_cache(test, max_entries=2)
@@ -0,0 +1,99 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Tests of the TEDS client against stand-in TIM servers sending wrong replies, run with: python -m pytest
+# A reply that can not be matched to its command must fail the requests, not hang the client
+
+import asyncio
+
+import pytest
+
+from teds_client import TEDS_Client, TEDS_Client_Protocol
+from teds_protocol import command_struct, query_reply_struct, read_args_struct, read_reply_struct, \
+    COMMON_CMD_FUNCTIONS, TEDS_STATUS_VALID, TIM_CHANNEL, pack_reply, pack_command, query_args_struct, \
+    connect_endpoint
+from teds_data_model import TEDS_ACCESS_CODES
+
+# Seconds a failing request may take, far below the client timeout
+QUICK = 2.0
+TEDS_SIZE = 40
+MAX_SEGMENT = 16
+
+# Reply of a stand-in TIM to a segment read, for each case
+def oversized_segment(offset, max_length):
+    return pack_reply(True, read_reply_struct.pack(offset) + bytes(max_length + 8))
+
+def undersized_segment(offset, max_length):
+    return pack_reply(True, bytes(read_reply_struct.size - 2))
+
+# Serve Query TEDS correctly and segment reads with the reply of the case
+async def start_server(segment_reply, unsolicited=False):
+    async def serve(reader, writer):
+        if unsolicited:
+            writer.write(pack_reply(True))
+        try:
+            while True:
+                channel, command_class, function, length = command_struct.unpack(
+                    await reader.readexactly(command_struct.size))
+                args = await reader.readexactly(length)
+                if function == COMMON_CMD_FUNCTIONS.QueryTEDS:
+                    writer.write(pack_reply(True, query_reply_struct.pack(0, TEDS_STATUS_VALID, TEDS_SIZE, 0,
+                        MAX_SEGMENT)))
+                else:
+                    access_code, offset, max_length = read_args_struct.unpack(args)
+                    writer.write(segment_reply(offset, max_length))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+    server = await asyncio.start_server(serve, "127.0.0.1", 0)
+    host, port = server.sockets[0].getsockname()[:2]
+    return server, "{}:{}".format(host, port)
+
+@pytest.mark.parametrize("segment_reply", [oversized_segment, undersized_segment])
+def test_wrong_segment_reply_fails_quickly(segment_reply):
+    async def run():
+        server, endpoint = await start_server(segment_reply)
+        client = TEDS_Client(timeout=30)
+        try:
+            with pytest.raises(ValueError):
+                await asyncio.wait_for(client.fetch_image(endpoint, TIM_CHANNEL, TEDS_ACCESS_CODES.MetaTEDS), QUICK)
+            # All the segment reads of the window failed, the connection is dropped
+            protocol = client.pool.connections[endpoint]
+            assert protocol.aborted and protocol.closed and not protocol.pending
+            # The next request opens a new connection
+            results = await asyncio.wait_for(client.fetch_many([endpoint]), QUICK)
+            assert isinstance(results[endpoint], ValueError)
+        finally:
+            client.close()
+            server.close()
+            await server.wait_closed()
+    asyncio.run(run())
+
+def test_unsolicited_reply_aborts_the_connection():
+    async def run():
+        server, endpoint = await start_server(oversized_segment, unsolicited=True)
+        try:
+            transport, protocol = await connect_endpoint(TEDS_Client_Protocol, endpoint)
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + QUICK
+            while not protocol.closed and loop.time() < deadline:
+                await asyncio.sleep(0.01)
+            assert protocol.aborted
+            assert isinstance(protocol.exception, ValueError)
+            with pytest.raises(ValueError):
+                protocol.send(pack_command(TIM_CHANNEL, COMMON_CMD_FUNCTIONS.QueryTEDS,
+                    query_args_struct.pack(TEDS_ACCESS_CODES.MetaTEDS)))
+        finally:
+            server.close()
+            await server.wait_closed()
+    asyncio.run(run())
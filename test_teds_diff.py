@@ -0,0 +1,93 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Tests of the TLV diff and patch of TEDS images, run with: python -m pytest
+
+import os
+
+import pytest
+
+from teds_diff import TEDS_Patch, diff_images, apply_patch, iter_patch_changes
+from teds_data_model import teds_data_block_from_bytes
+
+SAMPLE_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+CHANNEL_FILE = "channel_teds_2022-07-03_00-13-59.bin"
+META_FILE = "meta_teds_2022-07-03_00-12-17.bin"
+
+def read_sample(name):
+    with open(os.path.join(SAMPLE_DIRECTORY, name), "rb") as fh:
+        return fh.read()
+
+# Edits of the sample files: values, optional fields added and removed, nested blocks
+def edit_values(teds_data_block):
+    if teds_data_block.field_by_name("HiLimit") is not None:
+        teds_data_block.HiLimit.set_value(250.0)
+        teds_data_block.LowLimit.set_value(-250.0)
+    else:
+        teds_data_block.field_by_name("MaxChan").set_value(4)
+
+def edit_optional(teds_data_block):
+    for field in teds_data_block.fields:
+        if getattr(field, "optional", False):
+            field.include = not field.include
+
+def edit_nested(teds_data_block):
+    units = teds_data_block.PhyUnits.get_value()
+    units.field_by_name("UnitType").set_value(1)
+    units.field_by_name("Kelvins").set_value(130)
+
+EDITS = {
+    CHANNEL_FILE: [edit_values, edit_optional, edit_nested],
+    META_FILE: [edit_values, edit_optional],
+}
+
+CASES = [(name, edit) for name, edits in EDITS.items() for edit in edits + [None]]
+
+def edited_image(image, edit):
+    teds_data_block = teds_data_block_from_bytes(image)
+    if edit is not None:
+        edit(teds_data_block)
+    return teds_data_block
+
+@pytest.mark.parametrize("name, edit", CASES)
+def test_patch_of_diff_gives_the_new_image(name, edit):
+    old = read_sample(name)
+    new = bytes(edited_image(old, edit).to_bytes())
+    patch = diff_images(old, new)
+    assert apply_patch(old, patch) == new
+    # Through the encoded patch too
+    encoded = patch.to_bytes()
+    assert len(encoded) == patch.get_encoded_length()
+    assert apply_patch(old, TEDS_Patch.from_bytes(encoded)) == new
+    if edit is None:
+        assert len(patch) == 0
+    else:
+        assert len(patch) > 0
+        assert list(iter_patch_changes(old, patch))
+
+# Checksummed images are patched keeping their framing
+@pytest.mark.parametrize("name, edit", CASES)
+def test_patch_of_checksummed_images(name, edit):
+    old_block = teds_data_block_from_bytes(read_sample(name))
+    old = bytes(old_block.to_bytes_with_length_and_checksum())
+    new = bytes(edited_image(read_sample(name), edit).to_bytes_with_length_and_checksum())
+    assert apply_patch(old, diff_images(old, new)) == new
+
+def test_patch_of_another_image_is_rejected():
+    old = read_sample(CHANNEL_FILE)
+    new = bytes(edited_image(old, edit_values).to_bytes())
+    patch = diff_images(old, new)
+    with pytest.raises(ValueError):
+        apply_patch(new, patch)
+    with pytest.raises(ValueError):
+        diff_images(old, read_sample(META_FILE))
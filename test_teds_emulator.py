@@ -0,0 +1,130 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Tests of the emulated TIMs, over a local TCP connection, run with: python -m pytest
+
+import asyncio
+
+from teds_emulator import make_emulators, start_emulators, stop_emulators
+from teds_protocol import reply_struct, query_args_struct, query_reply_struct, read_args_struct, \
+    read_reply_struct, write_args_struct, update_args_struct, COMMON_CMD_FUNCTIONS, REPLY_SUCCESS, \
+    REPLY_FAIL, TIM_CHANNEL, TEDS_STATUS_VALID, pack_command
+from teds_data_model import TEDS_ACCESS_CODES, Meta_TEDS_Data_Block, TransducerChannel_TEDS_Data_Block, \
+    teds_data_block_from_bytes
+from teds_utils import check_length_and_checksum
+
+MAX_SEGMENT = 16
+
+def make_channel(high):
+    teds_data_block = TransducerChannel_TEDS_Data_Block.create()
+    teds_data_block.HiLimit.set_value(high)
+    return teds_data_block
+
+class Connection():
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    async def command(self, channel, function, args):
+        self.writer.write(pack_command(channel, function, args))
+        success, length = reply_struct.unpack(await self.reader.readexactly(reply_struct.size))
+        return success, await self.reader.readexactly(length)
+
+    # Framed TEDS image, read by segments
+    async def read_teds(self, channel, access_code):
+        success, data = await self.command(channel, COMMON_CMD_FUNCTIONS.QueryTEDS, query_args_struct.pack(access_code))
+        assert success == REPLY_SUCCESS
+        _, status, size, checksum, max_segment = query_reply_struct.unpack(data)
+        assert status == TEDS_STATUS_VALID and max_segment == MAX_SEGMENT
+        image = bytearray()
+        while len(image) < size:
+            success, data = await self.command(channel, COMMON_CMD_FUNCTIONS.ReadTEDSSegment,
+                read_args_struct.pack(access_code, len(image), max_segment))
+            assert success == REPLY_SUCCESS
+            assert read_reply_struct.unpack_from(data)[0] == len(image)
+            image += data[read_reply_struct.size:]
+        assert len(image) == size
+        assert int.from_bytes(image[-2:], "big") == checksum
+        return bytes(image)
+
+    async def write_teds(self, channel, access_code, image):
+        for offset in range(0, len(image), MAX_SEGMENT):
+            success, _ = await self.command(channel, COMMON_CMD_FUNCTIONS.WriteTEDSSegment,
+                write_args_struct.pack(access_code, offset) + image[offset:offset + MAX_SEGMENT])
+            assert success == REPLY_SUCCESS
+        return await self.command(channel, COMMON_CMD_FUNCTIONS.UpdateTEDS, update_args_struct.pack(access_code))
+
+async def connect(endpoint):
+    host, port = endpoint.rsplit(":", 1)
+    return Connection(*await asyncio.open_connection(host, int(port)))
+
+def decode(image):
+    start, end = check_length_and_checksum(image)
+    return teds_data_block_from_bytes(image[start:end])
+
+def run_emulators(test, count=2):
+    async def run():
+        channels = [make_channel(1.0), make_channel(2.0)]
+        emulators = make_emulators(count, Meta_TEDS_Data_Block.create(), channels, max_segment=MAX_SEGMENT)
+        endpoints = await start_emulators(emulators)
+        try:
+            await asyncio.wait_for(test(emulators, endpoints), 10)
+        finally:
+            await stop_emulators(emulators)
+    asyncio.run(run())
+
+# Each TIM has its own Meta-TEDS UUID, the channels are the ones given
+def test_read_teds():
+    async def test(emulators, endpoints):
+        metas = []
+        for endpoint in endpoints:
+            connection = await connect(endpoint)
+            meta_teds = decode(await connection.read_teds(TIM_CHANNEL, TEDS_ACCESS_CODES.MetaTEDS))
+            metas.append(bytes(meta_teds.uuid_field.get_value()))
+            channel = decode(await connection.read_teds(2, TEDS_ACCESS_CODES.ChanTEDS))
+            assert channel.HiLimit.get_value() == 2.0
+            connection.writer.close()
+        assert len(set(metas)) == len(endpoints)
+    run_emulators(test)
+
+def test_unknown_teds_fails():
+    async def test(emulators, endpoints):
+        connection = await connect(endpoints[0])
+        success, message = await connection.command(9, COMMON_CMD_FUNCTIONS.QueryTEDS,
+            query_args_struct.pack(TEDS_ACCESS_CODES.ChanTEDS))
+        assert success == REPLY_FAIL and message
+        # The connection still serves the next command
+        await connection.read_teds(1, TEDS_ACCESS_CODES.ChanTEDS)
+        connection.writer.close()
+    run_emulators(test, 1)
+
+# A TEDS written by the NCAP replaces the one of that TIM only
+def test_write_and_update_teds():
+    async def test(emulators, endpoints):
+        connection = await connect(endpoints[0])
+        image = bytes(make_channel(7.0).to_bytes_with_length_and_checksum())
+        assert (await connection.write_teds(1, TEDS_ACCESS_CODES.ChanTEDS, image))[0] == REPLY_SUCCESS
+        assert await connection.read_teds(1, TEDS_ACCESS_CODES.ChanTEDS) == image
+        assert emulators[0].tim.get_channel(0).HiLimit.get_value() == 7.0
+        other = await connect(endpoints[1])
+        assert decode(await other.read_teds(1, TEDS_ACCESS_CODES.ChanTEDS)).HiLimit.get_value() == 1.0
+        # A corrupted TEDS is refused and the current one kept
+        corrupted = bytearray(bytes(make_channel(8.0).to_bytes_with_length_and_checksum()))
+        corrupted[-1] ^= 0xFF
+        success, message = await connection.write_teds(1, TEDS_ACCESS_CODES.ChanTEDS, bytes(corrupted))
+        assert success == REPLY_FAIL and message
+        assert await connection.read_teds(1, TEDS_ACCESS_CODES.ChanTEDS) == image
+        connection.writer.close()
+        other.writer.close()
+    run_emulators(test)
@@ -0,0 +1,91 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Tests of the field values shown and edited in the editor tables, without PyQt, run with: python -m pytest
+
+import pytest
+
+from teds_field_values import NESTED_BLOCK_TEXT, is_optional_field, is_editable_field, is_nested_block_field, \
+    value_text, enum_items, enum_value, value_from_text, set_value_from_edit, include_state, set_include
+from teds_data_model import Meta_TEDS_Data_Block, TransducerChannel_TEDS_Data_Block
+
+@pytest.fixture
+def channel():
+    return TransducerChannel_TEDS_Data_Block.create()
+
+def test_value_text(channel):
+    assert value_text(channel.fields[0]) == "ChanTEDS"
+    assert value_text(channel.CalKey) == "CAL_NONE"
+    assert value_text(channel.PhyUnits) == NESTED_BLOCK_TEXT
+    assert value_text(channel.HiLimit) == channel.HiLimit.get_value_as_string()
+    # A value that is not a member of the enumeration is shown as the number
+    channel.CalKey.set_value(2)
+    assert value_text(channel.CalKey) == "2"
+
+def test_field_kinds(channel):
+    assert not is_editable_field(channel.fields[0])
+    assert not is_editable_field(channel.PhyUnits) and is_nested_block_field(channel.PhyUnits)
+    assert is_editable_field(channel.HiLimit) and not is_nested_block_field(channel.HiLimit)
+    assert is_optional_field(channel.MRange)
+    assert not is_optional_field(channel.HiLimit) and not is_optional_field(channel.fields[0])
+
+def test_enum_name_and_value(channel):
+    items = enum_items(channel.CalKey)
+    assert items[:2] == [("CAL_NONE", 0), ("CAL_SUPPLIED", 1)]
+    for name, value in items:
+        assert enum_value(channel.CalKey, name) == value
+        assert enum_value(channel.CalKey, value) == value
+    with pytest.raises(ValueError):
+        enum_value(channel.CalKey, 2)
+    with pytest.raises(ValueError):
+        enum_value(channel.CalKey, "CAL_UNKNOWN")
+    set_value_from_edit(channel.CalKey, "CAL_CUSTOM")
+    assert value_text(channel.CalKey) == "CAL_CUSTOM"
+    set_value_from_edit(channel.CalKey, 1)
+    assert channel.CalKey.get_value() == 1
+
+def test_scalar_text(channel):
+    set_value_from_edit(channel.HiLimit, " 9.5 ")
+    assert channel.HiLimit.get_value() == 9.5
+    with pytest.raises(ValueError):
+        value_from_text(channel.HiLimit, "high")
+
+# Lists are edited as shown, all their values are kept
+def test_list_text(channel):
+    field = channel.DAngles
+    assert value_from_text(field, field.get_value_as_string()) == field.get_value()
+    set_value_from_edit(field, "[1.5, -2.5]")
+    assert field.get_value() == [1.5, -2.5]
+    assert value_from_text(field, value_text(field)) == [1.5, -2.5]
+    field.include = True
+    loaded = TransducerChannel_TEDS_Data_Block.create()
+    loaded.load_from_bytearray(channel.to_bytes())
+    assert loaded.DAngles.get_value() == [1.5, -2.5]
+    for text in ("1.5", "[1.5]", "[1.5, 2.5, 3.5]", "[1.5, "):
+        with pytest.raises(ValueError):
+            value_from_text(field, text)
+    uuid = Meta_TEDS_Data_Block.create().uuid_field
+    set_value_from_edit(uuid, str(list(range(10))))
+    assert list(uuid.get_value()) == list(range(10))
+
+def test_include_state(channel):
+    assert include_state(channel.HiLimit) is None
+    assert include_state(channel.MRange) is False
+    length = channel.get_encoded_length()
+    assert set_include(channel.MRange, True)
+    assert include_state(channel.MRange) is True
+    assert channel.get_encoded_length() == length + channel.MRange.get_total_length()
+    assert set_include(channel.MRange, False)
+    assert channel.get_encoded_length() == length
+    assert not set_include(channel.HiLimit, False)
+    assert channel.get_encoded_length() == length
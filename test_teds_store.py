@@ -0,0 +1,73 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Tests of the content addressed TEDS store, run with: python -m pytest
+
+import glob
+import os
+
+import pytest
+
+from teds_store import TEDS_Content_Store, TEDS_Directory_Backend, content_key
+from teds_data_model import TransducerChannel_TEDS_Data_Block
+
+SAMPLE_FILES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "*.bin")))
+
+def make_channel(high):
+    teds_data_block = TransducerChannel_TEDS_Data_Block.create()
+    teds_data_block.HiLimit.set_value(high)
+    return teds_data_block
+
+@pytest.mark.parametrize("path", SAMPLE_FILES)
+def test_sample_round_trip(path):
+    with open(path, "rb") as fh:
+        image = fh.read()
+    store = TEDS_Content_Store()
+    key = store.save_image(image)
+    assert key == content_key(image)
+    assert store.get_image(key) == image
+    assert bytes(store.load(key).to_bytes()) == image
+
+# Identical images are stored once, images differing in one value share their nested blocks
+def test_dedup():
+    store = TEDS_Content_Store()
+    first = store.save(make_channel(1.0))
+    objects, stored_octets = store.objects, store.stored_octets
+    assert store.save(make_channel(1.0)) == first
+    assert (store.objects, store.stored_octets) == (objects, stored_octets)
+    second = store.save(make_channel(2.0))
+    assert second != first
+    # Only the top object is new, the nested blocks are referenced
+    assert store.objects == objects + 1
+    assert store.get_dedup_ratio() > 1.0
+    assert store.load(first, TransducerChannel_TEDS_Data_Block).HiLimit.get_value() == 1.0
+    assert store.load(second).HiLimit.get_value() == 2.0
+
+def test_directory_backend(tmp_path):
+    image = bytes(make_channel(3.0).to_bytes())
+    key = TEDS_Content_Store(TEDS_Directory_Backend(str(tmp_path))).save_image(image)
+    # A new store on the same directory reads the saved objects
+    store = TEDS_Content_Store(TEDS_Directory_Backend(str(tmp_path)))
+    assert key in store
+    assert store.get_image(key) == image
+    with pytest.raises(KeyError):
+        store.get_image(content_key(b"missing"))
+
+def test_corrupted_object_is_detected():
+    store = TEDS_Content_Store()
+    key = store.save(make_channel(4.0))
+    stored = bytearray(store.backend[key])
+    stored[-1] ^= 0xFF
+    store.backend[key] = bytes(stored)
+    with pytest.raises(ValueError):
+        store.get_image(key)
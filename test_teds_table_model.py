@@ -0,0 +1,113 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Tests of the editor table model, run headless with: python -m pytest
+# Skipped when PyQt5 is not installed
+
+import os
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+QtWidgets = pytest.importorskip("PyQt5.QtWidgets")
+from PyQt5 import QtCore
+
+from teds_data_model import TransducerChannel_TEDS_Data_Block
+from teds_table_model import TEDS_Table_Model, COLUMN_FIELD, COLUMN_VALUE, COLUMN_INCLUDE
+from teds_field_values import NESTED_BLOCK_TEXT
+
+@pytest.fixture(scope="module")
+def application():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+@pytest.fixture
+def model(application):
+    return TEDS_Table_Model(TransducerChannel_TEDS_Data_Block.create())
+
+def cell(model, name, column):
+    return model.index(model.teds_data_block.field_index_by_name(name), column)
+
+# Changed cells, from the dataChanged signal
+def watch_changes(model):
+    changed = []
+    model.dataChanged.connect(lambda first, last, roles=None: changed.append((first.row(), first.column())))
+    return changed
+
+def test_rows_show_the_fields(model):
+    teds_data_block = model.teds_data_block
+    assert model.rowCount() == len(teds_data_block.fields)
+    assert model.columnCount() == 3
+    assert model.data(model.index(0, COLUMN_VALUE)) == "ChanTEDS"
+    assert model.data(cell(model, "HiLimit", COLUMN_FIELD)) == teds_data_block.HiLimit.get_description()
+    assert model.data(cell(model, "HiLimit", COLUMN_VALUE)) == teds_data_block.HiLimit.get_value_as_string()
+    assert model.data(cell(model, "CalKey", COLUMN_VALUE)) == "CAL_NONE"
+    assert model.data(cell(model, "PhyUnits", COLUMN_VALUE)) == NESTED_BLOCK_TEXT
+
+def test_flags(model):
+    assert model.flags(cell(model, "HiLimit", COLUMN_VALUE)) & QtCore.Qt.ItemIsEditable
+    assert model.flags(cell(model, "CalKey", COLUMN_VALUE)) & QtCore.Qt.ItemIsEditable
+    assert not model.flags(cell(model, "HiLimit", COLUMN_FIELD)) & QtCore.Qt.ItemIsEditable
+    # Identification header and nested blocks are not edited in the cell
+    assert not model.flags(model.index(0, COLUMN_VALUE)) & QtCore.Qt.ItemIsEditable
+    assert not model.flags(cell(model, "PhyUnits", COLUMN_VALUE)) & QtCore.Qt.ItemIsEditable
+    assert model.flags(cell(model, "MRange", COLUMN_INCLUDE)) & QtCore.Qt.ItemIsUserCheckable
+    assert not model.flags(cell(model, "HiLimit", COLUMN_INCLUDE)) & QtCore.Qt.ItemIsUserCheckable
+
+def test_edit_commits_to_the_field(model):
+    changed = watch_changes(model)
+    index = cell(model, "HiLimit", COLUMN_VALUE)
+    assert model.setData(index, "9.5", QtCore.Qt.EditRole)
+    assert model.teds_data_block.HiLimit.get_value() == 9.5
+    assert model.data(index) == "9.5"
+    assert changed == [(index.row(), COLUMN_VALUE)]
+    # The edit reaches the encoded block
+    loaded = TransducerChannel_TEDS_Data_Block.create()
+    loaded.load_from_bytearray(model.teds_data_block.to_bytes())
+    assert loaded.HiLimit.get_value() == 9.5
+
+def test_enum_edit_commits_the_member_value(model):
+    index = cell(model, "CalKey", COLUMN_VALUE)
+    assert model.setData(index, 1, QtCore.Qt.EditRole)
+    assert model.teds_data_block.CalKey.get_value() == 1
+    assert model.data(index) == "CAL_SUPPLIED"
+
+def test_invalid_edit_is_rejected(model):
+    changed = watch_changes(model)
+    index = cell(model, "CalKey", COLUMN_VALUE)
+    assert not model.setData(index, 2, QtCore.Qt.EditRole)
+    assert model.teds_data_block.CalKey.get_value() == 0
+    assert changed == []
+
+def test_include_toggling(model):
+    field = model.teds_data_block.MRange
+    index = cell(model, "MRange", COLUMN_INCLUDE)
+    length = model.teds_data_block.get_encoded_length()
+    assert model.data(index, QtCore.Qt.CheckStateRole) == QtCore.Qt.Unchecked
+    assert model.setData(index, QtCore.Qt.Checked, QtCore.Qt.CheckStateRole)
+    assert field.include
+    assert model.data(index, QtCore.Qt.CheckStateRole) == QtCore.Qt.Checked
+    assert model.teds_data_block.get_encoded_length() == length + field.get_total_length()
+    assert model.setData(index, QtCore.Qt.Unchecked, QtCore.Qt.CheckStateRole)
+    assert not field.include
+    # Mandatory fields have no include check box
+    assert model.data(cell(model, "HiLimit", COLUMN_INCLUDE), QtCore.Qt.CheckStateRole) is None
+    assert not model.setData(cell(model, "HiLimit", COLUMN_INCLUDE), QtCore.Qt.Unchecked, QtCore.Qt.CheckStateRole)
+
+def test_set_teds_data_block_resets_the_rows(model):
+    resets = []
+    model.modelReset.connect(lambda: resets.append(True))
+    teds_data_block = TransducerChannel_TEDS_Data_Block.create()
+    teds_data_block.HiLimit.set_value(3.0)
+    model.set_teds_data_block(teds_data_block)
+    assert resets == [True]
+    assert model.data(cell(model, "HiLimit", COLUMN_VALUE)) == "3.0"
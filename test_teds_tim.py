@@ -0,0 +1,50 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Tests of the TIM container, run with: python -m pytest
+
+from teds_tim import TEDS_TIM, read_tim_channel
+from teds_data_model import TransducerChannel_TEDS_Data_Block
+
+def make_tim_image(count=3):
+    channels = [TransducerChannel_TEDS_Data_Block.create() for _ in range(count)]
+    for index, teds_data_block in enumerate(channels):
+        teds_data_block.HiLimit.set_value(float(index))
+    return bytes(TEDS_TIM(channels=channels).to_bytes())
+
+# Channels not accessed are written back from the loaded image
+def test_unchanged_tim_round_trip():
+    image = make_tim_image()
+    tim = TEDS_TIM.from_bytes(image)
+    assert bytes(tim.to_bytes()) == image
+    tim.get_channel(1)
+    assert bytes(tim.to_bytes()) == image
+
+# An edit of a loaded channel must survive every save, not only the first one
+def test_loaded_channel_edit_survives_saves():
+    tim = TEDS_TIM.from_bytes(make_tim_image())
+    tim.get_channel(1).HiLimit.set_value(9.0)
+    first = bytes(tim.to_bytes())
+    second = bytes(tim.to_bytes())
+    assert first == second
+    assert read_tim_channel(second, 1).HiLimit.get_value() == 9.0
+    assert read_tim_channel(second, 2).HiLimit.get_value() == 2.0
+
+# A channel edited after a save is written again
+def test_loaded_channel_edit_after_save():
+    tim = TEDS_TIM.from_bytes(make_tim_image())
+    teds_data_block = tim.get_channel(0)
+    tim.to_bytes()
+    teds_data_block.HiLimit.set_value(5.0)
+    tim.to_bytes()
+    assert read_tim_channel(tim.to_bytes(), 0).HiLimit.get_value() == 5.0
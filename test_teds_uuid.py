@@ -0,0 +1,74 @@
+# *****************************************************************************************
+# *    Copyright 2022 by Digital and Intelligent Industry Lab (DIGI2), systecfof@fe.up.pt *
+# *    You may use, edit, run or distribute this file                                     *
+# *    as long as the above copyright notice remains                                      *
+# * THIS SOFTWARE IS PROVIDED "AS IS".  NO WARRANTIES, WHETHER EXPRESS, IMPLIED           *
+# * OR STATUTORY, INCLUDING, BUT NOT LIMITED TO, IMPLIED WARRANTIES OF                    *
+# * MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE APPLY TO THIS SOFTWARE.          *
+# * DIGI2 Lab SHALL NOT, IN ANY CIRCUMSTANCES, BE LIABLE FOR SPECIAL, INCIDENTAL,         *
+# * OR CONSEQUENTIAL DAMAGES, FOR ANY REASON WHATSOEVER.                                  *
+# * For more information about the lab, see:                                              *
+# * http://digi2.fe.up.pt                                                                 *
+# *****************************************************************************************
+
+# Tests of the TEDS UUID packing and generators, run with: python -m pytest
+
+import datetime
+
+import pytest
+
+from teds_uuid import TEDS_UUID_Generator, TIME_BITS, MAX_TIME, location_bits, pack_uuids, unpack_uuid, \
+    uuid_time, make_uuid
+
+# Latitude, longitude, manufacturer, year, time and the UUID, checked bit by bit against the layout
+VECTORS = [
+    (0.0, 0.0, 0, 0, 0, "80000400000000000000"),
+    (41.178, -8.598, 3, 2022, 1234567, "9218881e3a4df992d687"),
+    (-90.0, 180.0, 15, 4095, MAX_TIME, "278d0678d03fffffffff"),
+    (-33.8568, 151.2153, 0, 2024, 0, "0ee0e6139dc1fa000000"),
+]
+
+@pytest.mark.parametrize("latitude, longitude, manufacturer, year, time, expected", VECTORS)
+def test_pack_and_unpack(latitude, longitude, manufacturer, year, time, expected):
+    octets = pack_uuids(location_bits(latitude, longitude), manufacturer, year, time)
+    assert octets.shape == (1, 10)
+    assert octets[0].tobytes().hex() == expected
+    fields = unpack_uuid(bytes.fromhex(expected))
+    # Location is stored in arcseconds
+    assert fields["latitude"] == pytest.approx(latitude, abs=1 / 3600)
+    assert fields["longitude"] == pytest.approx(longitude, abs=1 / 3600)
+    assert (fields["manufacturer"], fields["year"], fields["time"]) == (manufacturer, year, time)
+
+def test_pack_arrays_match_scalars():
+    latitudes = [vector[0] for vector in VECTORS]
+    longitudes = [vector[1] for vector in VECTORS]
+    octets = pack_uuids(location_bits(latitudes, longitudes), [vector[2] for vector in VECTORS],
+        [vector[3] for vector in VECTORS], [vector[4] for vector in VECTORS])
+    assert [row.tobytes().hex() for row in octets] == [vector[5] for vector in VECTORS]
+
+def test_out_of_range_fields():
+    with pytest.raises(ValueError):
+        location_bits(91.0, 0.0)
+    with pytest.raises(ValueError):
+        pack_uuids(0, 16, 0, 0)
+    with pytest.raises(ValueError):
+        pack_uuids(0, 0, 0, MAX_TIME + 1)
+
+def test_make_uuid():
+    date = datetime.datetime(2022, 7, 3, 0, 12, 17, tzinfo=datetime.timezone.utc)
+    assert uuid_time(date) == 1581193
+    # North and West positive
+    assert make_uuid(41.178, 8.598, 1, date=date).hex() == "9218881e3a45f9982089"
+
+# UUIDs made in the same ten seconds use the following time values, also after the last ten seconds of the year
+def test_generator_sequence(tmp_path):
+    date = datetime.datetime(2022, 12, 31, 23, 59, 50, tzinfo=datetime.timezone.utc)
+    path = str(tmp_path / "sequence.json")
+    first = TEDS_UUID_Generator(41.178, -8.598, 3, path).generate_batch(2, date)
+    # A second generator on the same sequence file continues after the first one
+    second = TEDS_UUID_Generator(41.178, -8.598, 3, path).generate(date)
+    fields = [unpack_uuid(octets) for octets in list(first) + [second]]
+    clocks = [(field["year"] << TIME_BITS) | field["time"] for field in fields]
+    assert clocks == [clocks[0], clocks[0] + 1, clocks[0] + 2]
+    assert (fields[0]["year"], fields[0]["time"]) == (2022, uuid_time(date))
+    assert (fields[2]["year"], fields[2]["time"]) == (2022, uuid_time(date) + 2)